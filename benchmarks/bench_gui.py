@@ -0,0 +1,270 @@
+"""ブラウズタブとポーション確認タブの速度を、実際のウィジェットを画面無しで動かして測る
+
+使い方:
+    python benchmarks/bench_gui.py [--sizes 200 1000] [--update-baseline]
+
+ポーション数ごとにライブラリを生成し、別プロセスで QT_QPA_PLATFORM=offscreen のビューアを起動して
+読み込み時間、最初の描画までの時間、グリッドの作り直し、リサイズ時の再配置、クリック 1 回の時間、
+ポーション確認タブの表示と参照強度の再計算、最大メモリ使用量を測る。
+gui_baseline.json の値より tolerance の割合以上（かつ min_abs 以上）遅くなった項目があれば終了コード 1 を返す。
+
+基準値はマシンごとに違うのでリポジトリには含めない。gui_baseline.json が無ければ初回の結果をそのまま
+基準値として保存する（--update-baseline で作り直せる）。基準値には測ったマシンと Qt の環境を記録しておき、
+今の環境と違う場合は比較を参考として表示するだけにして失敗にはしない。
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gui_baseline.json")
+DEFAULT_SIZES = [200, 1000]
+# ポーション確認タブで表示する参照の数
+REFERENCES = 16
+# 比較の既定値。指標ごとの最小差（秒・ミリ秒・MB）を超えない揺れは無視する
+DEFAULT_TOLERANCE = 0.5
+DEFAULT_MIN_ABS = {
+    "scan_s": 0.2, "rescan_s": 0.2, "first_paint_s": 0.2, "grid_rebuild_s": 0.05, "reflow_s": 0.05,
+    "click_ms": 5, "potion_drop_ms": 20, "strength_edit_ms": 5, "peak_rss_mb": 50,
+}
+
+
+def generate_library(directory, count):
+    """サムネイル付き（5 件に 1 件は無し）のポーションを count 件作り、参照に使う encoding を返す"""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    os.makedirs(directory, exist_ok=True)
+    references = []
+    for i in range(count):
+        img = Image.fromarray(rng.integers(0, 255, (256, 192, 3), dtype=np.uint8))
+        buffer = io.BytesIO()
+        img.save(buffer, "PNG")
+        encodings = {}
+        for version_key in ("v4-5full", "v4full"):
+            encodings[version_key] = {}
+            for info_extracted in (1, 0.5):
+                enc = base64.b64encode(rng.standard_normal(256).astype("<f2").tobytes()).decode()
+                encodings[version_key][f"{version_key}-{i}-{info_extracted}"] = {
+                    "encoding": enc, "params": {"information_extracted": info_extracted}}
+        references.append(encodings["v4-5full"][f"v4-5full-{i}-1"]["encoding"])
+        data = {
+            "identifier": "novelai-vibe-transfer", "version": 1, "type": "image", "id": str(i),
+            "encodings": encodings, "name": f"potion_{i:05d}",
+            "thumbnail": "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode() if i % 5 else None,
+            "importInfo": {"model": "nai-diffusion-4-5-full", "information_extracted": 1, "strength": 0.6},
+        }
+        with open(os.path.join(directory, f"potion_{i:05d}.naiv4vibe"), "w") as f:
+            json.dump(data, f, indent=2)
+    return references[:REFERENCES]
+
+
+def generate_image(path, references):
+    """references を参照に使った生成画像（Comment にメタデータを持つ PNG）を作る"""
+    from PIL import Image, PngImagePlugin
+
+    comment = json.dumps({
+        "prompt": "benchmark",
+        "reference_image_multiple": references,
+        "reference_strength_multiple": [round(0.1 + 0.05 * i, 2) for i in range(len(references))],
+    })
+    info = PngImagePlugin.PngInfo()
+    info.add_text("Comment", comment)
+    Image.new("RGBA", (832, 1216), (30, 60, 90, 255)).save(path, pnginfo=info)
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 1024 / 1024
+        except (ImportError, AttributeError):
+            return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def run_child(workdir, library, image_path):
+    """ビューアを起動して各指標を測り、dict で返す（ベンチマーク用の子プロセスで呼ぶ）"""
+    os.environ["QT_QPA_PLATFORM"] = "offscreen"
+    os.chdir(workdir)
+    with open("config.json", "w") as f:
+        json.dump({
+            "version": "v4.5", "thumbnail_size": 128, "directories": [], "sort_order": "name_asc",
+            "window_width": 1200, "window_height": 800, "show_images_without_thumbnails": False,
+        }, f)
+
+    from PyQt6.QtCore import QEvent, QObject, Qt, QPoint
+    from PyQt6.QtTest import QTest
+    from PyQt6.QtWidgets import QApplication
+
+    import main
+    import browse_tab_widget
+
+    class PaintProbe(QObject):
+        def __init__(self):
+            super().__init__()
+            self.painted_at = None
+
+        def eventFilter(self, obj, event):
+            if (self.painted_at is None and event.type() == QEvent.Type.Paint
+                    and isinstance(obj, browse_tab_widget.ThumbnailWidget)):
+                self.painted_at = time.perf_counter()
+            return False
+
+    def timed(func, repeat=1):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            app.processEvents()
+            samples.append(time.perf_counter() - start)
+        return statistics.median(samples)
+
+    app = QApplication([])
+    probe = PaintProbe()
+    app.installEventFilter(probe)
+    viewer = main.Naiv4VibeViewer()
+    viewer.show()
+    app.processEvents()
+    viewer.directories = [library]
+    results = {}
+
+    start = time.perf_counter()
+    viewer.load_files()
+    results["scan_s"] = time.perf_counter() - start
+    deadline = time.perf_counter() + 10
+    while probe.painted_at is None and time.perf_counter() < deadline:
+        app.processEvents()
+    results["first_paint_s"] = (probe.painted_at or time.perf_counter()) - start
+
+    results["rescan_s"] = timed(viewer.load_files)
+    browse = viewer.browse_tab
+    results["grid_rebuild_s"] = timed(browse.set_view, repeat=3)
+    widths = iter([900, 1200] * 2)
+    results["reflow_s"] = timed(lambda: viewer.resize(next(widths), 800), repeat=4)
+
+    thumbnails = browse.thumbnails[:20]
+    clicks = []
+    for widget in thumbnails:
+        start = time.perf_counter()
+        # Ctrl+クリックならドラッグを始めずに、選択とスタイルの更新と詳細表示だけが走る
+        QTest.mouseClick(widget.thumbnail, Qt.MouseButton.LeftButton, Qt.KeyboardModifier.ControlModifier, QPoint(5, 5))
+        app.processEvents()
+        clicks.append(time.perf_counter() - start)
+    results["click_ms"] = statistics.median(clicks) * 1000 if clicks else None
+
+    potion_tab = viewer.potion_tab
+    viewer.tabs.setCurrentWidget(potion_tab)
+    results["potion_drop_ms"] = timed(lambda: potion_tab.handle_dropped_image(image_path)) * 1000
+    edits = []
+    if potion_tab.thumbnail_widgets:
+        strength_input = potion_tab.thumbnail_widgets[0].strength_input
+        for text in ("0.3", "0.45", "0.5", "0.25", "0.4"):
+            edits.append(timed(lambda: strength_input.setText(text)))
+    results["strength_edit_ms"] = statistics.median(edits) * 1000 if edits else None
+
+    results["peak_rss_mb"] = peak_rss_mb()
+    viewer.close()
+    return results
+
+
+def machine_info():
+    """基準値を測った環境として記録する項目"""
+    from PyQt6.QtCore import QT_VERSION_STR
+
+    return {
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "qt": QT_VERSION_STR,
+        "qt_platform": "offscreen",
+    }
+
+
+def compare(results, baseline):
+    """基準値より遅くなった項目を [(サイズ, 指標, 基準値, 今回の値), ...] で返す"""
+    tolerance = baseline.get("tolerance", DEFAULT_TOLERANCE)
+    min_abs = {**DEFAULT_MIN_ABS, **baseline.get("min_abs", {})}
+    regressions = []
+    for size, metrics in results.items():
+        for metric, value in metrics.items():
+            base = baseline.get("results", {}).get(size, {}).get(metric)
+            if value is None or base is None:
+                continue
+            if value > base * (1 + tolerance) and value - base > min_abs.get(metric, 0):
+                regressions.append((size, metric, base, value))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--update-baseline", action="store_true", help="今回の結果を基準値として保存する")
+    parser.add_argument("--child", nargs=3, metavar=("WORKDIR", "LIBRARY", "IMAGE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(*args.child)))
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            workdir = os.path.join(tmp, f"run_{size}")
+            library = os.path.join(tmp, f"library_{size}")
+            image_path = os.path.join(tmp, f"image_{size}.png")
+            os.makedirs(workdir)
+            generate_image(image_path, generate_library(library, size))
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", workdir, library, image_path],
+                cwd=ROOT, capture_output=True, text=True, check=True
+            ).stdout
+            results[str(size)] = json.loads(output.strip().splitlines()[-1])
+
+    metrics = list(next(iter(results.values())))
+    print(f"{'metric':<20}" + "".join(f"{size:>12}" for size in results))
+    for metric in metrics:
+        values = [results[size][metric] for size in results]
+        print(f"{metric:<20}" + "".join(f"{value:>12.3f}" if value is not None else f"{'-':>12}" for value in values))
+
+    machine = machine_info()
+    if args.update_baseline or not os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE, "w") as f:
+            json.dump({"machine": machine, "tolerance": DEFAULT_TOLERANCE, "min_abs": DEFAULT_MIN_ABS,
+                       "results": results}, f, indent=2)
+        print(f"基準値を保存しました: {BASELINE_FILE}")
+        return
+
+    with open(BASELINE_FILE) as f:
+        baseline = json.load(f)
+    # 別の環境で測った基準値との比較は当てにならないので、参考として表示するだけにする
+    advisory = baseline.get("machine") != machine
+    if advisory:
+        print("基準値は別の環境で測ったものなので、比較は参考です（--update-baseline で手元の基準値を作れます）")
+    regressions = compare(results, baseline)
+    for size, metric, base, value in regressions:
+        print(f"[遅くなっています] {size} 件 {metric}: {base:.3f} -> {value:.3f}")
+    if regressions and not advisory:
+        sys.exit(1)
+    if not regressions:
+        print("基準値からの悪化はありません")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""ポーションファイルの JSON 読み書きの速度を、標準の json と orjson で比較する
+
+使い方:
+    python benchmarks/bench_json_backend.py <ポーションのフォルダ> [--repeat 3]
+
+ファイルの内容はあらかじめメモリに読み込んでおき、パースと書き出しの時間だけを測る。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json_backend  # noqa: E402
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def load_samples(directory):
+    samples = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".naiv4vibe"):
+            with open(os.path.join(directory, filename), 'rb') as f:
+                samples.append(f.read())
+    return samples
+
+
+def best_of(repeat, func, samples):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for sample in samples:
+            func(sample)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    samples = load_samples(args.directory)
+    if not samples:
+        sys.exit("ポーションファイルが見つかりません")
+    total_mb = sum(len(sample) for sample in samples) / 1024 / 1024
+    objects = [json.loads(sample) for sample in samples]
+    print(f"{len(samples)} files, {total_mb:.1f} MB")
+
+    cases = [
+        ("json.loads(str)", lambda b: json.loads(b.decode('utf-8')), samples),
+        ("json.loads(bytes)", json.loads, samples),
+        ("json.dumps(indent=2)", lambda o: json.dumps(o, indent=2), objects),
+        ("json.dumps(compact)", lambda o: json.dumps(o, separators=(',', ':')), objects),
+    ]
+    if orjson:
+        cases += [
+            ("orjson.loads(bytes)", orjson.loads, samples),
+            ("orjson.dumps(indent=2)", lambda o: orjson.dumps(o, option=orjson.OPT_INDENT_2), objects),
+            ("orjson.dumps(compact)", orjson.dumps, objects),
+        ]
+    cases.append((f"json_backend.loads ({json_backend.BACKEND})", json_backend.loads, samples))
+    if not orjson:
+        print("orjson がインストールされていないため、標準の json だけを測定します")
+
+    results = {}
+    for name, func, inputs in cases:
+        results[name] = best_of(args.repeat, func, inputs)
+
+    baseline = {"loads": results["json.loads(str)"], "dumps": results["json.dumps(indent=2)"]}
+    print(f"{'case':<32}{'total [s]':>12}{'per file [ms]':>16}{'MB/s':>10}{'speedup':>10}")
+    for name, elapsed in results.items():
+        base = baseline["loads"] if "loads" in name else baseline["dumps"]
+        print(
+            f"{name:<32}{elapsed:>12.3f}{elapsed / len(samples) * 1000:>16.3f}"
+            f"{total_mb / elapsed:>10.1f}{base / elapsed:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
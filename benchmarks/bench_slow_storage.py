@@ -0,0 +1,110 @@
+"""遅いストレージを再現して、ReadScheduler の並行数ごとの読み込み速度を測る
+
+使い方:
+    python benchmarks/bench_slow_storage.py [<ポーションのフォルダ>] [--latency 0 5 20 50] [--concurrency 1 4 16 32]
+        [--failure-rate 0.05] [--stall 1] [--timeout 2]
+
+フォルダを省略すると、サムネイル付きのポーションを --count 件生成して使う。
+LatencyFileSystem で 1 回の読み込みごとに --latency ミリ秒の待ち時間を入れ、並行数 1（従来の 1 件ずつの読み込みと同じ）と
+比べた 1 秒あたりのファイル数を表にする。--failure-rate で一時的なエラーを、--stall で止まったままのファイルを混ぜると、
+リトライとタイムアウトで飛ばした件数も表示する。
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from io_scheduler import LatencyFileSystem, ReadScheduler, ReadTimeout  # noqa: E402
+
+DEFAULT_LATENCIES = [0, 5, 20, 50]
+DEFAULT_CONCURRENCY = [1, 4, 16, 32]
+
+
+def generate_library(directory, count):
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    for i in range(count):
+        img = Image.fromarray(rng.integers(0, 255, (128, 96, 3), dtype=np.uint8))
+        buffer = io.BytesIO()
+        img.save(buffer, "PNG")
+        enc = base64.b64encode(rng.standard_normal(1024).astype("<f2").tobytes()).decode()
+        data = {
+            "identifier": "novelai-vibe-transfer", "version": 1, "type": "image", "id": str(i),
+            "encodings": {"v4-5full": {"x": {"encoding": enc, "params": {"information_extracted": 1}}}},
+            "name": f"potion_{i:05d}",
+            "thumbnail": "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode(),
+        }
+        with open(os.path.join(directory, f"potion_{i:05d}.naiv4vibe"), "w") as f:
+            json.dump(data, f)
+
+
+def run(filepaths, fs, concurrency, timeout):
+    """(秒, 読めたバイト数, タイムアウトの件数, エラーの件数) を返す"""
+    scheduler = ReadScheduler(fs, concurrency=concurrency, timeout=timeout, retry_delay=0.01)
+    start = time.perf_counter()
+    total = timeouts = errors = 0
+    for _, raw, error in scheduler.read_all(filepaths):
+        if isinstance(error, ReadTimeout):
+            timeouts += 1
+        elif error is not None:
+            errors += 1
+        else:
+            total += len(raw)
+    return time.perf_counter() - start, total, timeouts, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory", nargs="?")
+    parser.add_argument("--count", type=int, default=300, help="フォルダを省略したときに生成するポーションの数")
+    parser.add_argument("--latency", type=float, nargs="+", default=DEFAULT_LATENCIES, help="1 回の読み込みの待ち時間（ミリ秒）")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="一時的な I/O エラーを起こす割合")
+    parser.add_argument("--stall", type=int, default=0, help="読み込みが止まったままになるファイルの数")
+    parser.add_argument("--timeout", type=float, default=2.0, help="1 回の読み込みのタイムアウト（秒）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.directory
+        if directory is None:
+            directory = tmp
+            generate_library(directory, args.count)
+        filepaths = [
+            os.path.join(directory, filename) for filename in sorted(os.listdir(directory))
+            if filename.endswith(".naiv4vibe")
+        ]
+        if not filepaths:
+            sys.exit("ポーションファイルが見つかりません")
+        stall = filepaths[len(filepaths) // 2:len(filepaths) // 2 + args.stall]
+
+        print(f"{len(filepaths)} ファイル、1 秒あたりのファイル数（カッコ内は並行数 1 との比）")
+        print(f"{'latency':>10}" + "".join(f"{f'x{concurrency}':>18}" for concurrency in args.concurrency))
+        skipped = []
+        for latency in args.latency:
+            row = f"{f'{latency:g}ms':>10}"
+            base = None
+            for concurrency in args.concurrency:
+                fs = LatencyFileSystem(latency=latency / 1000, failure_rate=args.failure_rate, stall=stall)
+                elapsed, total, timeouts, errors = run(filepaths, fs, concurrency, args.timeout)
+                fs.release()
+                rate = len(filepaths) / elapsed
+                base = base or rate
+                row += f"{f'{rate:.0f} ({rate / base:.1f}x)':>18}"
+                skipped.append((latency, concurrency, timeouts, errors))
+            print(row)
+
+        if args.failure_rate or args.stall:
+            print("\nタイムアウトで飛ばした件数 / リトライしても読めなかった件数")
+            for latency, concurrency, timeouts, errors in skipped:
+                print(f"  {latency:g}ms x{concurrency}: {timeouts} / {errors}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,37 @@
 import os
-import json
+import json_backend
 from PyQt6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QScrollArea, QLabel, QLineEdit, QSizePolicy, QGridLayout, QMessageBox,
-    QInputDialog, QComboBox, QMenu, QFrame, QPushButton
+    QInputDialog, QComboBox, QMenu, QFrame, QPushButton, QToolButton, QDialog, QSpinBox, QListWidget,
+    QDialogButtonBox
 )
-from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QPixmap, QMouseEvent, QShortcut, QKeySequence, QDoubleValidator
+from PyQt6.QtCore import Qt, QThreadPool
+from PyQt6.QtGui import QPixmap, QShortcut, QKeySequence, QDoubleValidator, QDragEnterEvent, QDropEvent
 from datetime import datetime
 import utils
-from send2trash import send2trash
+import potion_bundle
+from facet_index import FacetIndex
+from encoding_index import VERSION_LABELS
 from collections import OrderedDict
+from detail_image_loader import DETAIL_SIZE, DetailImageSignals, DetailImageTask
+from file_operations import OperationError, plan_renames, plan_moves
+from file_operation_task import RENAME, MOVE, TRASH
+
+# ドロップするとサムネイルが近いポーションを探す画像
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".webp")
+
+# 一括名前変更のプレビューに並べる件数
+PREVIEW_LIMIT = 200
+# 詳細表示用に読み込んだサムネイルをいくつまで覚えておくか
+DETAIL_CACHE_SIZE = 64
+# 絞り込みに使うファセット（キー, 表示名）
+FACETS = [
+    ("version", "バージョン"),
+    ("info_extracted", "情報抽出度"),
+    ("thumbnail", "サムネイル"),
+    ("model", "読み込みモデル"),
+    ("strength", "読み込み参照強度"),
+]
 
 
 def insert_linebreaks(text: str, max_chars_per_line: int = 10) -> str:
@@ -17,6 +39,63 @@ def insert_linebreaks(text: str, max_chars_per_line: int = 10) -> str:
     return '\n'.join(text[i:i+max_chars_per_line] for i in range(0, len(text), max_chars_per_line))
 
 
+class BulkRenameDialog(QDialog):
+    """選択したポーションの名前を、書式と連番でまとめて付け直す"""
+
+    def __init__(self, paths, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(f"名前の変更（{len(paths)} 個）")
+        self.resize(600, 450)
+        self.paths = paths
+        self.pairs = []
+
+        self.template = QLineEdit("{name}_{n:03}")
+        self.template.textChanged.connect(self.update_preview)
+        self.start = QSpinBox()
+        self.start.setRange(0, 999999)
+        self.start.setValue(1)
+        self.start.valueChanged.connect(self.update_preview)
+
+        form_layout = QHBoxLayout()
+        form_layout.addWidget(QLabel("名前："))
+        form_layout.addWidget(self.template, 1)
+        form_layout.addWidget(QLabel("連番の開始："))
+        form_layout.addWidget(self.start)
+
+        help_label = QLabel("{name} は元の名前、{n} は連番に置き換わります（{n:03} で 3 桁のゼロ埋め）。")
+        help_label.setWordWrap(True)
+        self.error_label = QLabel("")
+        self.error_label.setStyleSheet("color: red;")
+        self.preview = QListWidget()
+
+        self.buttons = QDialogButtonBox(
+            QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel)
+        self.buttons.accepted.connect(self.accept)
+        self.buttons.rejected.connect(self.reject)
+
+        layout = QVBoxLayout(self)
+        layout.addLayout(form_layout)
+        layout.addWidget(help_label)
+        layout.addWidget(self.error_label)
+        layout.addWidget(self.preview)
+        layout.addWidget(self.buttons)
+        self.update_preview()
+
+    def update_preview(self):
+        self.preview.clear()
+        try:
+            self.pairs = plan_renames(self.paths, self.template.text(), self.start.value())
+            self.error_label.setText("")
+        except OperationError as e:
+            self.pairs = []
+            self.error_label.setText(str(e))
+        for old, new in self.pairs[:PREVIEW_LIMIT]:
+            self.preview.addItem(f"{os.path.basename(old)} → {os.path.basename(new)}")
+        if len(self.pairs) > PREVIEW_LIMIT:
+            self.preview.addItem(f"ほか {len(self.pairs) - PREVIEW_LIMIT} 個")
+        self.buttons.button(QDialogButtonBox.StandardButton.Ok).setEnabled(bool(self.pairs))
+
+
 class ClickableThumbnail(utils.ClickableThumbnail):
     def __init__(
             self, pixmap: QPixmap, fullpath: str, mtime: str, info_extracted: str,
@@ -25,76 +104,79 @@ class ClickableThumbnail(utils.ClickableThumbnail):
         super().__init__(pixmap, fullpath, mtime, info_extracted, thumbnail_size, parent=parent)
         self.filename = os.path.basename(self.fullpath)
         self.importinfo = importinfo
+        # バンドル内のポーションは読み取り専用
+        self.read_only = potion_bundle.split_bundle_path(self.fullpath) is not None
 
     def contextMenuEvent(self, event):
         menu = QMenu(self)
-
-        rename_action = menu.addAction("名前の変更")
-        delete_action = menu.addAction("削除")
+        main_window = self.parent.main_window
+        # 選択中のものを右クリックした場合は、選択中のすべてが対象になる
+        paths = self.drag_paths()
+        writable = not any(potion_bundle.split_bundle_path(path) for path in paths)
+        count = f"（{len(paths)} 個）" if len(paths) > 1 else ""
+
+        rename_action = menu.addAction("名前の変更" + count)
+        delete_action = menu.addAction("削除" + count)
+        move_menu = menu.addMenu("別のフォルダへ移動" + count)
+        move_actions = {}
+        for directory in main_window.directories:
+            if not potion_bundle.is_bundle(directory):
+                move_actions[move_menu.addAction(directory)] = directory
         open_folder_action = menu.addAction("ファイルの場所を開く")
+        similar_action = menu.addAction("似ているポーション")
+        menu.addSeparator()
+        undo_action = menu.addAction(self.parent.undo_text())
+        rename_action.setEnabled(writable)
+        delete_action.setEnabled(writable)
+        move_menu.setEnabled(writable and bool(move_actions))
+        undo_action.setEnabled(bool(main_window.undo_stack))
 
         action = menu.exec(event.globalPos())
 
         if action == rename_action:
-            self.rename_file()
+            self.rename_file(paths)
         elif action == delete_action:
-            self.delete_file()
+            self.delete_file(paths)
+        elif action in move_actions:
+            main_window.run_file_operation(MOVE, plan_moves(paths, move_actions[action]))
         elif action == open_folder_action:
             self.open_in_explorer()
+        elif action == similar_action:
+            main_window.find_similar(self.fullpath)
+        elif action == undo_action:
+            main_window.undo_file_operation()
+
+    def rename_file(self, paths):
+        if len(paths) > 1:
+            dialog = BulkRenameDialog(paths, self)
+            if dialog.exec():
+                self.parent.main_window.run_file_operation(RENAME, dialog.pairs)
+            return
 
-    def rename_file(self):
         base_name = os.path.splitext(self.filename)[0]
         new_name, ok = QInputDialog.getText(self, "名前の変更", "新しい名前を入力してください：", text=base_name)
         if ok and new_name:
-            new_filename = new_name + ".naiv4vibe"
-            new_path = os.path.join(os.path.dirname(self.fullpath), new_filename)
-
-            if os.path.exists(new_path):
-                QMessageBox.critical(self, "エラー", "同名のファイルが既に存在します。")
-                return
-
             try:
-                os.rename(self.fullpath, new_path)
-                self.fullpath = new_path
-                self.filename = new_filename
-                self.parent.main_window.load_files()
-
-            except Exception as e:
-                QMessageBox.critical(self, "エラー", f"名前の変更に失敗しました：{str(e)}")
+                # 書式の { } がそのまま名前に入るよう、エスケープしてから渡す
+                pairs = plan_renames([self.fullpath], new_name.replace("{", "{{").replace("}", "}}"))
+            except OperationError as e:
+                QMessageBox.critical(self, "エラー", str(e))
+                return
+            self.parent.main_window.run_file_operation(RENAME, pairs)
 
-    def delete_file(self):
+    def delete_file(self, paths):
+        target = self.filename if len(paths) == 1 else f"{len(paths)} 個のポーション"
         reply = QMessageBox.question(
-            self, "確認", f"{self.filename} をゴミ箱に移動しますか？",
+            self, "確認", f"{target} をゴミ箱に移動しますか？",
             QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
         )
         if reply == QMessageBox.StandardButton.Yes:
-            try:
-                abs_path = os.path.abspath(self.fullpath)
-                if not os.path.exists(abs_path):
-                    raise FileNotFoundError(f"ファイルが存在しません: {abs_path}")
-                send2trash(abs_path)
-
-                self.parent.main_window.load_files()
-            except Exception as e:
-                QMessageBox.critical(self, "エラー", f"削除に失敗しました：{str(e)}")
-
-    def mousePressEvent(self, event: QMouseEvent):
-        if self.clicked_callback:
-            self.clicked_callback(self)
-        self.selected = True
-        self.update_style()
-        if event.button() == Qt.MouseButton.LeftButton and self.fullpath:
-            self.leftclick(event)
-        else:
-            event.accept()  # Right Click
-        self.parent.update_detail_from_thumbnail(self)
+            self.parent.main_window.run_file_operation(TRASH, paths)
 
     def set_importinfo(self, importinfo):
-        with open(self.fullpath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = json_backend.read_json(self.fullpath)
         data["importInfo"] = importinfo
-        with open(self.fullpath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2)
+        json_backend.write_json(self.fullpath, data)
 
 
 class ThumbnailWidget(utils.ThumbnailWidget):
@@ -120,6 +202,16 @@ class BrowseTabWidget(QWidget):
         self.items = []
         self.thumbnails = []
         self.current_selection = None
+        self.selection_model = utils.SelectionModel(on_current_changed=self.on_current_changed)
+        self.detail_cache = OrderedDict()  # path -> 詳細表示用の QPixmap（サムネイルが無いものは None）、古い順
+        self.detail_pool = QThreadPool(self)
+        self.detail_pool.setMaxThreadCount(1)
+        self.detail_signals = DetailImageSignals(self)
+        self.detail_signals.loaded.connect(self.on_detail_loaded)
+        self.detail_signals.failed.connect(self.on_detail_failed)
+        self.columns = 1
+        self.setFocusPolicy(Qt.FocusPolicy.StrongFocus)
+        self.setAcceptDrops(True)
         self.outer_layout = QVBoxLayout(self)
 
         self.search_query = ""
@@ -129,8 +221,40 @@ class BrowseTabWidget(QWidget):
         shortcut = QShortcut(QKeySequence("Ctrl+F"), self)
         shortcut.setContext(Qt.ShortcutContext.ApplicationShortcut)
         shortcut.activated.connect(self.focus_search_box)
+        undo_shortcut = QShortcut(QKeySequence.StandardKey.Undo, self)
+        undo_shortcut.activated.connect(self.main_window.undo_file_operation)
         self.outer_layout.addWidget(self.search_box)
 
+        self.facet_index = FacetIndex()
+        self.facet_filters = {}  # facet -> 選択された値の set
+        self.facet_buttons = {}
+        facet_layout = QHBoxLayout()
+        for facet, label in FACETS:
+            button = QToolButton()
+            button.setText(label)
+            button.setPopupMode(QToolButton.ToolButtonPopupMode.InstantPopup)
+            button.setMenu(QMenu(button))
+            self.facet_buttons[facet] = button
+            facet_layout.addWidget(button)
+        clear_button = QPushButton("絞り込み解除")
+        clear_button.clicked.connect(self.clear_facet_filters)
+        facet_layout.addWidget(clear_button)
+        facet_layout.addStretch()
+        self.outer_layout.addLayout(facet_layout)
+
+        self.ranking = None  # [(filepath, 類似度), ...]
+        self.ranking_bar = QWidget()
+        ranking_layout = QHBoxLayout(self.ranking_bar)
+        ranking_layout.setContentsMargins(0, 0, 0, 0)
+        self.ranking_label = QLabel()
+        ranking_layout.addWidget(self.ranking_label)
+        ranking_clear_button = QPushButton("解除")
+        ranking_clear_button.clicked.connect(self.clear_ranking)
+        ranking_layout.addWidget(ranking_clear_button)
+        ranking_layout.addStretch()
+        self.ranking_bar.hide()
+        self.outer_layout.addWidget(self.ranking_bar)
+
         self.main_layout = QHBoxLayout()
         self.outer_layout.addLayout(self.main_layout)
 
@@ -244,10 +368,13 @@ class BrowseTabWidget(QWidget):
             if widget:
                 self.grid_layout.removeWidget(widget)
         self.thumbnails = []
+        self.selection_model.clear()
 
     def reset_registrated_thumbnails(self):
         self.clear_grid()
         self.items = []
+        self.detail_cache.clear()
+        self.facet_index = FacetIndex()
 
     @property
     def has_thumbnails(self):
@@ -275,19 +402,116 @@ class BrowseTabWidget(QWidget):
         else:
             raise NotImplementedError("The sort order is not implemented.")
 
-    def register_thumbnail(self, pixmap, filepath, mtime, info, importinfo, no_thumb):
+    def register_thumbnail(self, pixmap, filepath, mtime, info, importinfo, no_thumb, versions=()):
         thumb_info = (pixmap, filepath, mtime, info, importinfo, no_thumb)
         self.items.append(thumb_info)
 
+        strength = importinfo.get("strength")
+        self.facet_index.add(filepath, {
+            "version": versions,
+            "info_extracted": info.split(", ") if info else ["なし"],
+            "thumbnail": ["なし" if no_thumb else "あり"],
+            "model": [importinfo.get("model", "未設定")],
+            "strength": [f"{strength:g}" if isinstance(strength, (int, float)) else "未設定"],
+        })
+
+    def update_facet_menus(self):
+        """読み込んだポーションに合わせて絞り込みメニューの選択肢を作り直す"""
+        for facet, label in FACETS:
+            values = self.facet_index.values(facet)
+            selected = self.facet_filters.get(facet, set()) & set(values)
+            self.facet_filters[facet] = selected
+
+            menu = self.facet_buttons[facet].menu()
+            menu.clear()
+            for value in values:
+                text = VERSION_LABELS.get(value, value) if facet == "version" else value
+                action = menu.addAction(f"{text} ({self.facet_index.count(facet, value)})")
+                action.setCheckable(True)
+                action.setChecked(value in selected)
+                action.toggled.connect(lambda checked, f=facet, v=value: self.toggle_facet_value(f, v, checked))
+            self.update_facet_button(facet)
+
+    def update_facet_button(self, facet):
+        label = dict(FACETS)[facet]
+        selected = self.facet_filters.get(facet)
+        self.facet_buttons[facet].setText(f"{label} ({len(selected)})" if selected else label)
+
+    def toggle_facet_value(self, facet, value, checked):
+        selected = self.facet_filters.setdefault(facet, set())
+        if checked:
+            selected.add(value)
+        else:
+            selected.discard(value)
+        self.update_facet_button(facet)
+        self.set_view()
+
+    def clear_facet_filters(self):
+        self.facet_filters = {}
+        self.update_facet_menus()
+        self.set_view()
+
+    def show_ranking(self, title, ranking):
+        """ranking の順に、該当するポーションだけを表示する"""
+        self.ranking = ranking
+        self.ranking_label.setText(title)
+        self.ranking_bar.show()
+        self.set_view()
+        self.scroll_area.verticalScrollBar().setValue(0)
+
+    def clear_ranking(self):
+        self.ranking = None
+        self.ranking_bar.hide()
+        self.set_view()
+
+    def undo_text(self):
+        labels = {RENAME: "名前の変更", MOVE: "移動"}
+        if not self.main_window.undo_stack:
+            return "元に戻す"
+        kind, pairs = self.main_window.undo_stack[-1]
+        return f"元に戻す（{labels.get(kind, kind)} {len(pairs)} 個）"
+
+    def rename_items(self, pairs):
+        """名前の変更や移動に合わせて、読み直さずに項目のパスだけを付け替える"""
+        mapping = dict(pairs)
+        self.items = [(item[0], mapping.get(item[1], item[1])) + item[2:] for item in self.items]
+        self.facet_index.rename(pairs)
+        if self.ranking is not None:
+            self.ranking = [(mapping.get(filepath, filepath), score) for filepath, score in self.ranking]
+        self.sort_thumbnails(self.main_window.sort_order)
+        self.set_view()
+
+    def remove_items(self, paths):
+        """ゴミ箱に移したポーションを、読み直さずに項目から取り除く"""
+        self.items = [item for item in self.items if item[1] not in paths]
+        self.facet_index.remove(paths)
+        self.update_facet_menus()
+        self.set_view()
+
+    def replace_pixmaps(self, pixmaps):
+        """filepath -> QPixmap の対応でサムネイルを差し替える"""
+        self.items = [
+            (pixmaps.get(item[1], item[0]),) + item[1:]
+            for item in self.items
+        ]
+
     def set_view(self):
         self.clear_grid()
         thumbs = self.items
+        scores = None
+        if self.ranking is not None:
+            scores = dict(self.ranking)
+            order = {filepath: i for i, (filepath, score) in enumerate(self.ranking)}
+            thumbs = sorted((t for t in thumbs if t[1] in order), key=lambda t: order[t[1]])
         if self.search_query:
             query_lower = self.search_query.lower()
             thumbs = [
                 t for t in thumbs
                 if query_lower in os.path.basename(t[1]).removesuffix(".naiv4vibe").lower()
             ]
+        matches = self.facet_index.matcher(self.facet_filters)
+        if matches:
+            thumbs = [t for t in thumbs if matches(t[1])]
 
         # グリッド幅に応じた列数を計算
         available_width = self.scroll_area.viewport().width()
@@ -296,6 +520,7 @@ class BrowseTabWidget(QWidget):
             columns = max(1, available_width // widget_width)
         else:
             columns = 1
+        self.columns = columns
 
         idx = 0
         for thumb_info in thumbs:
@@ -308,7 +533,9 @@ class BrowseTabWidget(QWidget):
                 ClickableThumbnail(pixmap, filepath, mtime, info, importinfo, self.main_window.thumbnail_size, parent=self),
                 parent=self
             )
-            widget.set_clicked_callback(self.clear_selection_except)
+            widget.set_selection_model(self.selection_model)
+            if scores is not None:
+                widget.label.setText(f"{widget.label.text()}\n類似度 {scores[filepath]:.2f}")
             self.thumbnails.append(widget)
             self.grid_layout.addWidget(widget, row, col)
             idx += 1
@@ -316,18 +543,51 @@ class BrowseTabWidget(QWidget):
     def update_detail_from_thumbnail(self, thumb: ClickableThumbnail):
         self.current_selection = thumb
         pixmap = thumb.original_pixmap
+        self.detail_image.setToolTip("")
+        if max(pixmap.width(), pixmap.height()) < DETAIL_SIZE:
+            # 一覧用に縮小済みなので、読み込み済みでなければ一覧の画像を出しておき、読み込めたら差し替える
+            pixmap = self.detail_pixmap(thumb.fullpath) or pixmap
+        self.set_detail_pixmap(pixmap)
         importinfo = thumb.importinfo
-        self.detail_image.setPixmap(
-            pixmap.scaled(256, 256, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation))
         self.detail_filename.setText(f"ファイル名：{os.path.basename(thumb.fullpath).removesuffix('.naiv4vibe')}")
         self.detail_mtime.setText(f"作成日時：{thumb.mtime}")
         self.detail_info_extracted.setText(f"情報抽出度：{thumb.info_extracted}")
-        self.import_strength.setText(str(importinfo["strength"]))
-        self.import_info_extracted.setText(str(importinfo["information_extracted"]))
-        self.import_version_select.setCurrentIndex(self.version_choices.index(importinfo["model"]))
+        self.import_strength.setText(str(importinfo.get("strength", "")))
+        self.import_info_extracted.setText(str(importinfo.get("information_extracted", "")))
+        if importinfo.get("model") in self.version_choices:
+            self.import_version_select.setCurrentIndex(self.version_choices.index(importinfo["model"]))
+
+    def set_detail_pixmap(self, pixmap):
+        self.detail_image.setPixmap(pixmap.scaled(
+            DETAIL_SIZE, DETAIL_SIZE, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation))
+
+    def detail_pixmap(self, path):
+        """詳細表示用のサムネイルを返す。まだ読み込んでいなければバックグラウンドで読み込みを始めて None を返す"""
+        if path in self.detail_cache:
+            self.detail_cache.move_to_end(path)
+            return self.detail_cache[path]
+        # 選択を素早く動かしたときに古い要求が溜まらないよう、まだ始まっていないものは取り消す
+        self.detail_pool.clear()
+        self.detail_pool.start(DetailImageTask(path, self.detail_signals))
+        return None
+
+    def on_detail_loaded(self, path, thumbnail):
+        pixmap = QPixmap.fromImage(utils.rgba_to_qimage(*thumbnail)) if thumbnail else None
+        self.detail_cache[path] = pixmap
+        self.detail_cache.move_to_end(path)
+        while len(self.detail_cache) > DETAIL_CACHE_SIZE:
+            self.detail_cache.popitem(last=False)
+        if pixmap is not None and self.current_selection and self.current_selection.fullpath == path:
+            self.set_detail_pixmap(pixmap)
+
+    def on_detail_failed(self, path, error):
+        if self.current_selection and self.current_selection.fullpath == path:
+            self.detail_image.setToolTip(f"元のサムネイルを読み込めませんでした：{error}")
 
     def save_importinfo(self):
-        if self.current_selection:
+        if self.current_selection and self.current_selection.read_only:
+            QMessageBox.warning(self, "エラー", "バンドル内のポーションは変更できません。")
+        elif self.current_selection:
             information_extracted = float(self.import_info_extracted.text())
             if not (0.01 <= information_extracted <= 1):
                 QMessageBox.critical(self, "エラー", "情報抽出度は0.01～1.0の範囲で入力してください。")
@@ -340,8 +600,35 @@ class BrowseTabWidget(QWidget):
                 self.current_selection.set_importinfo(importinfo)
                 QMessageBox.information(self, "保存完了", "読み込み設定が保存されました。")
 
-    def clear_selection_except(self, selected_widget: ClickableThumbnail):
-        for widget in self.thumbnails:
-            if widget is not selected_widget:
-                widget.selected(False)
-                widget.update_style()
\ No newline at end of file
+    def on_current_changed(self, widget: ThumbnailWidget):
+        self.setFocus()
+        self.scroll_area.ensureWidgetVisible(widget)
+        self.update_detail_from_thumbnail(widget.thumbnail)
+
+    def dragEnterEvent(self, event: QDragEnterEvent):
+        if event.mimeData().hasUrls():
+            for url in event.mimeData().urls():
+                if url.toLocalFile().lower().endswith(IMAGE_SUFFIXES):
+                    event.acceptProposedAction()
+                    return
+        event.ignore()
+
+    def dropEvent(self, event: QDropEvent):
+        for url in event.mimeData().urls():
+            filepath = url.toLocalFile()
+            if filepath.lower().endswith(IMAGE_SUFFIXES):
+                self.main_window.find_by_image(filepath)
+                return
+
+    def keyPressEvent(self, event):
+        moves = {
+            Qt.Key.Key_Left: -1,
+            Qt.Key.Key_Right: 1,
+            Qt.Key.Key_Up: -self.columns,
+            Qt.Key.Key_Down: self.columns,
+        }
+        if event.key() in moves:
+            extend = bool(event.modifiers() & Qt.KeyboardModifier.ShiftModifier)
+            self.selection_model.move(moves[event.key()], extend)
+        else:
+            super().keyPressEvent(event)
@@ -0,0 +1,191 @@
+"""ポーションファイルを詰め直して、ライブラリの読み込みを軽くする
+
+使い方:
+    python compact_library.py <フォルダ> [<フォルダ> ...] [--max-thumbnail 512] [--dry-run]
+
+- インデント付きで保存されたポーションを空白の無い JSON に書き直す
+- --max-thumbnail を指定すると、それより大きい埋め込みサムネイルを縮小する
+- 書き直した内容は一時ファイルに書いて読み戻し、元と同じになることを確かめてから元のファイルに上書きする
+  （ファイルを置き換えないので、一覧の日付順に使う作成日時も更新日時も変わらない）
+- 最後に減ったバイト数と、書き直す前後でのフォルダの読み込み時間を表示する
+
+フォルダ単位で、バンドル (.vibebundle) は対象外。
+"""
+import argparse
+import base64
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+import json_backend
+from thumbnail_pipeline import DATA_URI_PREFIX, load_potion, open_thumbnail, prescale_size
+
+# data URI の形式 -> PIL の保存形式と保存時の引数
+THUMBNAIL_FORMATS = {
+    "png": ("PNG", {"optimize": True}),
+    "jpeg": ("JPEG", {"quality": 90}),
+    "jpg": ("JPEG", {"quality": 90}),
+    "webp": ("WEBP", {"quality": 90}),
+}
+# 一覧表示と同じ条件で読み込み時間を測るときのサムネイルの大きさ
+SCAN_SIZE = 128
+
+
+def shrink_thumbnail(b64_thumb, max_size):
+    """max_size より大きいサムネイルを縮小した data URI を返す。縮小しない場合は None"""
+    match = DATA_URI_PREFIX.match(b64_thumb)
+    img = open_thumbnail(b64_thumb)
+    if match is None or img is None or max(img.size) <= max_size:
+        return None
+
+    fmt = match.group(0)[len("data:image/"):].split(";")[0].lower()
+    format_name, params = THUMBNAIL_FORMATS.get(fmt, THUMBNAIL_FORMATS["png"])
+    if format_name == "JPEG":
+        img = img.convert("RGB")
+    img = img.resize(prescale_size(img.width, img.height, max_size), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    img.save(buffer, format_name, **params)
+    shrunk = f"data:image/{format_name.lower()};base64," + base64.b64encode(buffer.getvalue()).decode('ascii')
+    return shrunk if len(shrunk) < len(b64_thumb) else None
+
+
+def compact_potion(filepath, max_thumbnail=None, dry_run=False):
+    """1 ファイルを詰め直し、(filepath, 元のバイト数, 詰め直した後のバイト数, サムネイルを縮小したか, エラー) を返す"""
+    try:
+        with open(filepath, 'rb') as f:
+            raw = f.read()
+        data = json_backend.loads(raw)
+
+        resized = False
+        if max_thumbnail and isinstance(data.get("thumbnail"), str):
+            shrunk = shrink_thumbnail(data["thumbnail"], max_thumbnail)
+            if shrunk is not None:
+                data["thumbnail"] = shrunk
+                resized = True
+
+        compacted = json_backend.dumps(data)
+        if len(compacted) >= len(raw) and not resized:
+            return filepath, len(raw), len(raw), False, None
+
+        # 書き出したものを読み戻して、サムネイル以外が元と同じかを確かめる
+        expected = json_backend.loads(raw)
+        if resized:
+            expected["thumbnail"] = data["thumbnail"]
+        if json_backend.loads(compacted) != expected:
+            return filepath, len(raw), len(raw), False, "読み戻した内容が一致しません"
+        if dry_run:
+            return filepath, len(raw), len(compacted), resized, None
+
+        stat = os.stat(filepath)
+        tmp_path = filepath + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(compacted)
+        with open(tmp_path, 'rb') as f:
+            if f.read() != compacted:
+                os.remove(tmp_path)
+                return filepath, len(raw), len(raw), False, "書き込んだ内容が一致しません"
+
+        # 新しいファイルで置き換えると作成日時（Windows の st_ctime、macOS の st_birthtime）が変わり、
+        # 日付順で先頭に来てしまうので、確かめた内容を元のファイルに上書きする。
+        # 上書きの途中で止まった場合に備えて、終わるまで一時ファイルは残しておく
+        if not _overwrite(filepath, compacted):
+            _overwrite(filepath, raw)
+            os.utime(filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            message = f"上書きに失敗したため元に戻しました（{os.path.basename(tmp_path)} に詰め直した内容があります）"
+            return filepath, len(raw), len(raw), False, message
+        os.utime(filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.remove(tmp_path)
+        return filepath, len(raw), len(compacted), resized, None
+    except Exception as e:
+        return filepath, 0, 0, False, str(e)
+
+
+def _overwrite(filepath, content):
+    """ファイルを開き直さずに中身だけを content にし、読み戻して一致すれば True を返す"""
+    with open(filepath, 'r+b') as f:
+        f.write(content)
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+    with open(filepath, 'rb') as f:
+        return f.read() == content
+
+
+def _compact_chunk(filepaths, max_thumbnail, dry_run):
+    return [compact_potion(filepath, max_thumbnail, dry_run) for filepath in filepaths]
+
+
+def list_potions(directories):
+    filepaths = []
+    for directory in directories:
+        if not os.path.isdir(directory):
+            print(f"フォルダではないので飛ばします: {directory}", file=sys.stderr)
+            continue
+        filepaths += [
+            os.path.join(directory, filename) for filename in sorted(os.listdir(directory))
+            if filename.endswith(".naiv4vibe")
+        ]
+    return filepaths
+
+
+def measure_scan(filepaths):
+    """ブラウズタブの読み込みと同じく、ポーションを読んでサムネイルを縮小するまでの時間"""
+    start = time.perf_counter()
+    for filepath in filepaths:
+        load_potion(filepath, SCAN_SIZE)
+    return time.perf_counter() - start
+
+
+def compact_library(filepaths, max_thumbnail=None, dry_run=False, max_workers=None):
+    """filepaths をプロセスプールで並列に詰め直し、compact_potion の結果のリストを返す"""
+    max_workers = max_workers or os.cpu_count() or 1
+    chunk_size = max(1, min(64, len(filepaths) // (max_workers * 4)))
+    chunks = [filepaths[i:i + chunk_size] for i in range(0, len(filepaths), chunk_size)]
+    results = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for chunk_results in executor.map(
+                _compact_chunk, chunks, [max_thumbnail] * len(chunks), [dry_run] * len(chunks)):
+            results += chunk_results
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directories", nargs="+")
+    parser.add_argument("--max-thumbnail", type=int, help="埋め込みサムネイルの長辺の上限（ピクセル）")
+    parser.add_argument("--dry-run", action="store_true", help="書き換えずに、減るバイト数だけを表示する")
+    parser.add_argument("--workers", type=int, help="並列に処理するプロセス数")
+    args = parser.parse_args()
+
+    filepaths = list_potions(args.directories)
+    if not filepaths:
+        sys.exit("ポーションファイルが見つかりません")
+
+    scan_before = None if args.dry_run else measure_scan(filepaths)
+    start = time.perf_counter()
+    results = compact_library(filepaths, args.max_thumbnail, args.dry_run, args.workers)
+    elapsed = time.perf_counter() - start
+
+    errors = [(filepath, error) for filepath, _, _, _, error in results if error]
+    for filepath, error in errors:
+        print(f"[エラー] {os.path.basename(filepath)}: {error}", file=sys.stderr)
+    before = sum(result[1] for result in results)
+    after = sum(result[2] for result in results)
+    changed = sum(1 for result in results if result[2] != result[1] or result[3])
+    resized = sum(1 for result in results if result[3])
+
+    print(f"{len(results)} ファイル中 {changed} ファイルを{'詰め直せます' if args.dry_run else '詰め直しました'}"
+          f"（サムネイル縮小 {resized}、エラー {len(errors)}、{elapsed:.1f} 秒）")
+    print(f"{before / 1024 / 1024:.1f} MB -> {after / 1024 / 1024:.1f} MB"
+          f"（{(before - after) / 1024 / 1024:.1f} MB 削減, {100 * (before - after) / max(before, 1):.0f}%）")
+    if scan_before is not None:
+        scan_after = measure_scan(filepaths)
+        print(f"読み込み時間: {scan_before:.2f} 秒 -> {scan_after:.2f} 秒（{scan_before / max(scan_after, 1e-9):.2f} 倍）")
+
+
+if __name__ == "__main__":
+    main()
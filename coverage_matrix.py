@@ -0,0 +1,91 @@
+"""ライブラリ全体の情報抽出度の揃い具合（ポーション × バージョン × 情報抽出度）
+
+索引 (EncodingIndex) の encodings の行だけから作るので、ポーションファイルは開かない。
+present[ポーション, バージョン, 情報抽出度] の bool 配列に持ち、絞り込みと並び替えは配列の演算で行う。
+Qt に依存しない。
+"""
+import os
+
+import numpy as np
+
+from encoding_index import VERSION_LABELS
+
+
+class CoverageMatrix:
+    def __init__(self, paths, rows):
+        """paths はポーションのパス、rows は (path, version_key, info_extracted) の iterable"""
+        rows = list(rows)
+        self.paths = sorted(paths)
+        position = {path: i for i, path in enumerate(self.paths)}
+        rows = [row for row in rows if row[0] in position]
+
+        found_versions = {version_key for _, version_key, _ in rows}
+        self.version_keys = [vk for vk in VERSION_LABELS if vk in found_versions]
+        self.version_keys += sorted(found_versions - set(self.version_keys))
+        found_levels = {info_extracted for _, _, info_extracted in rows}
+        # 情報抽出度は大きい順、数値でないものは最後に「不明」としてまとめる
+        self.levels = sorted((level for level in found_levels if level is not None), reverse=True)
+        if None in found_levels:
+            self.levels.append(None)
+
+        version_index = {vk: i for i, vk in enumerate(self.version_keys)}
+        level_index = {level: i for i, level in enumerate(self.levels)}
+        count = len(rows)
+        self.present = np.zeros((len(self.paths), len(self.version_keys), len(self.levels)), dtype=bool)
+        self.present[
+            np.fromiter((position[row[0]] for row in rows), np.intp, count),
+            np.fromiter((version_index[row[1]] for row in rows), np.intp, count),
+            np.fromiter((level_index[row[2]] for row in rows), np.intp, count),
+        ] = True
+        # そのバージョンでライブラリのどこかに存在する情報抽出度（これ以外は「足りない」に数えない）
+        self.available = self.present.any(axis=0)
+        self.has_version = self.present.any(axis=2)
+
+        self.names = [os.path.basename(path).removesuffix(".naiv4vibe") for path in self.paths]
+        self.lower_names = np.array([name.lower() for name in self.names], dtype=str)
+        self.name_rank = np.empty(len(self.paths), dtype=np.intp)
+        self.name_rank[np.argsort(self.lower_names, kind="stable")] = np.arange(len(self.paths))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def columns(self, versions=None):
+        """表示する (バージョンの番号, 情報抽出度の番号) のリスト。versions はバージョンの番号のリスト"""
+        versions = range(len(self.version_keys)) if versions is None else versions
+        return [(v, l) for v in versions for l in range(len(self.levels)) if self.available[v, l]]
+
+    def missing_counts(self, versions=None):
+        """各ポーションの、持っているバージョンで足りない情報抽出度の数"""
+        versions = list(range(len(self.version_keys)) if versions is None else versions)
+        missing = ~self.present[:, versions, :] & self.available[versions, :] & self.has_version[:, versions, None]
+        return missing.sum(axis=(1, 2))
+
+    def select(self, versions=None, query="", missing_only=False):
+        """条件に合うポーションの bool 配列。versions を指定すると、そのどれかを持つポーションだけにする"""
+        mask = np.ones(len(self.paths), dtype=bool)
+        if versions is not None:
+            mask &= self.has_version[:, list(versions)].any(axis=1)
+        if query:
+            mask &= np.char.find(self.lower_names, query.lower()) >= 0
+        if missing_only:
+            mask &= self.missing_counts(versions) > 0
+        return mask
+
+    def order(self, mask, key=None, descending=False, versions=None):
+        """mask のポーションを並べた番号の配列
+
+        key は None（名前順）、"missing"（versions で足りない数）、(v, l)（その情報抽出度が有るか）のいずれか。
+        同じ値どうしは名前順に並べる。
+        """
+        indices = np.flatnonzero(mask)
+        if key is None:
+            values = self.name_rank[indices]
+        elif key == "missing":
+            values = self.missing_counts(versions)[indices]
+        else:
+            v, l = key
+            # 有る > 足りない > そのバージョン自体が無い の順
+            values = self.present[indices, v, l].astype(np.int8) * 2 + self.has_version[indices, v]
+        if descending:
+            values = -values.astype(np.int64)
+        return indices[np.lexsort((self.name_rank[indices], values))]
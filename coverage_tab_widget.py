@@ -0,0 +1,189 @@
+import os
+import numpy as np
+from PyQt6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, QComboBox, QCheckBox, QTableView
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex
+from PyQt6.QtGui import QColor
+import utils
+import potion_bundle
+from coverage_matrix import CoverageMatrix
+from encoding_index import VERSION_LABELS
+
+PRESENT_MARK = "●"
+MISSING_MARK = "－"
+MISSING_COLOR = QColor(255, 220, 220)
+
+
+def format_level(level):
+    return "不明" if level is None else f"{level:g}"
+
+
+class CoverageModel(QAbstractTableModel):
+    """CoverageMatrix の絞り込み結果を表示する。セルは表示される分だけ配列から読む"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.matrix = CoverageMatrix([], [])
+        self.versions = None
+        self.columns = []
+        self.rows = np.zeros(0, dtype=np.intp)
+        self.missing = np.zeros(0, dtype=np.intp)
+        self.sort_key = None
+        self.descending = False
+
+    def set_matrix(self, matrix):
+        self.beginResetModel()
+        self.matrix = matrix
+        self.versions = None
+        self.columns = matrix.columns()
+        self.rows = np.arange(len(matrix))
+        self.missing = matrix.missing_counts()
+        self.sort_key = None
+        self.endResetModel()
+
+    def apply_filter(self, versions, query, missing_only):
+        """versions はバージョンの番号のリスト（None なら全バージョン）"""
+        self.beginResetModel()
+        self.versions = versions
+        self.columns = self.matrix.columns(versions)
+        if self.sort_key not in (None, "missing") and self.sort_key not in self.columns:
+            self.sort_key = None
+        self.missing = self.matrix.missing_counts(versions)
+        mask = self.matrix.select(versions, query, missing_only)
+        self.rows = self.matrix.order(mask, self.sort_key, self.descending, versions)
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 2 + len(self.columns)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole or orientation != Qt.Orientation.Horizontal:
+            return None
+        if section == 0:
+            return "ポーション"
+        if section == 1:
+            return "不足"
+        v, l = self.columns[section - 2]
+        version_key = self.matrix.version_keys[v]
+        return f"{VERSION_LABELS.get(version_key, version_key)}\n{format_level(self.matrix.levels[l])}"
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        potion = self.rows[index.row()]
+        column = index.column()
+        if column == 0:
+            if role == Qt.ItemDataRole.DisplayRole:
+                return self.matrix.names[potion]
+            if role == Qt.ItemDataRole.ToolTipRole:
+                return self.matrix.paths[potion]
+            return None
+        if column == 1:
+            if role == Qt.ItemDataRole.DisplayRole:
+                return int(self.missing[potion]) or ""
+            if role == Qt.ItemDataRole.TextAlignmentRole:
+                return Qt.AlignmentFlag.AlignCenter
+            return None
+
+        v, l = self.columns[column - 2]
+        present = self.matrix.present[potion, v, l]
+        has_version = self.matrix.has_version[potion, v]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return PRESENT_MARK if present else MISSING_MARK if has_version else ""
+        if role == Qt.ItemDataRole.BackgroundRole and has_version and not present:
+            return MISSING_COLOR
+        if role == Qt.ItemDataRole.TextAlignmentRole:
+            return Qt.AlignmentFlag.AlignCenter
+        return None
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        self.layoutAboutToBeChanged.emit()
+        self.sort_key = None if column <= 0 else "missing" if column == 1 else self.columns[column - 2]
+        self.descending = order == Qt.SortOrder.DescendingOrder
+        mask = np.zeros(len(self.matrix), dtype=bool)
+        mask[self.rows] = True
+        self.rows = self.matrix.order(mask, self.sort_key, self.descending, self.versions)
+        self.layoutChanged.emit()
+
+    def path_at(self, row):
+        return self.matrix.paths[self.rows[row]]
+
+
+class CoverageTabWidget(QWidget):
+    """どのポーションにどのバージョン・情報抽出度が揃っているかを一覧にする
+
+    一覧は索引から作るので、ブラウズタブの読み込みが終わった後に refresh() で作り直す。
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.main_window = parent
+        self.stale = True
+
+        self.search_box = QLineEdit()
+        self.search_box.setPlaceholderText("ファイル名で絞り込み...")
+        self.search_box.textChanged.connect(self.apply_filter)
+        self.version_select = QComboBox()
+        self.version_select.currentIndexChanged.connect(self.apply_filter)
+        self.missing_only = QCheckBox("足りない情報抽出度があるものだけ")
+        self.missing_only.toggled.connect(self.apply_filter)
+
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(self.search_box, 1)
+        filter_layout.addWidget(self.version_select)
+        filter_layout.addWidget(self.missing_only)
+
+        self.summary_label = QLabel("")
+        self.model = CoverageModel(self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSortingEnabled(True)
+        self.table.sortByColumn(-1, Qt.SortOrder.AscendingOrder)
+        self.table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.table.verticalHeader().setDefaultSectionSize(22)
+        self.table.horizontalHeader().setDefaultSectionSize(64)
+        self.table.doubleClicked.connect(self.open_in_explorer)
+
+        layout = QVBoxLayout(self)
+        layout.addLayout(filter_layout)
+        layout.addWidget(self.summary_label)
+        layout.addWidget(self.table)
+
+    def refresh(self):
+        """索引から一覧を作り直す。設定しているフォルダ・バンドルのポーションだけを数える"""
+        index = self.main_window.encoding_index
+        directories = potion_bundle.directory_keys(self.main_window.directories)
+        paths = [path for path in index.current_paths() if potion_bundle.is_under(path, directories)]
+        matrix = CoverageMatrix(paths, index.encoding_levels())
+        self.model.set_matrix(matrix)
+
+        self.version_select.blockSignals(True)
+        selected = self.version_select.currentData()
+        self.version_select.clear()
+        self.version_select.addItem("全バージョン", None)
+        for version_key in matrix.version_keys:
+            self.version_select.addItem(VERSION_LABELS.get(version_key, version_key), version_key)
+        position = self.version_select.findData(selected)
+        self.version_select.setCurrentIndex(max(position, 0))
+        self.version_select.blockSignals(False)
+
+        self.stale = False
+        self.apply_filter()
+        self.table.setColumnWidth(0, 240)
+
+    def apply_filter(self):
+        matrix = self.model.matrix
+        version_key = self.version_select.currentData()
+        versions = None if version_key is None else [matrix.version_keys.index(version_key)]
+        self.model.apply_filter(versions, self.search_box.text().strip(), self.missing_only.isChecked())
+        lacking = int((matrix.missing_counts(versions) > 0).sum())
+        self.summary_label.setText(
+            f"{len(matrix)} 個中 {lacking} 個に足りない情報抽出度があります（表示中 {self.model.rowCount()} 個）")
+
+    def open_in_explorer(self, index):
+        # バンドル内のポーションはバンドル自体の場所を開く
+        path = potion_bundle.container_path(self.model.path_at(index.row()))
+        if os.path.exists(path):
+            utils.open_file_location(path, parent=self)
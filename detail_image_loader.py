@@ -0,0 +1,46 @@
+"""ブラウズタブの詳細表示に使う、一覧より大きいサムネイルをバックグラウンドで読み込む
+
+一覧のサムネイルは表示サイズに縮小済みなので、詳細表示ではポーションのサムネイルを読み直す。
+ファイルの読み込みとデコードは GUI スレッドで行わず、終わったものからシグナルで知らせる。
+バンドル内のポーションはバンドルの index.json のサムネイルを使い、ポーション本体は取り出さない。
+"""
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
+
+import json_backend
+import potion_bundle
+from thumbnail_pipeline import open_thumbnail, scale_thumbnail
+
+DETAIL_SIZE = 256
+
+
+class DetailImageSignals(QObject):
+    # path, (幅, 高さ, RGBA バッファ)。サムネイルが無いポーションは None
+    loaded = pyqtSignal(str, object)
+    failed = pyqtSignal(str, str)  # path, error
+
+
+class DetailImageTask(QRunnable):
+    def __init__(self, path, signals):
+        super().__init__()
+        self.path = path
+        self.signals = signals
+
+    def run(self):
+        try:
+            parts = potion_bundle.split_bundle_path(self.path)
+            if parts:
+                data = dict(potion_bundle.read_index(parts[0]))[self.path]
+            else:
+                data = json_backend.read_json(self.path)
+            b64_thumb = data.get("thumbnail")
+            if not b64_thumb:
+                self.signals.loaded.emit(self.path, None)
+                return
+            img = open_thumbnail(b64_thumb)
+            if img is None:
+                raise ValueError("サムネイルを画像として読めません")
+            thumbnail = scale_thumbnail(img, DETAIL_SIZE)
+        except Exception as e:
+            self.signals.failed.emit(self.path, str(e))
+            return
+        self.signals.loaded.emit(self.path, thumbnail)
@@ -0,0 +1,224 @@
+"""encoding -> ポーションファイルの対応を全バージョン分 SQLite に保存しておく索引
+
+encoding の文字列はとても長いので、索引には encoding_digest() で縮めたものを保存する。
+GUI スレッドとワーカースレッドの両方から使うため、スレッドごとに EncodingIndex を作ること。
+"""
+import hashlib
+import os
+import sqlite3
+
+import json_backend
+import potion_bundle
+
+# 設定の version -> ポーションファイルの encodings のキー
+VERSION_KEYS = {
+    "v4": "v4full",
+    "v4.5": "v4-5full",
+    "v4.5c": "v4-5curated",
+    "v4c": "v4curated",
+}
+VERSION_LABELS = {
+    "v4full": "V4",
+    "v4-5full": "V4.5",
+    "v4-5curated": "V4.5 Curated",
+    "v4curated": "V4 Curated",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS potions (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    has_thumbnail INTEGER NOT NULL,
+    importinfo TEXT,
+    phash INTEGER,
+    dhash INTEGER
+);
+CREATE TABLE IF NOT EXISTS encodings (
+    digest TEXT NOT NULL,
+    version_key TEXT NOT NULL,
+    info_extracted NUMERIC,
+    path TEXT NOT NULL REFERENCES potions(path) ON DELETE CASCADE,
+    PRIMARY KEY (digest, path)
+);
+CREATE INDEX IF NOT EXISTS encodings_path ON encodings(path);
+"""
+
+
+def encoding_digest(encoding):
+    return hashlib.blake2b(encoding.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def iter_encodings(data):
+    """ポーションの dict から (version_key, encoding, info_extracted) を列挙する"""
+    for version_key, encodings in data.get("encodings", {}).items():
+        for item in encodings.values():
+            enc = item.get("encoding")
+            if not enc:
+                continue
+            info_extracted = item.get("params", {}).get("information_extracted")
+            if not isinstance(info_extracted, (float, int)):
+                info_extracted = None
+            yield version_key, enc, info_extracted
+
+
+class EncodingIndex:
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def commit(self):
+        self.conn.commit()
+
+    def is_current(self, path, stat):
+        row = self.conn.execute("SELECT mtime_ns, size FROM potions WHERE path = ?", (path,)).fetchone()
+        return row is not None and row == (stat.st_mtime_ns, stat.st_size)
+
+    def current_paths(self):
+        """path -> (mtime_ns, size)"""
+        return {row[0]: (row[1], row[2]) for row in self.conn.execute("SELECT path, mtime_ns, size FROM potions")}
+
+    def update_potion(self, path, stat, data, has_thumbnail):
+        """ポーションの内容で索引を更新する
+
+        data は encodings と importInfo、あればサムネイルの imageHash を含む dict。
+        """
+        importinfo = data.get("importInfo")
+        phash, dhash = data.get("imageHash") or (None, None)
+        self.conn.execute("DELETE FROM potions WHERE path = ?", (path,))
+        self.conn.execute(
+            "INSERT INTO potions (path, mtime_ns, size, has_thumbnail, importinfo, phash, dhash) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (path, stat.st_mtime_ns, stat.st_size, int(has_thumbnail),
+             json_backend.dumps(importinfo).decode('utf-8') if importinfo else None, phash, dhash)
+        )
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO encodings (digest, version_key, info_extracted, path) VALUES (?, ?, ?, ?)",
+            [(encoding_digest(enc), version_key, info_extracted, path)
+             for version_key, enc, info_extracted in iter_encodings(data)]
+        )
+
+    def discard_except(self, paths, unreadable):
+        """paths に含まれないポーションを取り除く
+
+        unreadable（potion_bundle.unreadable_directories）のフォルダのポーションは、一時的に見えないだけかも
+        しれないので残しておく。設定から外したフォルダのものは消える。
+        """
+        stale = [
+            (path,) for path in self.current_paths()
+            if path not in paths and not potion_bundle.is_under(path, unreadable)
+        ]
+        self.conn.executemany("DELETE FROM potions WHERE path = ?", stale)
+
+    def rename_paths(self, pairs):
+        """名前の変更や移動に合わせて、(元のパス, 新しいパス) の組でパスを付け替える（ファイルの内容は変わらない前提）"""
+        olds = {old for old, new in pairs}
+        if any(new in olds for old, new in pairs):
+            # 名前を入れ替える場合は、いったん重ならないパスに移してから付け替える
+            staged = [(old, f"{old}\0{i}") for i, (old, new) in enumerate(pairs)]
+            self.rename_paths(staged)
+            self.rename_paths([(tmp, new) for (_, tmp), (_, new) in zip(staged, pairs)])
+            return
+        for old, new in pairs:
+            # encodings が path を参照しているので、新しい行を作って付け替えてから古い行を消す
+            self.conn.execute("DELETE FROM potions WHERE path = ?", (new,))
+            self.conn.execute(
+                "INSERT INTO potions (path, mtime_ns, size, has_thumbnail, importinfo, phash, dhash) "
+                "SELECT ?, mtime_ns, size, has_thumbnail, importinfo, phash, dhash FROM potions WHERE path = ?",
+                (new, old))
+            self.conn.execute("UPDATE encodings SET path = ? WHERE path = ?", (new, old))
+            self.conn.execute("DELETE FROM potions WHERE path = ?", (old,))
+
+    def remove_paths(self, paths):
+        self.conn.executemany("DELETE FROM potions WHERE path = ?", [(path,) for path in paths])
+
+    def find_potions(self, version_key=None, info_extracted=None, has_thumbnail=None):
+        """条件に合うポーションを [(path, has_thumbnail, importinfo の dict), ...] で返す
+
+        version_key と info_extracted は、その組み合わせの encoding を持つかどうかで判定する。
+        """
+        conditions = []
+        params = []
+        if version_key is not None or info_extracted is not None:
+            subquery = "EXISTS (SELECT 1 FROM encodings e WHERE e.path = p.path"
+            if version_key is not None:
+                subquery += " AND e.version_key = ?"
+                params.append(version_key)
+            if info_extracted is not None:
+                subquery += " AND e.info_extracted = ?"
+                params.append(info_extracted)
+            conditions.append(subquery + ")")
+        if has_thumbnail is not None:
+            conditions.append("p.has_thumbnail = ?")
+            params.append(int(has_thumbnail))
+
+        sql = "SELECT p.path, p.has_thumbnail, p.importinfo FROM potions p"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return [
+            (path, bool(has_thumb), json_backend.loads(importinfo) if importinfo else {})
+            for path, has_thumb, importinfo in self.conn.execute(sql + " ORDER BY p.path", params)
+        ]
+
+    def encodings_of(self, paths):
+        """path -> [(digest, version_key, info_extracted), ...]"""
+        result = {}
+        paths = list(paths)
+        for i in range(0, len(paths), 500):
+            chunk = paths[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT path, digest, version_key, info_extracted FROM encodings "
+                f"WHERE path IN ({','.join('?' * len(chunk))}) ORDER BY version_key, info_extracted DESC", chunk)
+            for path, digest, version_key, info_extracted in rows:
+                result.setdefault(path, []).append((digest, version_key, info_extracted))
+        return result
+
+    def contents_of(self, directory):
+        """フォルダかバンドルの直下にあるポーションを path -> (importinfo の dict, [(digest, version_key, info_extracted), ...]) で返す"""
+        prefix = os.path.join(directory, "")
+        # path の主キーの索引で引けるよう、前方一致を範囲の条件にする
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        result = {}
+        rows = self.conn.execute(
+            "SELECT p.path, p.importinfo, e.digest, e.version_key, e.info_extracted "
+            "FROM potions p LEFT JOIN encodings e ON e.path = p.path WHERE p.path >= ? AND p.path < ?",
+            (prefix, upper))
+        for path, importinfo, digest, version_key, info_extracted in rows:
+            name = path[len(prefix):]
+            if "/" in name or os.sep in name:
+                # 下の階層のフォルダも設定されている場合
+                continue
+            if path not in result:
+                result[path] = (json_backend.loads(importinfo) if importinfo else {}, [])
+            if digest is not None:
+                result[path][1].append((digest, version_key, info_extracted))
+        return result
+
+    def encoding_levels(self):
+        """すべての encoding の (path, version_key, info_extracted)"""
+        return self.conn.execute("SELECT path, version_key, info_extracted FROM encodings").fetchall()
+
+    def image_hashes(self):
+        """サムネイルのハッシュがあるポーションの [(path, phash, dhash), ...]"""
+        return self.conn.execute("SELECT path, phash, dhash FROM potions WHERE phash IS NOT NULL").fetchall()
+
+    def lookup(self, digests):
+        """digest -> [(version_key, info_extracted, path), ...] を返す。見つからない digest は含まない"""
+        result = {}
+        digests = list(digests)
+        # SQLite の変数の上限を超えないよう分けて問い合わせる
+        for i in range(0, len(digests), 500):
+            chunk = digests[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT digest, version_key, info_extracted, path FROM encodings "
+                f"WHERE digest IN ({','.join('?' * len(chunk))})", chunk)
+            for digest, version_key, info_extracted, path in rows:
+                result.setdefault(digest, []).append((version_key, info_extracted, path))
+        return result
@@ -0,0 +1,79 @@
+"""ブラウズタブの絞り込み用に、ファセットの値ごとのビットセットを持つ索引
+
+各ポーションに登録順のビット番号を振り、(ファセット, 値) ごとに該当するポーションのビットを立てた
+int を持っておく。同じファセット内の値は OR、ファセット同士は AND で組み合わせるので、
+フィルタの組み合わせはビット演算だけで求まる。
+"""
+from collections import defaultdict
+
+
+class FacetIndex:
+    def __init__(self):
+        self.positions = {}  # filepath -> ビット番号
+        self.size = 0  # 振ったビット番号の数（取り除いたポーションの番号は使い回さない）
+        self.bitsets = defaultdict(lambda: defaultdict(int))  # facet -> value -> bitset
+
+    def add(self, filepath, facets):
+        """facets は ファセット名 -> 値の iterable の dict"""
+        position = self.positions.get(filepath)
+        if position is None:
+            position = self.positions[filepath] = self.size
+            self.size += 1
+        bit = 1 << position
+        for facet, values in facets.items():
+            for value in values:
+                self.bitsets[facet][value] |= bit
+
+    def rename(self, pairs):
+        """(元のパス, 新しいパス) の組でビット番号を付け替える"""
+        positions = [(new, self.positions.pop(old)) for old, new in pairs if old in self.positions]
+        self.positions.update(positions)
+
+    def remove(self, filepaths):
+        """ポーションのビットを落とす。どのポーションにも当てはまらなくなった値は選択肢から消える"""
+        mask = 0
+        for filepath in filepaths:
+            position = self.positions.pop(filepath, None)
+            if position is not None:
+                mask |= 1 << position
+        if not mask:
+            return
+        for values in self.bitsets.values():
+            for value in list(values):
+                values[value] &= ~mask
+                if not values[value]:
+                    del values[value]
+
+    def values(self, facet):
+        return sorted(self.bitsets[facet], key=lambda value: (str(type(value)), value))
+
+    def count(self, facet, value):
+        return self.bitsets[facet][value].bit_count()
+
+    def select(self, filters):
+        """filters は ファセット名 -> 選択された値の set。条件が無ければ None を返す"""
+        mask = None
+        for facet, values in filters.items():
+            if not values:
+                continue
+            facet_mask = 0
+            for value in values:
+                facet_mask |= self.bitsets[facet].get(value, 0)
+            mask = facet_mask if mask is None else mask & facet_mask
+        return mask
+
+    def matcher(self, filters):
+        """filters に合うかを filepath で判定する関数を返す。条件が無ければ None
+
+        大きな int のシフトを毎回しないよう、マスクは一度だけバイト列に展開しておく。
+        """
+        mask = self.select(filters)
+        if mask is None:
+            return None
+        bitmap = mask.to_bytes(self.size // 8 + 1, 'little')
+        positions = self.positions
+
+        def matches(filepath):
+            position = positions.get(filepath)
+            return position is not None and bool(bitmap[position >> 3] >> (position & 7) & 1)
+        return matches
@@ -0,0 +1,61 @@
+"""ブラウズタブの一括ファイル操作をバックグラウンドで行う
+
+ファイルを動かした後、全体を読み直さずに索引 (EncodingIndex) のパスだけを付け替える。
+画面側の項目は finished を受けた GUI スレッドで書き換える。
+"""
+import os
+import sqlite3
+
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
+
+from encoding_index import EncodingIndex
+from file_operations import OperationError, apply_moves, trash_files
+
+RENAME = "rename"
+MOVE = "move"
+TRASH = "trash"
+UNDO = "undo"
+
+
+class FileOperationSignals(QObject):
+    # 操作の種類, 完了したもの（ゴミ箱ならパス、それ以外は (元のパス, 新しいパス) の組）のリスト, エラーのメッセージのリスト
+    finished = pyqtSignal(str, object, object)
+
+
+class FileOperationTask(QRunnable):
+    def __init__(self, kind, targets, db_path, signals):
+        super().__init__()
+        self.kind = kind
+        self.targets = list(targets)
+        self.db_path = db_path
+        self.signals = signals
+
+    def run(self):
+        done = []
+        errors = []
+        try:
+            if self.kind == TRASH:
+                done, failed = trash_files(self.targets)
+                errors = [f"[エラー] {os.path.basename(path)}: {error}" for path, error in failed]
+            else:
+                apply_moves(self.targets)
+                done = self.targets
+        except OperationError as e:
+            errors.append(f"[エラー] {str(e)}")
+
+        try:
+            if done:
+                index = EncodingIndex(self.db_path)
+                try:
+                    if self.kind == TRASH:
+                        index.remove_paths(done)
+                    else:
+                        index.rename_paths(done)
+                    index.commit()
+                finally:
+                    index.close()
+        except sqlite3.Error as e:
+            # ファイルは動かしてあるので画面側は書き換える。索引は次の読み込みで作り直される
+            errors.append(f"[エラー] 索引を更新できませんでした（次の読み込みで作り直されます）: {str(e)}")
+        finally:
+            self.signals.finished.emit(self.kind, done, errors)
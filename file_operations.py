@@ -0,0 +1,131 @@
+"""ポーションファイルの一括の名前変更・移動・ゴミ箱への移動
+
+名前の変更も移動も (元のパス, 新しいパス) の組のリストとして計画し、apply_moves でまとめて実行する。
+途中で失敗した場合は、それまでに動かしたファイルを元に戻してから OperationError を送出するので、
+一部だけ名前が変わった状態にはならない。元に戻すときは組を入れ替えて apply_moves に渡せばよい。
+Qt に依存しない。
+"""
+import os
+import shutil
+
+from send2trash import send2trash
+
+from potion_bundle import unique_destination
+
+POTION_SUFFIX = ".naiv4vibe"
+
+
+class OperationError(Exception):
+    pass
+
+
+def potion_stem(path):
+    return os.path.basename(path).removesuffix(POTION_SUFFIX)
+
+
+def format_name(template, path, number):
+    """template の {name} を元の名前に、{n} を連番に置き換える。{n:03} のように書式も指定できる"""
+    try:
+        name = template.format(name=potion_stem(path), n=number)
+    except (IndexError, KeyError, ValueError) as e:
+        raise OperationError(f"名前の書式が正しくありません: {e}") from e
+    if not name or name != os.path.basename(name) or name in (".", ".."):
+        raise OperationError(f"ファイル名に使えない名前です: {name!r}")
+    return name + POTION_SUFFIX
+
+
+def plan_renames(paths, template, start=1):
+    """paths を並び順に template で名前を付け直す (元のパス, 新しいパス) のリストを返す
+
+    名前が変わらないものは含めない。新しい名前が重なる場合や、対象外の既存のファイルと重なる場合は
+    OperationError を送出する（対象どうしで名前を入れ替えるのは構わない）。
+    """
+    pairs = []
+    for number, path in enumerate(paths, start):
+        new_path = os.path.join(os.path.dirname(path), format_name(template, path, number))
+        if new_path != path:
+            pairs.append((path, new_path))
+    check_destinations(pairs)
+    return pairs
+
+
+def plan_moves(paths, directory):
+    """paths を directory に移す (元のパス, 新しいパス) のリストを返す。同名のファイルがあれば番号を付ける"""
+    pairs = []
+    taken = set()
+    target = os.path.normcase(os.path.normpath(directory))
+    for path in paths:
+        if os.path.normcase(os.path.normpath(os.path.dirname(path))) == target:
+            continue
+        dest = unique_destination(directory, os.path.basename(path))
+        stem, suffix = os.path.splitext(os.path.basename(path))
+        number = 2
+        while dest in taken:
+            dest = unique_destination(directory, f"{stem} ({number}){suffix}")
+            number += 1
+        taken.add(dest)
+        pairs.append((path, dest))
+    return pairs
+
+
+def check_destinations(pairs):
+    sources = {src for src, dst in pairs}
+    seen = set()
+    for src, dst in pairs:
+        if dst in seen:
+            raise OperationError(f"同じ名前になるファイルがあります: {os.path.basename(dst)}")
+        seen.add(dst)
+        if dst not in sources and os.path.exists(dst):
+            raise OperationError(f"同名のファイルが既に存在します: {os.path.basename(dst)}")
+
+
+def _move(src, dst):
+    if os.path.exists(dst):
+        raise FileExistsError(f"同名のファイルが既に存在します: {dst}")
+    # 別のドライブへの移動はコピーになるが、copy2 で更新日時は引き継がれる
+    shutil.move(src, dst)
+
+
+def apply_moves(pairs):
+    """(元のパス, 新しいパス) の組に従ってファイルを動かす
+
+    名前を入れ替える場合に備えて、新しいパスが別の元のパスと重なるときは一時的な名前を経由する。
+    失敗したときはそれまでの移動を元に戻し、OperationError を送出する。
+    """
+    check_destinations(pairs)
+    sources = {src for src, dst in pairs}
+    if any(dst in sources for src, dst in pairs):
+        staged = [(src, f"{src}.{i}.renaming") for i, (src, dst) in enumerate(pairs)]
+        steps = staged + [(tmp, dst) for (_, tmp), (_, dst) in zip(staged, pairs)]
+    else:
+        steps = list(pairs)
+
+    done = []
+    try:
+        for src, dst in steps:
+            _move(src, dst)
+            done.append((src, dst))
+    except OSError as e:
+        failed = src
+        for src, dst in reversed(done):
+            try:
+                _move(dst, src)
+            except OSError:
+                pass
+        raise OperationError(f"{os.path.basename(failed)}: {e}") from e
+
+
+def trash_files(paths):
+    """paths をゴミ箱に移し、(移したパスのリスト, [(パス, エラー), ...]) を返す"""
+    done = []
+    errors = []
+    for path in paths:
+        try:
+            abs_path = os.path.abspath(path)
+            if not os.path.exists(abs_path):
+                raise FileNotFoundError(f"ファイルが存在しません: {abs_path}")
+            send2trash(abs_path)
+            done.append(path)
+        except Exception as e:
+            errors.append((path, str(e)))
+    return done, errors
@@ -0,0 +1,129 @@
+"""出力フォルダを監視し、新しく保存された画像をバックグラウンドで解析する"""
+import hashlib
+import os
+import time
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, QTimer, QFileSystemWatcher, pyqtSignal
+
+IMAGE_SUFFIXES = (".png", ".webp")
+
+
+class _WorkerSignals(QObject):
+    finished = pyqtSignal(int, str, str, object)  # generation, filepath, sha256, analyse の戻り値
+    failed = pyqtSignal(int, str, str)  # generation, filepath, error
+
+
+class _AnalyseTask(QRunnable):
+    def __init__(self, generation, filepath, analyse, signals):
+        super().__init__()
+        self.generation = generation
+        self.filepath = filepath
+        self.analyse = analyse
+        self.signals = signals
+
+    def run(self):
+        try:
+            with open(self.filepath, 'rb') as f:
+                raw = f.read()
+            digest = hashlib.sha256(raw).hexdigest()
+            result = self.analyse(os.path.basename(self.filepath), raw)
+        except Exception as e:
+            self.signals.failed.emit(self.generation, self.filepath, str(e))
+            return
+        self.signals.finished.emit(self.generation, self.filepath, digest, result)
+
+
+class FolderWatcher(QObject):
+    """フォルダに追加された画像を検出し、書き込みが終わったものから analyse に回す
+
+    analyse(name, raw) はワーカースレッドで呼ばれるので、QPixmap などは作らないこと。
+    ファイルサイズと更新日時が settle_ms の間変わらなくなった時点で書き込み完了とみなす。
+    stop() の後に終わった解析の結果は、analysed・failed で知らせずに捨てる。
+    """
+    analysed = pyqtSignal(str, str, object)
+    failed = pyqtSignal(str, str)
+
+    def __init__(self, analyse, settle_ms=1000, poll_ms=250, parent=None):
+        super().__init__(parent)
+        self.analyse = analyse
+        self.settle = settle_ms / 1000
+        self.directory = None
+        self.generation = 0  # stop() のたびに増やし、それより前に始めた解析の結果を見分ける
+        self.seen = set()
+        self.pending = {}  # filepath -> ((size, mtime_ns), 変化を最後に確認した時刻)
+
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.scan)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(poll_ms)
+        self.timer.timeout.connect(self.check_pending)
+
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(2)
+        self.signals = _WorkerSignals(self)
+        self.signals.finished.connect(self._on_finished)
+        self.signals.failed.connect(self._on_failed)
+
+    @property
+    def is_running(self):
+        return self.directory is not None
+
+    def start(self, directory):
+        """監視を始める。既にある画像は解析しない"""
+        self.stop()
+        self.directory = directory
+        self.seen = set(self._list_images())
+        self.watcher.addPath(directory)
+
+    def stop(self):
+        if self.directory is not None:
+            self.watcher.removePath(self.directory)
+        self.directory = None
+        self.generation += 1
+        self.pending.clear()
+        self.timer.stop()
+
+    def _on_finished(self, generation, filepath, digest, result):
+        if generation == self.generation:
+            self.analysed.emit(filepath, digest, result)
+
+    def _on_failed(self, generation, filepath, error):
+        if generation == self.generation:
+            self.failed.emit(filepath, error)
+
+    def _list_images(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return [os.path.join(self.directory, name) for name in names if name.lower().endswith(IMAGE_SUFFIXES)]
+
+    def scan(self, *args):
+        now = time.monotonic()
+        for filepath in self._list_images():
+            if filepath not in self.seen and filepath not in self.pending:
+                self.pending[filepath] = (None, now)
+        if self.pending and not self.timer.isActive():
+            self.timer.start()
+
+    def check_pending(self):
+        now = time.monotonic()
+        for filepath, (signature, changed_at) in list(self.pending.items()):
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                # 一時ファイルがリネームされた場合など
+                del self.pending[filepath]
+                continue
+
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != signature:
+                self.pending[filepath] = (current, now)
+            elif stat.st_size and now - changed_at >= self.settle:
+                del self.pending[filepath]
+                self.seen.add(filepath)
+                self.pool.start(_AnalyseTask(self.generation, filepath, self.analyse, self.signals))
+
+        if not self.pending:
+            self.timer.stop()
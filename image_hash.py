@@ -0,0 +1,61 @@
+"""サムネイルの知覚ハッシュ（pHash と dHash）と、ハミング距離による検索
+
+どちらも 64 ビットで、SQLite の INTEGER にそのまま入るよう符号付きの int で扱う。
+検索では全ポーションのハッシュを uint64 の配列にして、XOR とビット数えで距離をまとめて求める。
+"""
+import numpy as np
+from PIL import Image
+
+HASH_BITS = 64
+PHASH_SIZE = 32
+_DCT = np.cos(
+    np.pi * (2 * np.arange(PHASH_SIZE)[np.newaxis, :] + 1) * np.arange(PHASH_SIZE)[:, np.newaxis] / (2 * PHASH_SIZE)
+)
+
+
+def _to_signed(bits):
+    value = int.from_bytes(np.packbits(bits.reshape(-1)).tobytes(), 'big')
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def phash(img):
+    """縮小したグレースケール画像の DCT の低周波成分が中央値より大きいかどうか"""
+    gray = np.asarray(img.convert("L").resize((PHASH_SIZE, PHASH_SIZE), Image.Resampling.LANCZOS), dtype=np.float32)
+    low = (_DCT @ gray @ _DCT.T)[:8, :8]
+    return _to_signed(low > np.median(low.reshape(-1)[1:]))
+
+
+def dhash(img):
+    """9x8 に縮小したグレースケール画像で、隣の画素より明るいかどうか"""
+    gray = np.asarray(img.convert("L").resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    return _to_signed(gray[:, 1:] > gray[:, :-1])
+
+
+def image_hashes(img):
+    """(pHash, dHash) を返す"""
+    return phash(img), dhash(img)
+
+
+def hamming_distances(hashes, value):
+    """int64 の配列 hashes の各要素と value のハミング距離"""
+    diff = np.bitwise_xor(hashes.view(np.uint64), np.int64(value).view(np.uint64))
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(diff).astype(np.int32)
+    return np.unpackbits(diff.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1, dtype=np.int32)
+
+
+def rank_by_hash(entries, query, k=50):
+    """entries の [(ファイルパス, pHash, dHash), ...] を query の (pHash, dHash) に近い順に並べる
+
+    戻り値は [(ファイルパス, 類似度), ...]。類似度は 2 つのハッシュの一致したビットの割合。
+    """
+    if not entries:
+        return []
+    paths = [entry[0] for entry in entries]
+    hashes = np.array([entry[1:] for entry in entries], dtype=np.int64)
+    distances = hamming_distances(hashes[:, 0], query[0]) + hamming_distances(hashes[:, 1], query[1])
+
+    k = min(k, len(paths))
+    top = np.argpartition(distances, k - 1)[:k]
+    top = top[np.argsort(distances[top], kind='stable')]
+    return [(paths[i], 1 - int(distances[i]) / (2 * HASH_BITS)) for i in top]
@@ -0,0 +1,189 @@
+"""NAS などの遅いストレージからポーションを読むための I/O スケジューラ
+
+1 ファイルずつ順番に開いて読むと、待ち時間がファイル数の分だけ積み重なる。
+ReadScheduler は決まった本数のスレッドで先読みし、ファイル全体を 1 回の read で読んで、入力順に結果を返す。
+時間内に終わらないファイルは ReadTimeout として報告して飛ばし、一時的な OSError は間隔を空けて読み直す。
+Qt に依存しない。LatencyFileSystem は手元で遅いストレージを再現するためのもの。
+"""
+import errno
+import os
+import random
+import threading
+import time
+from collections import deque
+from queue import SimpleQueue
+
+DEFAULT_CONCURRENCY = 16
+# 1 回の読み込み（リトライは別に数える）にかけてよい秒数
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_RETRIES = 2
+# リトライの待ち時間。2 回目以降は倍にしていく
+DEFAULT_RETRY_DELAY = 0.2
+
+
+class ReadTimeout(TimeoutError):
+    pass
+
+
+class LocalFileSystem:
+    """普通のファイルシステム"""
+
+    def read_bytes(self, path):
+        # バッファ無しで開くと readall がファイルサイズ分を確保して、まとめて読む
+        with open(path, 'rb', buffering=0) as f:
+            return f.readall()
+
+    def stat(self, path):
+        return os.stat(path)
+
+
+class LatencyFileSystem:
+    """read_bytes と stat の前に待ち時間を入れて、遅いストレージを再現する（ベンチマーク・動作確認用）
+
+    failure_rate の割合で一時的な OSError を起こし、stall に含まれるパスは release() まで止まったままにする。
+    """
+
+    def __init__(self, base=None, latency=0.02, jitter=0.0, failure_rate=0.0, stall=(), seed=0):
+        self.base = base or LocalFileSystem()
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.stall = set(stall)
+        self._released = threading.Event()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _wait(self, path):
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            failed = self._random.random() < self.failure_rate
+        if path in self.stall:
+            self._released.wait()
+        time.sleep(delay)
+        if failed:
+            raise OSError(errno.EIO, "injected I/O error", path)
+
+    def read_bytes(self, path):
+        self._wait(path)
+        return self.base.read_bytes(path)
+
+    def stat(self, path):
+        self._wait(path)
+        return self.base.stat(path)
+
+    def release(self):
+        """stall で止めている読み込みを再開させる"""
+        self._released.set()
+
+
+class _Job:
+    __slots__ = ("item", "started", "attempt_started", "result", "error", "done", "abandoned", "lock")
+
+    def __init__(self, item):
+        self.item = item
+        self.started = threading.Event()
+        self.attempt_started = None
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self.abandoned = False
+        self.lock = threading.Lock()
+
+
+class ReadScheduler:
+    """ファイルの読み込みを concurrency 本のスレッドで並行に行う
+
+    結果は入力順に返し、先読みするのは read_ahead 件までにしてメモリの使用量を抑える。
+    止まったまま戻らない読み込みはスレッドごと見捨て、代わりのスレッドを立てて並行数を保つ。
+    スレッドはデーモンなので、見捨てたものが残っていてもアプリの終了は妨げない。
+    """
+
+    def __init__(self, fs=None, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT,
+                 retries=DEFAULT_RETRIES, retry_delay=DEFAULT_RETRY_DELAY, read_ahead=None):
+        self.fs = fs or LocalFileSystem()
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.read_ahead = read_ahead or self.concurrency * 4
+
+    def read_all(self, paths):
+        """各ファイルの中身を (パス, バイト列, エラー) で入力順に返す。読めなかったものはバイト列が None"""
+        return self.map(self.fs.read_bytes, paths)
+
+    def stat_all(self, paths):
+        """各ファイルの os.stat を (パス, stat, エラー) で入力順に返す"""
+        return self.map(self.fs.stat, paths)
+
+    def map(self, func, items):
+        """func(item) を並行に呼び、(item, 結果, エラー) を入力順に返すジェネレータ"""
+        tasks = SimpleQueue()
+
+        def worker():
+            while True:
+                job = tasks.get()
+                if job is None or not self._run(func, job):
+                    return
+
+        def spawn():
+            threading.Thread(target=worker, daemon=True).start()
+
+        for _ in range(self.concurrency):
+            spawn()
+        pending = deque()
+        try:
+            for item in items:
+                job = _Job(item)
+                pending.append(job)
+                tasks.put(job)
+                if len(pending) >= self.read_ahead:
+                    yield self._finish(pending.popleft(), spawn)
+            while pending:
+                yield self._finish(pending.popleft(), spawn)
+        finally:
+            # 途中で打ち切られた場合は、まだ始まっていないものを読まずに捨てる
+            for job in pending:
+                job.abandoned = True
+            for _ in range(self.concurrency):
+                tasks.put(None)
+
+    def _run(self, func, job):
+        """job を実行する。job が見捨てられていたら False を返し、そのスレッドは終わる"""
+        if job.abandoned:
+            return True
+        job.attempt_started = time.monotonic()
+        job.started.set()
+        for attempt in range(self.retries + 1):
+            try:
+                job.result = func(job.item)
+                job.error = None
+                break
+            except OSError as e:
+                job.error = e
+                if attempt == self.retries or job.abandoned:
+                    break
+                time.sleep(self.retry_delay * 2 ** attempt)
+                job.attempt_started = time.monotonic()
+            except Exception as e:
+                job.error = e
+                break
+        with job.lock:
+            job.done.set()
+            return not job.abandoned
+
+    def _finish(self, job, spawn):
+        """job の完了を待つ。1 回の試行が timeout 秒を超えたら、ReadTimeout を返して次に進む"""
+        job.started.wait()
+        while True:
+            remaining = job.attempt_started + self.timeout - time.monotonic()
+            if job.done.wait(max(0.0, remaining)):
+                return job.item, job.result, job.error
+            if time.monotonic() - job.attempt_started < self.timeout:
+                # 待っている間にリトライが始まった
+                continue
+            with job.lock:
+                if job.done.is_set():
+                    return job.item, job.result, job.error
+                job.abandoned = True
+            spawn()
+            return job.item, None, ReadTimeout(f"{self.timeout:g} 秒以内に読み込みが終わりませんでした")
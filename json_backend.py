@@ -0,0 +1,50 @@
+"""JSON の読み書きを一か所にまとめる
+
+orjson がインストールされていればそれを使い、無ければ標準の json にフォールバックする。
+どちらのバックエンドでも bytes を直接扱い、ファイルは 1 回の read でまとめて読み込む。
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson else "json"
+
+
+def loads(data):
+    """bytes または str の JSON を読み込む"""
+    if orjson:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # NaN や BOM 付きなど、orjson が受け付けない書式は標準の json に任せる
+            pass
+    return json.loads(data)
+
+
+def dumps(obj, indent=False):
+    """UTF-8 の bytes に書き出す。indent が真なら 2 スペースで整形する"""
+    if orjson:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+        except TypeError:
+            # 64bit を超える整数など、orjson が書き出せない値は標準の json に任せる
+            pass
+    if indent:
+        text = json.dumps(obj, indent=2, ensure_ascii=False)
+    else:
+        text = json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+    return text.encode('utf-8')
+
+
+def read_json(path):
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def write_json(path, obj, indent=False):
+    data = dumps(obj, indent=indent)
+    with open(path, 'wb') as f:
+        f.write(data)
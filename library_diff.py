@@ -0,0 +1,141 @@
+"""2 つのライブラリ（フォルダかバンドル）を索引 (EncodingIndex) から比べて、足りないポーションを埋める
+
+ポーションファイルを開き直さず、索引にある encoding の digest とバージョンだけで比べる。
+同じ (バージョン, digest) の encoding を 1 つでも持つポーションどうしを同じポーションとみなし、
+片方にしか無いもの、バージョンごとの情報抽出度の組み合わせが違うもの、importInfo が違うものを挙げる。
+Qt に依存しない。
+"""
+import os
+import shutil
+from collections import Counter, namedtuple
+
+import json_backend
+import potion_bundle
+
+LEFT_ONLY = "left_only"
+RIGHT_ONLY = "right_only"
+INFO_EXTRACTED = "info_extracted"
+IMPORTINFO = "importinfo"
+
+# kind は上の定数。片方にしか無い場合、無い側のパスは None
+# detail は INFO_EXTRACTED なら version_key -> (左の情報抽出度の集合, 右の集合)、IMPORTINFO なら (左, 右) の importInfo
+DiffEntry = namedtuple("DiffEntry", "kind left right detail")
+
+
+def info_sets(encodings):
+    """[(digest, version_key, info_extracted), ...] を version_key -> 情報抽出度の frozenset にする"""
+    sets = {}
+    for _, version_key, info_extracted in encodings:
+        sets.setdefault(version_key, set()).add(info_extracted)
+    return {version_key: frozenset(values) for version_key, values in sets.items()}
+
+
+def _restrict(contents, version_key):
+    if version_key is None:
+        return contents
+    restricted = {}
+    for path, (importinfo, encodings) in contents.items():
+        encodings = [enc for enc in encodings if enc[1] == version_key]
+        if encodings:
+            restricted[path] = (importinfo, encodings)
+    return restricted
+
+
+def diff_libraries(left, right, version_key=None):
+    """EncodingIndex.contents_of の結果どうしを比べて、DiffEntry のリストを返す
+
+    version_key を指定すると、そのバージョンの encoding だけで比べる（持っていないポーションは対象外）。
+    """
+    left = _restrict(left, version_key)
+    right = _restrict(right, version_key)
+
+    right_by_digest = {}
+    for path, (_, encodings) in right.items():
+        for digest, vk, _ in encodings:
+            right_by_digest.setdefault((vk, digest), []).append(path)
+    left_digests = {(vk, digest) for _, encodings in left.values() for digest, vk, _ in encodings}
+
+    entries = []
+    for path in sorted(left):
+        importinfo, encodings = left[path]
+        shared = Counter(
+            other for digest, vk, _ in encodings for other in right_by_digest.get((vk, digest), ()))
+        if not shared:
+            entries.append(DiffEntry(LEFT_ONLY, path, None, None))
+            continue
+        # 同じファイル名があればそれを、無ければ共有する encoding が最も多いものを対応させる
+        name = os.path.basename(path)
+        other = next((p for p in shared if os.path.basename(p) == name), None) or shared.most_common(1)[0][0]
+
+        other_importinfo, other_encodings = right[other]
+        left_sets, right_sets = info_sets(encodings), info_sets(other_encodings)
+        differing = {
+            vk: (left_sets.get(vk, frozenset()), right_sets.get(vk, frozenset()))
+            for vk in sorted(left_sets.keys() | right_sets.keys())
+            if left_sets.get(vk) != right_sets.get(vk)
+        }
+        if differing:
+            entries.append(DiffEntry(INFO_EXTRACTED, path, other, differing))
+        if importinfo != other_importinfo:
+            entries.append(DiffEntry(IMPORTINFO, path, other, (importinfo, other_importinfo)))
+
+    for path in sorted(right):
+        if not any((vk, digest) in left_digests for digest, vk, _ in right[path][1]):
+            entries.append(DiffEntry(RIGHT_ONLY, None, path, None))
+    return entries
+
+
+def copy_potions(paths, directory):
+    """ポーションを directory にコピーし、コピー先のパスのリストを返す。バンドル内のものは取り出してコピーする"""
+    copied = []
+    for path in paths:
+        dest = potion_bundle.unique_destination(directory, os.path.basename(path))
+        shutil.copy2(potion_bundle.local_path(path), dest)
+        copied.append(dest)
+    return copied
+
+
+def merge_encodings(source, target, version_key=None):
+    """source にあって target に無い情報抽出度の encoding を target のファイルに書き足し、書き足した数を返す"""
+    source_data = json_backend.read_json(potion_bundle.local_path(source))
+    target_data = json_backend.read_json(target)
+    added = 0
+    for vk, items in source_data.get("encodings", {}).items():
+        if version_key is not None and vk != version_key:
+            continue
+        target_items = target_data.setdefault("encodings", {}).setdefault(vk, {})
+        existing = {item.get("params", {}).get("information_extracted") for item in target_items.values()}
+        for key, item in items.items():
+            info_extracted = item.get("params", {}).get("information_extracted")
+            if not item.get("encoding") or info_extracted in existing or key in target_items:
+                continue
+            target_items[key] = item
+            existing.add(info_extracted)
+            added += 1
+    if added:
+        tmp_path = target + ".tmp"
+        json_backend.write_json(tmp_path, target_data)
+        os.replace(tmp_path, target)
+    return added
+
+
+def fill_gaps(entries, direction, directory, version_key=None):
+    """差分を埋める。direction が "right" なら左にあるものを右へ、"left" なら右にあるものを左へ写す
+
+    directory は写す先のフォルダ（バンドルには書き込めない）。
+    片方にしか無いポーションはコピーし、情報抽出度が足りないポーションには encoding を書き足す。
+    (コピーした数, encoding を書き足した数, [(パス, エラー), ...]) を返す。
+    """
+    missing_kind = LEFT_ONLY if direction == "right" else RIGHT_ONLY
+    copied = merged = 0
+    errors = []
+    for entry in entries:
+        source, target = (entry.left, entry.right) if direction == "right" else (entry.right, entry.left)
+        try:
+            if entry.kind == missing_kind:
+                copied += len(copy_potions([source], directory))
+            elif entry.kind == INFO_EXTRACTED:
+                merged += merge_encodings(source, target, version_key)
+        except Exception as e:
+            errors.append((source, e))
+    return copied, merged, errors
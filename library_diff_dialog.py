@@ -0,0 +1,140 @@
+import os
+from PyQt6.QtWidgets import (
+    QDialog, QVBoxLayout, QHBoxLayout, QLabel, QComboBox, QPushButton, QTreeWidget, QTreeWidgetItem, QMessageBox
+)
+import potion_bundle
+import library_diff
+from encoding_index import VERSION_LABELS
+
+KIND_LABELS = {
+    library_diff.LEFT_ONLY: "左だけ",
+    library_diff.RIGHT_ONLY: "右だけ",
+    library_diff.INFO_EXTRACTED: "情報抽出度が違う",
+    library_diff.IMPORTINFO: "importInfo が違う",
+}
+
+
+def format_info(values):
+    return ", ".join(sorted(("不明" if value is None else f"{value}" for value in values), reverse=True)) or "なし"
+
+
+def format_detail(entry):
+    if entry.kind == library_diff.INFO_EXTRACTED:
+        return " / ".join(
+            f"{VERSION_LABELS.get(vk, vk)}: {format_info(left)} ↔ {format_info(right)}"
+            for vk, (left, right) in entry.detail.items()
+        )
+    if entry.kind == library_diff.IMPORTINFO:
+        left, right = entry.detail
+        keys = sorted(key for key in left.keys() | right.keys() if left.get(key) != right.get(key))
+        return " / ".join(f"{key}: {left.get(key, '-')} ↔ {right.get(key, '-')}" for key in keys)
+    return ""
+
+
+class LibraryDiffDialog(QDialog):
+    """設定したフォルダ・バンドルから 2 つを選んで、索引の内容で比べる"""
+
+    def __init__(self, main_window, parent=None):
+        super().__init__(parent)
+        self.main_window = main_window
+        self.setWindowTitle("ライブラリの比較")
+        self.resize(900, 600)
+        self.entries = []
+        self.compared = None
+
+        self.left_select = QComboBox()
+        self.right_select = QComboBox()
+        for select in (self.left_select, self.right_select):
+            select.addItems(main_window.directories)
+        if len(main_window.directories) > 1:
+            self.right_select.setCurrentIndex(1)
+        self.version_select = QComboBox()
+        self.version_select.addItem("全バージョン", None)
+        for version_key, label in VERSION_LABELS.items():
+            self.version_select.addItem(label, version_key)
+        compare_button = QPushButton("比較")
+        compare_button.clicked.connect(self.compare)
+
+        select_layout = QHBoxLayout()
+        select_layout.addWidget(QLabel("左"))
+        select_layout.addWidget(self.left_select, 1)
+        select_layout.addWidget(QLabel("右"))
+        select_layout.addWidget(self.right_select, 1)
+        select_layout.addWidget(self.version_select)
+        select_layout.addWidget(compare_button)
+
+        self.summary_label = QLabel("")
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels(["種類", "左", "右", "内容"])
+        self.tree.setRootIsDecorated(False)
+        self.tree.setSortingEnabled(True)
+
+        self.fill_left_button = QPushButton("左に足りないものを右から写す")
+        self.fill_left_button.clicked.connect(lambda: self.fill_gaps("left"))
+        self.fill_right_button = QPushButton("右に足りないものを左から写す")
+        self.fill_right_button.clicked.connect(lambda: self.fill_gaps("right"))
+        close_button = QPushButton("閉じる")
+        close_button.clicked.connect(self.accept)
+
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.fill_left_button)
+        button_layout.addWidget(self.fill_right_button)
+        button_layout.addStretch()
+        button_layout.addWidget(close_button)
+
+        layout = QVBoxLayout(self)
+        layout.addLayout(select_layout)
+        layout.addWidget(self.summary_label)
+        layout.addWidget(self.tree)
+        layout.addLayout(button_layout)
+        self.update_buttons()
+
+    def compare(self):
+        left, right = self.left_select.currentText(), self.right_select.currentText()
+        if not left or not right or left == right:
+            QMessageBox.information(self, "ライブラリの比較", "違うフォルダを 2 つ選んでください。")
+            return
+        version_key = self.version_select.currentData()
+        index = self.main_window.encoding_index
+        self.entries = library_diff.diff_libraries(index.contents_of(left), index.contents_of(right), version_key)
+        self.compared = (left, right, version_key)
+
+        self.tree.setSortingEnabled(False)
+        self.tree.clear()
+        for entry in self.entries:
+            QTreeWidgetItem(self.tree, [
+                KIND_LABELS[entry.kind],
+                os.path.basename(entry.left) if entry.left else "",
+                os.path.basename(entry.right) if entry.right else "",
+                format_detail(entry),
+            ])
+        self.tree.setSortingEnabled(True)
+        for column in range(3):
+            self.tree.resizeColumnToContents(column)
+
+        counts = {kind: 0 for kind in KIND_LABELS}
+        for entry in self.entries:
+            counts[entry.kind] += 1
+        self.summary_label.setText(
+            "、".join(f"{label} {counts[kind]} 件" for kind, label in KIND_LABELS.items()) if self.entries
+            else "違いはありません。"
+        )
+        self.update_buttons()
+
+    def update_buttons(self):
+        # バンドルは読み取り専用なので写す先にはできない
+        left, right = self.compared[:2] if self.compared else (None, None)
+        self.fill_left_button.setEnabled(bool(self.entries) and left is not None and not potion_bundle.is_bundle(left))
+        self.fill_right_button.setEnabled(bool(self.entries) and right is not None and not potion_bundle.is_bundle(right))
+
+    def fill_gaps(self, direction):
+        left, right, version_key = self.compared
+        directory = left if direction == "left" else right
+        copied, merged, errors = library_diff.fill_gaps(self.entries, direction, directory, version_key)
+        message = f"{copied} 個のポーションをコピーし、{merged} 個の encoding を書き足しました。"
+        if errors:
+            message += "\n" + "\n".join(f"[エラー] {os.path.basename(path)}: {str(e)}" for path, e in errors)
+        QMessageBox.information(self, "ライブラリの比較", message)
+
+        self.main_window.load_files()
+        self.compare()
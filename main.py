@@ -1,9 +1,9 @@
 import sys
 import os
-import json
-import re
-import base64
+import json_backend
 import utils
+import potion_bundle
+from multiprocessing import freeze_support
 from pathlib import Path
 from math import cos, sin, pi
 from PyQt6.QtWidgets import (
@@ -11,11 +11,30 @@ from PyQt6.QtWidgets import (
     QMessageBox, QDialog, QListWidget, QPushButton, QVBoxLayout, QHBoxLayout, QLineEdit
 )
 from PyQt6.QtGui import QAction, QPixmap, QImage, QActionGroup, QColor, QPainter, QFont
-from PyQt6.QtCore import Qt, QTimer
+from PyQt6.QtCore import Qt, QTimer, QThreadPool
+from PIL import Image, UnidentifiedImageError
 from browse_tab_widget import BrowseTabWidget
 from potion_tab_widget import PotionTabWidget
+from library_diff_dialog import LibraryDiffDialog
+from coverage_tab_widget import CoverageTabWidget
+from thumbnail_pipeline import ThumbnailPipeline
+from thumbnail_atlas import ThumbnailAtlas
+from encoding_index import EncodingIndex, VERSION_KEYS, encoding_digest
+from similarity_index import SimilarityIndex
+from image_hash import image_hashes, rank_by_hash
+import query_service
+from io_scheduler import ReadScheduler, DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT, DEFAULT_RETRIES
+import vibe_core
+from file_operation_task import FileOperationSignals, FileOperationTask, TRASH, UNDO
 
 CONFIG_FILE = "config.json"
+CACHE_DIR = "cache"
+INDEX_FILE = "index.sqlite3"
+# 元に戻せる名前の変更・移動の数
+UNDO_LIMIT = 20
+# 読み込み中に索引へ書き込んだものをまとめて確定する件数。ポーション確認タブの ResolveTask も
+# 別の接続で索引に書き込むので、読み込みの間ずっと書き込みのロックを持ち続けないようにする
+INDEX_COMMIT_INTERVAL = 64
 default_config = {
     "version": "v4.5",
     "thumbnail_size": 128,
@@ -29,8 +48,7 @@ default_config = {
 def load_config():
     if os.path.exists(CONFIG_FILE):
         try:
-            with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
+            return json_backend.read_json(CONFIG_FILE)
         except Exception:
             pass
     return default_config
@@ -38,8 +56,7 @@ def load_config():
 
 def save_config(config):
     try:
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
+        json_backend.write_json(CONFIG_FILE, config, indent=True)
     except Exception as e:
         print(f"設定ファイルの保存に失敗しました: {e}")
 
@@ -87,22 +104,6 @@ def create_placeholder_image(size=128) -> QImage:
     return image
 
 
-def get_b64thumbnail(filepath):
-    with open(filepath, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    b64_thumb = data.get("thumbnail")
-    if not b64_thumb:
-        no_thumb = True
-        image = create_placeholder_image()
-    else:
-        no_thumb = False
-        b64_thumb = re.sub('^data:image/.+;base64,', '', b64_thumb).encode('utf-8')
-        image_data = base64.b64decode(b64_thumb)
-        image = QImage.fromData(image_data)
-    return data, image, no_thumb
-
-
 class DirectorySettingsDialog(QDialog):
     def __init__(self, directories, parent=None):
         super().__init__(parent)
@@ -115,15 +116,18 @@ class DirectorySettingsDialog(QDialog):
         self.list_widget.addItems(self.directories)
 
         add_button = QPushButton("追加")
+        add_bundle_button = QPushButton("バンドルを追加")
         remove_button = QPushButton("削除")
         close_button = QPushButton("閉じる")
 
         add_button.clicked.connect(self.add_directory)
+        add_bundle_button.clicked.connect(self.add_bundle)
         remove_button.clicked.connect(self.remove_selected)
         close_button.clicked.connect(self.accept)
 
         button_layout = QVBoxLayout()
         button_layout.addWidget(add_button)
+        button_layout.addWidget(add_bundle_button)
         button_layout.addWidget(remove_button)
         button_layout.addStretch()
         button_layout.addWidget(close_button)
@@ -138,6 +142,13 @@ class DirectorySettingsDialog(QDialog):
             self.directories.append(folder)
             self.list_widget.addItem(folder)
 
+    def add_bundle(self):
+        filepath, _ = QFileDialog.getOpenFileName(
+            self, "バンドルを追加", "", f"ポーションバンドル (*{potion_bundle.BUNDLE_SUFFIX})")
+        if filepath and filepath not in self.directories:
+            self.directories.append(filepath)
+            self.list_widget.addItem(filepath)
+
     def remove_selected(self):
         selected_items = self.list_widget.selectedItems()
         for item in selected_items:
@@ -166,6 +177,19 @@ class Naiv4VibeViewer(QMainWindow):
                 del self.directories[i]
         self.sort_order = self.config["sort_order"]
         self.version = self.config["version"]
+        self.thumbnail_pipeline = ThumbnailPipeline()
+        self.thumbnail_atlas = ThumbnailAtlas(CACHE_DIR, self.thumbnail_size)
+        self.encoding_index = EncodingIndex(os.path.join(CACHE_DIR, INDEX_FILE))
+        self.similarity_index = SimilarityIndex(CACHE_DIR, VERSION_KEYS.get(self.version))
+        self.path_pixmaps = {}  # filepath -> 読み込み済みのサムネイル
+        self.query_server = None
+
+        self.operation_pool = QThreadPool(self)
+        self.operation_pool.setMaxThreadCount(1)
+        self.operation_signals = FileOperationSignals()
+        self.operation_signals.finished.connect(self.on_file_operation_finished)
+        self.operation_running = False
+        self.undo_stack = []  # [(操作の種類, [(元のパス, 新しいパス), ...]), ...]
 
         self.tabs = QTabWidget()
         self.setCentralWidget(self.tabs)
@@ -178,7 +202,13 @@ class Naiv4VibeViewer(QMainWindow):
         self.potion_tab.set_encoding_thumbnail_map(self.encoding_thumbnail_map)
         self.tabs.addTab(self.potion_tab, "ポーション確認")
 
+        self.coverage_tab = CoverageTabWidget(self)
+        self.tabs.addTab(self.coverage_tab, "情報抽出度の一覧")
+        self.tabs.currentChanged.connect(self.on_tab_changed)
+
         self.setup_menu()
+        if self.config.get("query_service"):
+            self.toggle_query_service(True)
 
         if self.directories:
             QTimer.singleShot(0, self.load_files)
@@ -192,6 +222,17 @@ class Naiv4VibeViewer(QMainWindow):
         reload_action = QAction("更新", self)
         reload_action.triggered.connect(self.load_files)
 
+        diff_action = QAction("ライブラリを比較", self)
+        diff_action.triggered.connect(self.compare_libraries)
+
+        bundle_menu = QMenu("バンドル", self)
+        export_bundle_action = QAction("フォルダをバンドルに書き出す", self)
+        export_bundle_action.triggered.connect(self.export_bundle)
+        bundle_menu.addAction(export_bundle_action)
+        import_bundle_action = QAction("バンドルをフォルダに取り込む", self)
+        import_bundle_action.triggered.connect(self.import_bundle)
+        bundle_menu.addAction(import_bundle_action)
+
         config_menu = QMenu("設定", self)
 
         size_action = QAction("表示サイズ変更", self)
@@ -221,6 +262,17 @@ class Naiv4VibeViewer(QMainWindow):
         self.toggle_no_thumbnail_action.triggered.connect(self.toggle_no_thumbnail_display)
         config_menu.addAction(self.toggle_no_thumbnail_action)
 
+        port = self.config.get("query_service_port", query_service.DEFAULT_PORT)
+        self.query_service_action = QAction(f"問い合わせサービスを起動する (127.0.0.1:{port})", self, checkable=True)
+        self.query_service_action.setChecked(bool(self.config.get("query_service")))
+        self.query_service_action.triggered.connect(self.toggle_query_service)
+        config_menu.addAction(self.query_service_action)
+
+        self.slow_storage_action = QAction("低速ストレージ向けに並行して読み込む（NAS など）", self, checkable=True)
+        self.slow_storage_action.setChecked(bool(self.config.get("slow_storage")))
+        self.slow_storage_action.triggered.connect(self.toggle_slow_storage)
+        config_menu.addAction(self.slow_storage_action)
+
         version_menu = QMenu("version切り替え", self)
         version_actions = {
             "v4.5": QAction("V4.5", self),
@@ -241,6 +293,8 @@ class Naiv4VibeViewer(QMainWindow):
 
         menu_bar.addAction(folder_action)
         menu_bar.addAction(reload_action)
+        menu_bar.addAction(diff_action)
+        menu_bar.addMenu(bundle_menu)
         menu_bar.addMenu(config_menu)
         self.setMenuBar(menu_bar)
 
@@ -250,6 +304,10 @@ class Naiv4VibeViewer(QMainWindow):
         save_config(self.config)
         self.load_files()
 
+    def set_watch_directory(self, directory):
+        self.config["watch_directory"] = directory
+        save_config(self.config)
+
     def set_sort_order(self, order):
         self.sort_order = order
         self.config["sort_order"] = order
@@ -257,6 +315,93 @@ class Naiv4VibeViewer(QMainWindow):
         self.browse_tab.sort_thumbnails(order)
         self.reload_files()
 
+    def compare_libraries(self):
+        if len(self.directories) < 2:
+            QMessageBox.information(self, "ライブラリの比較", "比べるフォルダかバンドルを「フォルダ設定」で 2 つ以上追加してください。")
+            return
+        LibraryDiffDialog(self, self).exec()
+
+    def run_file_operation(self, kind, targets):
+        """ファイルの名前の変更・移動・ゴミ箱への移動をワーカーで行う
+
+        targets はゴミ箱ならパスのリスト、それ以外は (元のパス, 新しいパス) の組のリスト。
+        終わったら読み直さずに、読み込み済みの項目とキャッシュのパスだけを書き換える。
+        """
+        if not targets:
+            return
+        if self.operation_running:
+            QMessageBox.information(self, "処理中", "前のファイル操作が終わるまでお待ちください。")
+            return
+        self.operation_running = True
+        self.operation_pool.start(
+            FileOperationTask(kind, targets, os.path.join(CACHE_DIR, INDEX_FILE), self.operation_signals))
+
+    def undo_file_operation(self):
+        """最後の名前の変更・移動を元に戻す"""
+        if self.undo_stack:
+            kind, pairs = self.undo_stack[-1]
+            self.run_file_operation(UNDO, [(new, old) for old, new in reversed(pairs)])
+
+    def on_file_operation_finished(self, kind, done, errors):
+        self.operation_running = False
+        self.invalidate_coverage()
+        if kind == TRASH:
+            self.forget_paths(done)
+        elif done:
+            self.rename_paths(done)
+            if kind == UNDO:
+                self.undo_stack.pop()
+            else:
+                self.undo_stack.append((kind, done))
+                del self.undo_stack[:-UNDO_LIMIT]
+        if errors:
+            QMessageBox.warning(self, "エラー", "\n".join(errors))
+
+    def rename_paths(self, pairs):
+        """名前の変更や移動に合わせて、読み込み済みの項目とキャッシュのパスを付け替える"""
+        mapping = dict(pairs)
+        self.thumbnail_atlas.rename_paths(pairs)
+        self.thumbnail_atlas.save()
+        self.similarity_index.rename_paths(pairs)
+        self.path_pixmaps = {mapping.get(path, path): pixmap for path, pixmap in self.path_pixmaps.items()}
+        # ポーション確認タブと共有している dict なので、作り直さずに書き換える
+        for enc, (pixmap, info_extracted, filepath) in self.encoding_thumbnail_map.items():
+            if filepath in mapping:
+                self.encoding_thumbnail_map[enc] = (pixmap, info_extracted, mapping[filepath])
+        self.browse_tab.rename_items(pairs)
+
+    def forget_paths(self, paths):
+        """ゴミ箱に移したポーションを、読み込み済みの項目とキャッシュから取り除く"""
+        removed = set(paths)
+        self.thumbnail_atlas.remove_paths(removed)
+        self.thumbnail_atlas.save()
+        self.similarity_index.remove_paths(removed)
+        self.similarity_index.save()
+        for path in removed:
+            self.path_pixmaps.pop(path, None)
+        self.browse_tab.remove_items(removed)
+
+        # 同じ encoding を持つ別のポーションが読み込まれていれば、そちらに付け替える
+        # （ポーション確認タブと共有している dict なので、作り直さずに書き換える）
+        orphaned = [enc for enc, value in self.encoding_thumbnail_map.items() if value[2] in removed]
+        if not orphaned:
+            return
+        digests = {encoding_digest(enc): enc for enc in orphaned}
+        loaded = {item[1]: item[0] for item in self.browse_tab.items}
+        version_key = VERSION_KEYS.get(self.version)
+        candidates = self.encoding_index.lookup(digests)
+        for digest, enc in digests.items():
+            found = [
+                (info_extracted, path) for vk, info_extracted, path in candidates.get(digest, [])
+                if vk == version_key and path in loaded and path not in removed
+            ]
+            if not found:
+                del self.encoding_thumbnail_map[enc]
+                continue
+            # 読み込み時と同じく、情報抽出度が分かっているものを優先する
+            info_extracted, path = max(found, key=lambda entry: entry[0] is not None)
+            self.encoding_thumbnail_map[enc] = (loaded[path], info_extracted, path)
+
     def select_folders(self):
         dialog = DirectorySettingsDialog(self.directories, self)
         if dialog.exec():
@@ -265,12 +410,82 @@ class Naiv4VibeViewer(QMainWindow):
             save_config(self.config)
             self.load_files()
 
+    def export_bundle(self):
+        directory = QFileDialog.getExistingDirectory(self, "書き出すフォルダを選択")
+        if not directory:
+            return
+        bundle_path, _ = QFileDialog.getSaveFileName(
+            self, "バンドルの保存先", os.path.basename(directory) + potion_bundle.BUNDLE_SUFFIX,
+            f"ポーションバンドル (*{potion_bundle.BUNDLE_SUFFIX})")
+        if not bundle_path:
+            return
+        if not bundle_path.endswith(potion_bundle.BUNDLE_SUFFIX):
+            bundle_path += potion_bundle.BUNDLE_SUFFIX
+
+        try:
+            count = potion_bundle.export_bundle(directory, bundle_path, get_mtime=utils.creation_date)
+        except Exception as e:
+            QMessageBox.critical(self, "エラー", f"バンドルの書き出しに失敗しました：{str(e)}")
+            return
+        QMessageBox.information(self, "書き出し完了", f"{count} 個のポーションを書き出しました。")
+
+    def import_bundle(self):
+        bundle_path, _ = QFileDialog.getOpenFileName(
+            self, "取り込むバンドルを選択", "", f"ポーションバンドル (*{potion_bundle.BUNDLE_SUFFIX})")
+        if not bundle_path:
+            return
+        directory = QFileDialog.getExistingDirectory(self, "取り込み先のフォルダを選択")
+        if not directory:
+            return
+
+        try:
+            imported, skipped = potion_bundle.import_bundle(bundle_path, directory)
+        except Exception as e:
+            QMessageBox.critical(self, "エラー", f"バンドルの取り込みに失敗しました：{str(e)}")
+            return
+        message = f"{imported} 個のポーションを取り込みました。"
+        if skipped:
+            message += f"\n同名のファイルがあるため {skipped} 個を飛ばしました。"
+        QMessageBox.information(self, "取り込み完了", message)
+        if directory in self.directories:
+            self.load_files()
+
     def toggle_no_thumbnail_display(self):
         self.show_images_without_thumbnails = self.toggle_no_thumbnail_action.isChecked()
         self.config['show_images_without_thumbnails'] = self.show_images_without_thumbnails
         save_config(self.config)
         self.reload_files()
 
+    def toggle_query_service(self, checked):
+        """他のツールから索引を引けるよう、ローカルの HTTP サービスを起動・停止する"""
+        if self.query_server is not None:
+            query_service.stop(self.query_server)
+            self.query_server = None
+        if checked:
+            port = self.config.get("query_service_port", query_service.DEFAULT_PORT)
+            try:
+                self.query_server = query_service.start_in_thread(os.path.join(CACHE_DIR, INDEX_FILE), port=port)
+            except OSError as e:
+                QMessageBox.warning(self, "起動エラー", f"問い合わせサービスを起動できませんでした：{str(e)}")
+                checked = False
+        self.query_service_action.setChecked(checked)
+        self.config["query_service"] = checked
+        save_config(self.config)
+
+    def toggle_slow_storage(self, checked):
+        self.config["slow_storage"] = checked
+        save_config(self.config)
+
+    def create_read_scheduler(self):
+        """低速ストレージ向けの設定が有効なら、読み込みに使う ReadScheduler を返す"""
+        if not self.config.get("slow_storage"):
+            return None
+        return ReadScheduler(
+            concurrency=self.config.get("slow_storage_concurrency", DEFAULT_CONCURRENCY),
+            timeout=self.config.get("slow_storage_timeout", DEFAULT_TIMEOUT),
+            retries=self.config.get("slow_storage_retries", DEFAULT_RETRIES),
+        )
+
     def reload_files(self):
         self.browse_tab.set_view()
 
@@ -296,7 +511,7 @@ class Naiv4VibeViewer(QMainWindow):
                     self.thumbnail_size = new_size
                     self.config["thumbnail_size"] = new_size
                     save_config(self.config)
-                    self.reload_files()
+                    self.refresh_thumbnails()
                     dialog.accept()
                 else:
                     QMessageBox.warning(dialog, "無効な値", "50～500の範囲内で指定してください。")
@@ -306,67 +521,225 @@ class Naiv4VibeViewer(QMainWindow):
         apply_button.clicked.connect(apply_size)
         dialog.exec()
 
+    def _lookup_atlas(self, filepaths, scheduler=None):
+        """アトラスに現在の表示サイズの縮小済みサムネイルがあるファイルを探す"""
+        stats = {}
+        cached = {}
+        container_stats = {}
+        if scheduler is not None:
+            # 遅いストレージでは stat も 1 件ずつ待つと時間がかかるので、まとめて並行に取る
+            containers = dict.fromkeys(map(potion_bundle.container_path, filepaths))
+            for container, stat, error in scheduler.stat_all(containers):
+                if error is None:
+                    container_stats[container] = stat
+        for filepath in filepaths:
+            # バンドル内のポーションはバンドル自体の更新日時とサイズで判定する
+            container = potion_bundle.container_path(filepath)
+            try:
+                if container not in container_stats:
+                    if scheduler is not None:
+                        continue
+                    container_stats[container] = os.stat(container)
+                stats[filepath] = stat = container_stats[container]
+            except OSError:
+                continue
+            thumbnail = self.thumbnail_atlas.lookup(filepath, stat)
+            if thumbnail:
+                cached[filepath] = thumbnail
+        return stats, cached
+
+    def _to_pixmap(self, filepath, thumbnail, stats, cached):
+        if filepath in cached:
+            return QPixmap.fromImage(utils.rgba_to_qimage(*cached[filepath]))
+        if thumbnail is None:
+            return None
+        if filepath in stats:
+            self.thumbnail_atlas.add(filepath, stats[filepath], *thumbnail)
+        return QPixmap.fromImage(utils.rgba_to_qimage(*thumbnail))
+
+    def refresh_thumbnails(self):
+        """表示サイズの変更時に、ファイルを読み直さずサムネイルだけを差し替える"""
+        self.thumbnail_atlas.close()
+        self.thumbnail_atlas = ThumbnailAtlas(CACHE_DIR, self.thumbnail_size)
+
+        filepaths = [item[1] for item in self.browse_tab.items if not item[5]]
+        stats, cached = self._lookup_atlas(filepaths)
+        pixmaps = {filepath: self._to_pixmap(filepath, None, stats, cached) for filepath in cached}
+
+        missing = []
+        bundle_entries = {}
+        for filepath in filepaths:
+            if filepath in cached:
+                continue
+            parts = potion_bundle.split_bundle_path(filepath)
+            if parts is None:
+                missing.append(filepath)
+                continue
+            bundle_path = parts[0]
+            if bundle_path not in bundle_entries:
+                try:
+                    bundle_entries[bundle_path] = dict(potion_bundle.read_index(bundle_path))
+                except Exception:
+                    bundle_entries[bundle_path] = {}
+            if filepath in bundle_entries[bundle_path]:
+                missing.append((filepath, bundle_entries[bundle_path][filepath]))
+
+        for filepath, data, thumbnail, no_thumb, error in self.thumbnail_pipeline.map(missing, self.thumbnail_size):
+            pixmap = self._to_pixmap(filepath, thumbnail, stats, cached)
+            if pixmap is not None:
+                pixmaps[filepath] = pixmap
+        # cached はアトラスの mmap を指しているので、詰め直しで閉じられるよう先に手放す
+        cached.clear()
+        self.thumbnail_atlas.save()
+
+        self.browse_tab.replace_pixmaps(pixmaps)
+        self.path_pixmaps.update(pixmaps)
+        for enc, (pixmap, info_extracted, filepath) in self.encoding_thumbnail_map.items():
+            if filepath in pixmaps:
+                self.encoding_thumbnail_map[enc] = (pixmaps[filepath], info_extracted, filepath)
+        self.reload_files()
+
+    def find_similar(self, filepath):
+        """encoding が似ているポーションを類似度の高い順にブラウズタブに表示する"""
+        ranking = self.similarity_index.query(filepath)
+        if ranking is None:
+            QMessageBox.information(self, "似ているポーション", "このバージョンの encoding が無いため探せません。")
+            return
+        name = os.path.basename(filepath).removesuffix(".naiv4vibe")
+        self.browse_tab.show_ranking(f"「{name}」に似ているポーション", [(filepath, 1.0)] + ranking)
+
+    def find_by_image(self, image_path):
+        """画像に見た目が近いサムネイルのポーションを近い順にブラウズタブに表示する"""
+        try:
+            with Image.open(image_path) as img:
+                query = image_hashes(img)
+        except (UnidentifiedImageError, OSError) as e:
+            QMessageBox.warning(self, "読み込みエラー", f"{os.path.basename(image_path)}: {str(e)}")
+            return
+        loaded = {item[1] for item in self.browse_tab.items}
+        entries = [entry for entry in self.encoding_index.image_hashes() if entry[0] in loaded]
+        ranking = rank_by_hash(entries, query)
+        self.browse_tab.show_ranking(f"「{os.path.basename(image_path)}」に近いサムネイルのポーション", ranking)
+
     def load_files(self):
         items = []
         error_messages = []
 
         self.browse_tab.reset_registrated_thumbnails()
-        for directory in self.directories:
-            files = [f for f in os.listdir(directory) if f.endswith(".naiv4vibe")]
-
-            for filename in files:
-                filepath = os.path.join(directory, filename)
-                try:
-                    data, image, no_thumb = get_b64thumbnail(filepath)
-                    if image is None or image.isNull():
-                        continue
-
-                    if self.version == "v4":
-                        version_key = "v4full"
-                    elif self.version == "v4.5":
-                        version_key = "v4-5full"
-                    elif self.version == "v4.5c":
-                        version_key = "v4-5curated"
-                    elif self.version == "v4c":
-                        version_key = "v4curated"
-                    else:
-                        continue
-
-                    encodings = data.get("encodings", {}).get(version_key, {})
-                    if not len(encodings):
+        filepaths = []
+        sources = []
+        bundle_mtimes = {}
+        bundle_errors = []
+        for filepath, source in potion_bundle.iter_sources(self.directories, bundle_errors):
+            filepaths.append(filepath)
+            sources.append(source)
+            if isinstance(source, tuple):
+                bundle_mtimes[filepath] = source[1].get("mtime")
+        for bundle_path, e in bundle_errors:
+            error_messages.append(f"[エラー] {os.path.basename(bundle_path)}: {str(e)}")
+        # 読めなかったフォルダのポーションは、索引やキャッシュから消さずに残しておく
+        unreadable = potion_bundle.unreadable_directories(bundle_errors)
+
+        self.path_pixmaps = {}
+        if self.similarity_index.version_key != VERSION_KEYS.get(self.version):
+            self.similarity_index.close()
+            self.similarity_index = SimilarityIndex(CACHE_DIR, VERSION_KEYS.get(self.version))
+        scheduler = self.create_read_scheduler()
+        stats, cached = self._lookup_atlas(filepaths, scheduler)
+        # 索引が古いものはサムネイルのハッシュを取り直すため、アトラスにあってもデコードする
+        indexed = self.encoding_index.current_paths()
+        skip_decode = {
+            filepath for filepath in cached
+            if indexed.get(filepath) == (stats[filepath].st_mtime_ns, stats[filepath].st_size)
+        }
+        placeholder = None
+        uncommitted = 0
+        for filepath, data, thumbnail, no_thumb, error in self.thumbnail_pipeline.map(
+                sources, self.thumbnail_size, skip_decode, scheduler):
+            filename = os.path.basename(filepath)
+            if error:
+                error_messages.append(f"[エラー] {filename}: {error}")
+                continue
+            try:
+                stat = stats.get(filepath)
+                if stat and not self.encoding_index.is_current(filepath, stat):
+                    self.encoding_index.update_potion(filepath, stat, data, not no_thumb)
+                    uncommitted += 1
+                    if uncommitted >= INDEX_COMMIT_INTERVAL:
+                        self.encoding_index.commit()
+                        uncommitted = 0
+                if stat and not self.similarity_index.is_current(filepath, stat):
+                    self.similarity_index.add(filepath, stat, data)
+
+                if no_thumb:
+                    if placeholder is None:
+                        placeholder = QPixmap.fromImage(create_placeholder_image())
+                    pixmap = placeholder
+                else:
+                    pixmap = self._to_pixmap(filepath, thumbnail, stats, cached)
+                    if pixmap is None:
                         continue
-
-                    pixmap = QPixmap.fromImage(image)
-                    # mtime = os.path.getmtime(filepath)
-                    mtime = utils.creation_date(filepath)
-                    info = []
-                    for item in encodings.values():
-                        enc = item.get("encoding", {})
-                        if not enc:
-                            continue
-
-                        params = item.get("params", {})
-                        info_extracted = params.get("information_extracted")
-
-                        if isinstance(info_extracted, (float, int)):
-                            info.append(f"{info_extracted}")
-
-                        current = self.encoding_thumbnail_map.get(enc)
-                        to_be_update = not current or (not current[1] and info_extracted)
-                        self.encoding_thumbnail_map[enc] = (pixmap, info_extracted, filepath) if to_be_update else current
-
-                    importinfo = data.get("importInfo", {})
-                    self.browse_tab.register_thumbnail(
-                        pixmap, filepath, mtime, ", ".join(sorted(info)), importinfo, no_thumb
-                    )
-
-                except Exception as e:
-                    error_messages.append(f"[エラー] {filename}: {str(e)}")
-
+                    self.path_pixmaps[filepath] = pixmap
+
+                version_key = VERSION_KEYS.get(self.version)
+                if version_key is None:
+                    continue
+
+                encodings = vibe_core.potion_encodings(data, version_key)
+                if not encodings:
+                    continue
+
+                # mtime = os.path.getmtime(filepath)
+                if filepath in bundle_mtimes:
+                    mtime = bundle_mtimes[filepath]
+                elif stat:
+                    # 遅いストレージでファイルごとに stat し直さないよう、まとめて取った結果を使う
+                    mtime = utils.stat_creation_date(stat)
+                else:
+                    # stat できなかった（時間切れなど）ものは日付不明として最も古い扱いにする
+                    mtime = 0
+                info = []
+                for enc, info_extracted in encodings:
+                    if info_extracted is not None:
+                        info.append(f"{info_extracted}")
+
+                    current = self.encoding_thumbnail_map.get(enc)
+                    to_be_update = not current or (not current[1] and info_extracted)
+                    self.encoding_thumbnail_map[enc] = (pixmap, info_extracted, filepath) if to_be_update else current
+
+                importinfo = data.get("importInfo", {})
+                versions = list(vibe_core.potion_versions(data))
+                self.browse_tab.register_thumbnail(
+                    pixmap, filepath, mtime, ", ".join(sorted(info)), importinfo, no_thumb, versions
+                )
+
+            except Exception as e:
+                error_messages.append(f"[エラー] {filename}: {str(e)}")
+
+        # cached はアトラスの mmap を指しているので、詰め直しで閉じられるよう先に手放す
+        cached.clear()
+        self.thumbnail_atlas.discard_except(filepaths, unreadable)
+        self.thumbnail_atlas.save()
+        self.encoding_index.discard_except(set(filepaths), unreadable)
+        self.encoding_index.commit()
+        self.similarity_index.discard_except(filepaths, unreadable)
+        self.similarity_index.save()
+        self.browse_tab.update_facet_menus()
         self.set_sort_order(self.sort_order)
+        self.invalidate_coverage()
         if error_messages:
             QMessageBox.warning(self, "読み込みエラー", "\n".join(error_messages))
 
+    def invalidate_coverage(self):
+        """索引が変わったので、情報抽出度の一覧を作り直す（表示していなければ次に開いたときに作る）"""
+        self.coverage_tab.stale = True
+        if self.tabs.currentWidget() is self.coverage_tab:
+            self.coverage_tab.refresh()
+
+    def on_tab_changed(self, index):
+        if self.tabs.widget(index) is self.coverage_tab and self.coverage_tab.stale:
+            self.coverage_tab.refresh()
+
     def resizeEvent(self, event):
         super().resizeEvent(event)
         self.browse_tab.set_view()
@@ -376,10 +749,18 @@ class Naiv4VibeViewer(QMainWindow):
         self.config["window_width"] = size.width()
         self.config["window_height"] = size.height()
         save_config(self.config)
+        self.operation_pool.waitForDone()
+        self.thumbnail_pipeline.shutdown()
+        self.thumbnail_atlas.close()
+        self.encoding_index.close()
+        self.similarity_index.close()
+        if self.query_server is not None:
+            query_service.stop(self.query_server)
         super().closeEvent(event)
 
 
 if __name__ == "__main__":
+    freeze_support()  # PyInstaller でexe化した場合にワーカープロセスを起動するため
     app = QApplication(sys.argv)
     viewer = Naiv4VibeViewer()
     viewer.show()
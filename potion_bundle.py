@@ -0,0 +1,176 @@
+"""フォルダ内のポーションを 1 つの zip にまとめたバンドルファイル
+
+先頭の index.json にサムネイルとメタデータを並べておき、ポーション本体はその後ろに格納する。
+ブラウズタブでは index.json だけを読んで読み取り専用のライブラリとして表示し、
+NAI に渡すときなど実体が必要になったポーションだけを一時フォルダに取り出す。
+
+バンドル内のポーションは os.path.join(バンドルのパス, ポーションのファイル名) という
+仮想パスで扱う。
+"""
+import hashlib
+import json_backend
+import os
+import shutil
+import tempfile
+import zipfile
+
+BUNDLE_SUFFIX = ".vibebundle"
+INDEX_NAME = "index.json"
+INDEX_VERSION = 1
+
+# index.json に載せる項目（元画像などの大きな項目はポーション本体にだけ残す）
+INDEX_KEYS = ("thumbnail", "encodings", "importInfo")
+
+
+def is_bundle(path):
+    return path.lower().endswith(BUNDLE_SUFFIX) and os.path.isfile(path)
+
+
+def split_bundle_path(path):
+    """バンドル内の仮想パスなら (バンドルのパス, ファイル名) を、そうでなければ None を返す"""
+    bundle_path, name = os.path.split(path)
+    if is_bundle(bundle_path):
+        return bundle_path, name
+    return None
+
+
+def container_path(path):
+    """実在するファイルのパスを返す。バンドル内のポーションならバンドル自体のパスになる"""
+    parts = split_bundle_path(path)
+    return parts[0] if parts else path
+
+
+def read_index(bundle_path):
+    """バンドルの index.json を読み込み、(仮想パス, 項目の dict) のリストを返す"""
+    with zipfile.ZipFile(bundle_path) as zf:
+        index = json_backend.loads(zf.read(INDEX_NAME))
+    return [(os.path.join(bundle_path, entry["name"]), entry) for entry in index["potions"]]
+
+
+def iter_sources(directories, errors=None):
+    """フォルダとバンドルに含まれるポーションを (パス, thumbnail_pipeline.load_potion に渡す source) で列挙する
+
+    バンドルは索引だけを読み、source は (仮想パス, 索引の項目) になる。
+    読めなかったフォルダやバンドルは errors に (パス, 例外) を追加して飛ばす。
+    """
+    for directory in directories:
+        try:
+            if is_bundle(directory):
+                entries = read_index(directory)
+            else:
+                filenames = os.listdir(directory)
+        except Exception as e:
+            if errors is not None:
+                errors.append((directory, e))
+            continue
+
+        if is_bundle(directory):
+            for filepath, entry in entries:
+                yield filepath, (filepath, entry)
+            continue
+
+        for filename in filenames:
+            if filename.endswith(".naiv4vibe"):
+                filepath = os.path.join(directory, filename)
+                yield filepath, filepath
+
+
+def unreadable_directories(errors):
+    """iter_sources で読めなかったフォルダ・バンドルを、is_under で比べられる形の集合で返す
+
+    errors は iter_sources に渡したもの。索引などから無くなったポーションを消すときに、ここに含まれる
+    フォルダのものは一時的に見えないだけかもしれないので残す。設定から外したフォルダのものは消える。
+    """
+    return directory_keys(path for path, e in errors)
+
+
+def directory_keys(directories):
+    """フォルダ・バンドルのパスを、is_under で比べられる形の集合にする"""
+    return {_normalize(directory) for directory in directories}
+
+
+def is_under(path, directories):
+    """ポーションのパスが directories（directory_keys や unreadable_directories の結果）のフォルダ・バンドルに含まれるか"""
+    return _normalize(os.path.dirname(path)) in directories
+
+
+def _normalize(path):
+    return os.path.normcase(os.path.normpath(path))
+
+
+def unique_destination(directory, name):
+    """directory に name で置けるパス。同名のファイルがあれば「名前 (2).naiv4vibe」のように番号を付ける"""
+    dest = os.path.join(directory, name)
+    stem, suffix = os.path.splitext(name)
+    number = 2
+    while os.path.exists(dest):
+        dest = os.path.join(directory, f"{stem} ({number}){suffix}")
+        number += 1
+    return dest
+
+
+def export_bundle(directory, bundle_path, get_mtime=os.path.getmtime):
+    """directory 内の .naiv4vibe をバンドルに書き出し、格納した件数を返す
+
+    index.json を先頭に置くため、1 周目で索引を作り、2 周目で本体を格納する。
+    """
+    names = sorted(f for f in os.listdir(directory) if f.endswith(".naiv4vibe"))
+    entries = []
+    for name in names:
+        filepath = os.path.join(directory, name)
+        data = json_backend.read_json(filepath)
+        entry = {key: data[key] for key in INDEX_KEYS if data.get(key)}
+        entry["name"] = name
+        entry["mtime"] = get_mtime(filepath)
+        entries.append(entry)
+
+    index = {"version": INDEX_VERSION, "potions": entries}
+    tmp_path = bundle_path + ".tmp"
+    with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(INDEX_NAME, json_backend.dumps(index))
+        for entry in entries:
+            zf.write(os.path.join(directory, entry["name"]), entry["name"])
+    os.replace(tmp_path, bundle_path)
+    return len(entries)
+
+
+def import_bundle(bundle_path, directory):
+    """バンドル内のポーションを directory に展開し、(展開した件数, 同名のため飛ばした件数) を返す"""
+    imported = skipped = 0
+    with zipfile.ZipFile(bundle_path) as zf:
+        for name in zf.namelist():
+            if name == INDEX_NAME or not name.endswith(".naiv4vibe"):
+                continue
+            dest = os.path.join(directory, os.path.basename(name))
+            if os.path.exists(dest):
+                skipped += 1
+                continue
+            with zf.open(name) as src, open(dest, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            imported += 1
+    return imported, skipped
+
+
+def _extract_dir(bundle_path):
+    stat = os.stat(bundle_path)
+    key = f"{os.path.abspath(bundle_path)}:{stat.st_mtime_ns}:{stat.st_size}"
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), "nai_vibe_viewer", digest)
+
+
+def local_path(path):
+    """ファイルとして扱えるパスを返す。バンドル内のポーションは一時フォルダに取り出す"""
+    parts = split_bundle_path(path)
+    if parts is None:
+        return path
+
+    bundle_path, name = parts
+    dest = os.path.join(_extract_dir(bundle_path), name)
+    if not os.path.exists(dest):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with zipfile.ZipFile(bundle_path) as zf, zf.open(name) as src:
+            tmp_path = dest + ".tmp"
+            with open(tmp_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        os.replace(tmp_path, dest)
+    return dest
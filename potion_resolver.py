@@ -0,0 +1,93 @@
+"""ポーション確認タブで、対応表に無い encoding をバックグラウンドで探す
+
+索引 (EncodingIndex) で見つかったポーションのサムネイルを読み込み、索引にも無い encoding は
+まだ索引に入っていないか更新されたファイルだけを読んで探す。見つかった順にシグナルで知らせる。
+"""
+import os
+import sqlite3
+
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
+
+import potion_bundle
+from encoding_index import EncodingIndex, encoding_digest, iter_encodings
+from thumbnail_pipeline import load_potion
+
+
+class ResolverSignals(QObject):
+    resolved = pyqtSignal(str, str, object)  # request, digest, (version_key, info_extracted, path)
+    thumbnail = pyqtSignal(str, str, object)  # request, path, (幅, 高さ, RGBA バッファ)
+    finished = pyqtSignal(str)  # request
+
+
+class ResolveTask(QRunnable):
+    def __init__(self, request, db_path, directories, digests, thumbnail_paths, size, signals):
+        super().__init__()
+        self.request = request
+        self.db_path = db_path
+        self.directories = list(directories)
+        self.digests = set(digests)
+        self.thumbnail_paths = list(thumbnail_paths)
+        self.size = size
+        self.signals = signals
+
+    def run(self):
+        try:
+            for path in self.thumbnail_paths:
+                self.load_thumbnail(path)
+            if self.digests:
+                index = EncodingIndex(self.db_path)
+                try:
+                    self.scan(index)
+                finally:
+                    index.close()
+        finally:
+            self.signals.finished.emit(self.request)
+
+    def load_thumbnail(self, path):
+        try:
+            source = potion_bundle.local_path(path)
+        except Exception:
+            return
+        _, data, thumbnail, no_thumb, error = load_potion(source, self.size)
+        if thumbnail:
+            self.signals.thumbnail.emit(self.request, path, thumbnail)
+
+    def scan(self, index):
+        wanted = set(self.digests)
+        current = index.current_paths()
+        stats = {}
+        for filepath, source in potion_bundle.iter_sources(self.directories):
+            container = potion_bundle.container_path(filepath)
+            try:
+                if container not in stats:
+                    stats[container] = os.stat(container)
+            except OSError:
+                continue
+            stat = stats[container]
+            if current.get(filepath) == (stat.st_mtime_ns, stat.st_size):
+                continue
+
+            _, data, thumbnail, no_thumb, error = load_potion(source, self.size)
+            if error:
+                continue
+            try:
+                index.update_potion(filepath, stat, data, not no_thumb)
+                index.commit()
+            except sqlite3.OperationalError:
+                # 本体の再読み込みと重なって書き込めない場合は、索引の更新をそちらに任せる
+                index.conn.rollback()
+
+            found = {
+                encoding_digest(enc): (version_key, info_extracted, filepath)
+                for version_key, enc, info_extracted in iter_encodings(data)
+            }
+            matched = wanted & found.keys()
+            if not matched:
+                continue
+            for digest in matched:
+                self.signals.resolved.emit(self.request, digest, found[digest])
+            if thumbnail:
+                self.signals.thumbnail.emit(self.request, filepath, thumbnail)
+            wanted -= matched
+            if not wanted:
+                return
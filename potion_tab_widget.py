@@ -1,56 +1,55 @@
 import platform
-import os, json, subprocess
+import os, subprocess, hashlib
+from collections import OrderedDict
 import utils
 from PyQt6.QtWidgets import (
-    QWidget, QLabel, QVBoxLayout, QGridLayout, QScrollArea, QSizePolicy, QLineEdit, QPushButton, QFileDialog
+    QWidget, QLabel, QVBoxLayout, QHBoxLayout, QGridLayout, QScrollArea, QSizePolicy, QLineEdit, QPushButton,
+    QFileDialog, QListWidget, QListWidgetItem
 )
-from PyQt6.QtGui import QPixmap, QImage, QDragEnterEvent, QDropEvent, QPainter, QFont, QColor
-from PyQt6.QtCore import Qt
-from PIL import Image
+from PyQt6.QtGui import QPixmap, QImage, QDragEnterEvent, QDropEvent, QPainter, QFont, QColor, QIcon
+from PyQt6.QtCore import Qt, QSize, QThreadPool
 from utils import ClickableThumbnail
-
-
-def extract_json_from_bytes(data: bytes, marker=b'{"Comment":') -> dict:
-    # 1) JSON開始位置
-    start = data.find(marker)
-    if start == -1:
-        raise ValueError("JSON marker not found")
-
-    # 2) 波括弧の対応を数えて JSON の終端を見つける
-    i = start
-    depth = 0
-    in_string = False
-    escape = False
-
-    while i < len(data):
-        c = data[i]
-
-        if in_string:
-            if escape:
-                escape = False
-            elif c == 0x5C:  # backslash \
-                escape = True
-            elif c == 0x22:  # double quote "
-                in_string = False
-        else:
-            if c == 0x22:      # "
-                in_string = True
-            elif c == 0x7B:    # {
-                depth += 1
-            elif c == 0x7D:    # }
-                depth -= 1
-                if depth == 0:
-                    end = i + 1
-                    break
-        i += 1
-    else:
-        raise ValueError("JSON end not found")
-
-    json_bytes = data[start:end]
-
-    # 3) JSON は ASCII/UTF-8 として解釈できる想定（壊れている場合は replace）
-    json_text = json_bytes.decode("utf-8", errors="strict")
-    return json.loads(json_text)
+from folder_watcher import FolderWatcher
+from potion_resolver import ResolverSignals, ResolveTask
+from encoding_index import VERSION_KEYS, VERSION_LABELS
+from strength_engine import rescale, check_strengths, solve_round
+from vibe_core import parse_image_references
+
+# 解析結果を覚えておく画像の数
+HISTORY_SIZE = 50
+# 監視フィードに残す件数
+FEED_SIZE = 100
+
+
+def analyse_image(name, raw, preview_size) -> dict:
+    """画像のプレビューと生成に使われたポーションの encoding・参照強度を読み取る
+
+    GUI スレッド以外からも呼べるよう、プレビューは QImage で返す。
+    """
+    preview = QImage.fromData(raw)
+    if not preview.isNull():
+        preview = preview.scaled(
+            preview_size,
+            Qt.AspectRatioMode.KeepAspectRatio,
+            Qt.TransformationMode.SmoothTransformation
+        )
+    result = {
+        "name": name, "preview": preview, "keys": [], "key_digests": [], "strengths": [], "resolved": [],
+        "message": None
+    }
+
+    try:
+        references = list(parse_image_references(raw))
+    except Exception:
+        result["message"] = "メタデータ無し"
+        return result
+    if not references:
+        result["message"] = "ポーションなし"
+        return result
+    result["keys"] = [ref.encoding for ref in references]
+    result["key_digests"] = [ref.digest for ref in references]
+    result["strengths"] = [ref.strength for ref in references]
+    return result
 
 
 def create_placeholder_pixmap(size=150) -> QPixmap:
@@ -97,66 +96,67 @@ class ThumbnailWidget(utils.ThumbnailWidget):
         layout.addWidget(self.strength_input, alignment=Qt.AlignmentFlag.AlignHCenter)
 
         # Information Extracted
-        if thumbnail.info_extracted:
-            info_extracted_label = QLabel(f"情報抽出度：{thumbnail.info_extracted}")
-            info_extracted_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-            info_extracted_label.setWordWrap(True)
-            info_extracted_label.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Minimum)
-            layout.addWidget(info_extracted_label)
-
-        self.strength_input.textChanged.connect(self.update_others)
+        self.info_extracted_label = QLabel()
+        self.info_extracted_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.info_extracted_label.setWordWrap(True)
+        self.info_extracted_label.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Minimum)
+        layout.addWidget(self.info_extracted_label)
+        self.set_info_extracted_label(thumbnail.info_extracted)
+
         self._strength_value = strength
 
+    def set_info_extracted_label(self, info_extracted):
+        self.info_extracted_label.setText(f"情報抽出度：{info_extracted}")
+        self.info_extracted_label.setVisible(bool(info_extracted))
+
+    def set_potion(self, pixmap, info_extracted, fullpath):
+        """バックグラウンドで見つかったポーションでタイルを更新する。pixmap が None ならサムネイルはそのまま"""
+        thumbnail = self.thumbnail
+        if pixmap is not None:
+            thumbnail.original_pixmap = pixmap
+            thumbnail.setPixmap(thumbnail.resize_pixmap(pixmap))
+        thumbnail.fullpath = fullpath
+        thumbnail.info_extracted = info_extracted
+        self.filename = os.path.basename(fullpath).removesuffix(".naiv4vibe")
+        self.label.setText(f"{self.filename}\n参照強度：{self._strength_value}")
+        self.set_info_extracted_label(info_extracted)
+
     def resizeEvent(self, event):
         super().resizeEvent(event)
         self.label.setWordWrap(True)
 
-    def update_others(self):
-        try:
-            base_strength = float(self.strength_input.text())
-        except ValueError:
-            return
-
-        parent = self.parent()
-        while parent and not hasattr(parent, 'thumbnail_widgets'):
-            parent = parent.parent()
-        if not parent:
-            return
-        parent.warning_label.setStyleSheet("color: transparent;")
-        if base_strength > 1.0:
-            parent.change_warning_label("large_value")
-
-        i = parent.thumbnail_widgets.index(self)
-        base = self._strength_value
-
-        total = 0
-        for j, widget in enumerate(parent.thumbnail_widgets):
-            if widget is self:
-                continue
-            ratio = widget._strength_value / base if base != 0 else 0
-            new_value = base_strength * ratio
-            if abs(new_value) > 1.0:
-                parent.change_warning_label("large_value")
-            widget.strength_input.blockSignals(True)
-            widget.strength_input.setText(f"{new_value:.8f}")
-            widget.strength_input.blockSignals(False)
-            total += abs(new_value)
-        total += abs(float(self.strength_input.text()))
-
-        if total < 1.0:
-            parent.change_warning_label("small_total")
-
 
 class PotionTabWidget(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
+        self.main_window = parent
         self.thumbnail_widgets = []
+        self.strengths = []  # 表示中の画像の参照強度（thumbnail_widgets と同じ順）
+        self.selection_model = utils.SelectionModel()
         self.encoding_thumbnail_map = {}  # encoding:str -> (QPixmap, info_extracted, fullpath)
+        self.analysis_cache = OrderedDict()  # sha256 of image -> analysis result (oldest first)
+        self.current_digest = None
+        self.resolving = set()  # バックグラウンドで探索中の画像の sha256
+        self.resolver_pool = QThreadPool(self)
+        self.resolver_pool.setMaxThreadCount(1)
+        self.resolver_signals = ResolverSignals(self)
+        self.resolver_signals.resolved.connect(self.on_potion_resolved)
+        self.resolver_signals.thumbnail.connect(self.on_potion_thumbnail)
+        self.resolver_signals.finished.connect(self.resolving.discard)
         self._init_ui()
 
+        # analyse はワーカースレッドで呼ばれるので、ウィジェットの値は GUI スレッドで先に読んでおく
+        preview_size = QSize(self.preview_label.maximumSize())
+        self.folder_watcher = FolderWatcher(
+            lambda name, raw: analyse_image(name, raw, preview_size), parent=self)
+        self.folder_watcher.analysed.connect(self.on_watch_analysed)
+        self.folder_watcher.failed.connect(self.on_watch_failed)
+
     def _init_ui(self):
         self.setAcceptDrops(True)
-        layout = QVBoxLayout(self)
+        outer_layout = QHBoxLayout(self)
+        layout = QVBoxLayout()
+        outer_layout.addLayout(layout, stretch=1)
 
         self.preview_label = QLabel("画像をドロップしてください\nまたは")
         self.preview_label.setMaximumSize(300, 200)
@@ -187,13 +187,56 @@ class PotionTabWidget(QWidget):
         self.warning_label.setStyleSheet("color: transparent;")
         layout.addWidget(self.warning_label, alignment=Qt.AlignmentFlag.AlignHCenter)
 
+        solve_button = QPushButton("キリの良い数値を探す", self)
+        solve_button.setStyleSheet("font-size: 10pt;")
+        solve_button.clicked.connect(self.solve_round_strengths)
+        layout.addWidget(solve_button)
+        self.candidate_list = QListWidget()
+        self.candidate_list.setMaximumHeight(110)
+        self.candidate_list.itemClicked.connect(self.apply_candidate)
+        self.candidate_list.hide()
+        layout.addWidget(self.candidate_list)
+
+        history_layout = QVBoxLayout()
+        history_layout.addWidget(QLabel("履歴"))
+        self.history_list = QListWidget()
+        self.history_list.setFixedWidth(180)
+        self.history_list.setIconSize(QSize(64, 64))
+        self.history_list.itemClicked.connect(self.on_history_clicked)
+        history_layout.addWidget(self.history_list)
+
+        self.watch_button = QPushButton("フォルダを監視", self)
+        self.watch_button.setCheckable(True)
+        self.watch_button.setStyleSheet("font-size: 10pt;")
+        self.watch_button.toggled.connect(self.toggle_watch)
+        history_layout.addWidget(self.watch_button)
+
+        watch_folder_button = QPushButton("監視フォルダを変更", self)
+        watch_folder_button.setStyleSheet("font-size: 10pt;")
+        watch_folder_button.clicked.connect(self.select_watch_directory)
+        history_layout.addWidget(watch_folder_button)
+
+        self.watch_label = QLabel(f"監視フォルダ：{self.watch_directory or '未設定'}")
+        self.watch_label.setWordWrap(True)
+        self.watch_label.setMaximumWidth(180)
+        history_layout.addWidget(self.watch_label)
+
+        self.feed_list = QListWidget()
+        self.feed_list.setFixedWidth(180)
+        self.feed_list.setIconSize(QSize(48, 48))
+        self.feed_list.setWordWrap(True)
+        self.feed_list.itemClicked.connect(self.on_feed_clicked)
+        history_layout.addWidget(self.feed_list)
+        outer_layout.addLayout(history_layout)
+
     def tmp_click(self):
         filepath, _ = QFileDialog.getOpenFileName(
             parent=self,
             caption="ファイルを選択",
             directory="",
             filter="画像ファイル (*.png *.webp)")
-        self.handle_dropped_image(filepath)
+        if filepath:
+            self.handle_dropped_image(filepath)
 
     def change_warning_label(self, mode):
         if mode not in self.warnings:
@@ -202,6 +245,49 @@ class PotionTabWidget(QWidget):
         self.warning_label.setText(text)
         self.warning_label.setStyleSheet("color: red;")
 
+    def update_warnings(self, values):
+        self.warning_label.setStyleSheet("color: transparent;")
+        for mode in check_strengths(values):
+            self.change_warning_label(mode)
+
+    def set_strength_inputs(self, values, skip=None):
+        for idx, (widget, value) in enumerate(zip(self.thumbnail_widgets, values)):
+            if idx == skip:
+                continue
+            widget.strength_input.blockSignals(True)
+            widget.strength_input.setText(f"{value:.8f}" if skip is not None else f"{value:g}")
+            widget.strength_input.blockSignals(False)
+
+    def rebalance(self, index, text):
+        """入力された参照強度を基準に、ほかのポーションの参照強度を同じ比率で計算し直す"""
+        try:
+            value = float(text)
+        except ValueError:
+            return
+        values = rescale(self.strengths, index, value)
+        self.set_strength_inputs(values, skip=index)
+        self.update_warnings(values)
+
+    def solve_round_strengths(self):
+        """バランス調整後に元の参照強度を再現できる、キリの良い数値の組み合わせを一覧に出す"""
+        self.candidate_list.clear()
+        self.candidate_list.show()
+        candidates = solve_round(self.strengths)
+        if not candidates:
+            self.candidate_list.addItem("条件を満たす組み合わせが見つかりません")
+            return
+        for values, error in candidates:
+            item = QListWidgetItem(f"{', '.join(f'{v:g}' for v in values)}（ずれ {error * 100:.2f}%）")
+            item.setData(Qt.ItemDataRole.UserRole, [float(v) for v in values])
+            self.candidate_list.addItem(item)
+
+    def apply_candidate(self, item):
+        values = item.data(Qt.ItemDataRole.UserRole)
+        if values is None:
+            return
+        self.set_strength_inputs(values)
+        self.update_warnings(values)
+
     def set_encoding_thumbnail_map(self, mapping):
         self.encoding_thumbnail_map = mapping
 
@@ -220,64 +306,219 @@ class PotionTabWidget(QWidget):
                 self.handle_dropped_image(filepath)
 
     def handle_dropped_image(self, filepath):
-        self.clear_thumbnails()
-
-        # プレビュー表示
-        image = QImage(filepath)
-        pixmap = QPixmap.fromImage(image)
-        pixmap = pixmap.scaled(
-            self.preview_label.maximumSize(),
-            Qt.AspectRatioMode.KeepAspectRatio,
-            Qt.TransformationMode.SmoothTransformation
-        )
-        self.preview_label.setPixmap(pixmap)
-
         try:
-            img = Image.open(filepath)
-            if "exif" in img.info:
-                comment = extract_json_from_bytes(img.info["exif"]).get("Comment")
-            else:
-                comment = img.info.get("Comment")
-            if not comment:
-                raise ValueError("no comment")
-            info = json.loads(comment)
-
-            keys = info.get("reference_image_multiple", None)
-            if not keys:
-                self.preview_label.setText("ポーションなし")
-                return
-            else:
-                strengths = info["reference_strength_multiple"]
-        except Exception as e:
+            with open(filepath, 'rb') as f:
+                raw = f.read()
+        except OSError:
+            self.clear_thumbnails()
             self.preview_label.setText("メタデータ無し")
             return
 
-        for idx, key in enumerate(keys):
-            pixmap, info_extracted, fullpath = self.encoding_thumbnail_map.get(key, (None, None, None))
+        # 同じ画像なら解析結果を使い回す
+        digest = hashlib.sha256(raw).hexdigest()
+        if digest not in self.analysis_cache:
+            self.store_analysis(digest, analyse_image(os.path.basename(filepath), raw, self.preview_label.maximumSize()))
+        self.touch_history(digest)
+        self.show_analysis(digest)
+
+    def store_analysis(self, digest, result):
+        """analyse_image の結果をポーションと対応付けてキャッシュに入れる（GUI スレッドから呼ぶこと）"""
+        result["preview"] = QPixmap.fromImage(result["preview"])
+        result["resolved"] = [self.encoding_thumbnail_map.get(key) for key in result["keys"]]
+        self.analysis_cache[digest] = result
+        self.analysis_cache.move_to_end(digest)
+        while len(self.analysis_cache) > HISTORY_SIZE:
+            old_digest, _ = self.analysis_cache.popitem(last=False)
+            self.remove_history_item(old_digest)
+        self.resolve_from_index(digest)
+        return result
+
+    def make_resolved(self, rows):
+        """索引の (version_key, info_extracted, path) から、表示中のバージョンを優先して 1 つ選ぶ"""
+        current_key = VERSION_KEYS.get(self.main_window.version)
+        version_key, info_extracted, path = min(
+            rows, key=lambda row: (row[0] != current_key, row[1] is None))
+        if version_key != current_key:
+            # 別バージョンのポーションであることが分かるようにする
+            label = VERSION_LABELS.get(version_key, version_key)
+            info_extracted = f"{info_extracted} ({label})" if info_extracted is not None else f"({label})"
+        return self.main_window.path_pixmaps.get(path), info_extracted, path
+
+    def resolve_from_index(self, digest):
+        """対応表に無い encoding を索引から引き、索引にも無いものとサムネイルはバックグラウンドで探す"""
+        result = self.analysis_cache[digest]
+        missing = {}  # encoding の digest -> ポーションの位置
+        for idx, resolved in enumerate(result["resolved"]):
+            if resolved is None:
+                missing.setdefault(result["key_digests"][idx], []).append(idx)
+
+        matches = self.main_window.encoding_index.lookup(missing) if missing else {}
+        for key_digest, rows in matches.items():
+            resolved = self.make_resolved(rows)
+            for idx in missing[key_digest]:
+                result["resolved"][idx] = resolved
+
+        not_found = set(missing) - set(matches)
+        thumbnail_paths = {
+            resolved[2] for resolved in result["resolved"]
+            if resolved and resolved[0] is None and resolved[2]
+        }
+        if (not_found or thumbnail_paths) and digest not in self.resolving:
+            self.resolving.add(digest)
+            self.resolver_pool.start(ResolveTask(
+                digest, self.main_window.encoding_index.db_path, self.main_window.directories,
+                not_found, thumbnail_paths, 128, self.resolver_signals))
+
+    def on_potion_resolved(self, request, key_digest, row):
+        result = self.analysis_cache.get(request)
+        if result is None:
+            return
+        resolved = self.make_resolved([row])
+        for idx, digest in enumerate(result["key_digests"]):
+            if digest == key_digest and result["resolved"][idx] is None:
+                result["resolved"][idx] = resolved
+                if request == self.current_digest:
+                    self.thumbnail_widgets[idx].set_potion(*resolved)
+
+    def on_potion_thumbnail(self, request, path, thumbnail):
+        pixmap = QPixmap.fromImage(utils.rgba_to_qimage(*thumbnail))
+        self.main_window.path_pixmaps.setdefault(path, pixmap)
+        result = self.analysis_cache.get(request)
+        if result is None:
+            return
+        for idx, resolved in enumerate(result["resolved"]):
+            if resolved and resolved[0] is None and resolved[2] == path:
+                result["resolved"][idx] = (pixmap,) + resolved[1:]
+                if request == self.current_digest:
+                    self.thumbnail_widgets[idx].set_potion(*result["resolved"][idx])
+
+    def show_analysis(self, digest):
+        self.clear_thumbnails()
+        self.current_digest = digest
+        result = self.analysis_cache[digest]
+
+        self.preview_label.setPixmap(result["preview"])
+        if result["message"]:
+            self.preview_label.setText(result["message"])
+            return
+
+        # 解析後にフォルダが読み込まれた場合に備えて、最新の対応表を優先する
+        for idx, key in enumerate(result["keys"]):
+            result["resolved"][idx] = self.encoding_thumbnail_map.get(key) or result["resolved"][idx]
+        self.resolve_from_index(digest)
+
+        self.strengths = list(result["strengths"])
+        for idx, resolved in enumerate(result["resolved"]):
+            pixmap, info_extracted, fullpath = resolved or (None, None, None)
 
             if not pixmap:
                 pixmap = create_placeholder_pixmap(150)
 
             label_widget = ThumbnailWidget(
                 ClickableThumbnail(pixmap, fullpath, None, info_extracted, thumbnail_size=128, parent=self),
-                strengths[idx])
-            label_widget.set_clicked_callback(self.clear_selection_except)
+                result["strengths"][idx])
+            label_widget.set_selection_model(self.selection_model)
+            label_widget.strength_input.textChanged.connect(lambda text, i=idx: self.rebalance(i, text))
             self.thumbnail_widgets.append(label_widget)
 
             row = idx // 4
             col = idx % 4
             self.thumb_layout.addWidget(label_widget, row, col)
 
+    def add_history_item(self, digest):
+        result = self.analysis_cache[digest]
+        item = QListWidgetItem(QIcon(result["preview"]), result["name"])
+        item.setData(Qt.ItemDataRole.UserRole, digest)
+        item.setToolTip(result["name"])
+        self.history_list.insertItem(0, item)
+
+    def touch_history(self, digest):
+        """キャッシュと履歴の両方で digest を最新にする（履歴の並びと捨てる順番を揃えておく）"""
+        self.analysis_cache.move_to_end(digest)
+        self.remove_history_item(digest)
+        self.add_history_item(digest)
+
+    def remove_history_item(self, digest):
+        for row in range(self.history_list.count()):
+            if self.history_list.item(row).data(Qt.ItemDataRole.UserRole) == digest:
+                self.history_list.takeItem(row)
+                return
+
+    def on_history_clicked(self, item):
+        digest = item.data(Qt.ItemDataRole.UserRole)
+        if digest in self.analysis_cache:
+            self.show_analysis(digest)
+
+    @property
+    def watch_directory(self):
+        return self.main_window.config.get("watch_directory")
+
+    def select_watch_directory(self):
+        directory = QFileDialog.getExistingDirectory(self, "監視するフォルダを選択", self.watch_directory or "")
+        if not directory:
+            return False
+        self.main_window.set_watch_directory(directory)
+        self.watch_label.setText(f"監視フォルダ：{directory}")
+        if self.folder_watcher.is_running:
+            self.folder_watcher.start(directory)
+        return True
+
+    def toggle_watch(self, checked):
+        if not checked:
+            self.folder_watcher.stop()
+            return
+        if not self.watch_directory or not os.path.isdir(self.watch_directory):
+            if not self.select_watch_directory():
+                self.watch_button.setChecked(False)
+                return
+        self.watch_label.setText(f"監視フォルダ：{self.watch_directory}")
+        self.folder_watcher.start(self.watch_directory)
+
+    def on_watch_analysed(self, filepath, digest, result):
+        if digest in self.analysis_cache:
+            result = self.analysis_cache[digest]
+        else:
+            result = self.store_analysis(digest, result)
+        self.touch_history(digest)
+
+        if result["message"]:
+            summary = result["message"]
+        else:
+            names = [
+                os.path.basename(resolved[2]).removesuffix(".naiv4vibe") if resolved and resolved[2] else "?"
+                for resolved in result["resolved"]
+            ]
+            summary = ", ".join(names)
+        self.add_feed_item(result["preview"], f"{result['name']}\n{summary}", filepath, digest)
+
+    def on_watch_failed(self, filepath, error):
+        self.add_feed_item(QPixmap(), f"{os.path.basename(filepath)}\n読み込み失敗：{error}", filepath, None)
+
+    def add_feed_item(self, pixmap, text, filepath, digest):
+        item = QListWidgetItem(QIcon(pixmap), text)
+        item.setData(Qt.ItemDataRole.UserRole, (filepath, digest))
+        item.setToolTip(text)
+        self.feed_list.insertItem(0, item)
+        while self.feed_list.count() > FEED_SIZE:
+            self.feed_list.takeItem(self.feed_list.count() - 1)
+
+    def on_feed_clicked(self, item):
+        filepath, digest = item.data(Qt.ItemDataRole.UserRole)
+        if digest in self.analysis_cache:
+            self.show_analysis(digest)
+        else:
+            # 履歴から押し出されていればファイルから読み直す
+            self.handle_dropped_image(filepath)
+
     def clear_thumbnails(self):
         self.thumbnail_widgets.clear()
+        self.strengths = []
+        self.candidate_list.clear()
+        self.candidate_list.hide()
+        self.warning_label.setStyleSheet("color: transparent;")
+        self.selection_model.clear()
         while self.thumb_layout.count():
             item = self.thumb_layout.takeAt(0)
             widget = item.widget()
             if widget:
                 widget.deleteLater()
-
-    def clear_selection_except(self, selected_widget):
-        for widget in self.thumbnail_widgets:
-            if widget is not selected_widget:
-                widget.selected(False)
-                widget.update_style()
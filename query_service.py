@@ -0,0 +1,278 @@
+"""ビューアと同じ索引 (EncodingIndex) を他のツールから引けるようにするローカル HTTP サービス
+
+GUI から起動するとビューアのプロセス内で動き、`python query_service.py` で GUI 無しでも起動できる。
+127.0.0.1 でだけ待ち受け、HTTP/1.1 の keep-alive と一括問い合わせに対応する。
+
+- GET  /health                     索引に入っているポーションの数
+- POST /lookup   {"digests": [...], "encodings": [...], "thumbnail": false}
+                                   encoding（またはその digest）ごとに、持っているポーションのパスと情報抽出度
+- GET  /potions?name=&version=&info_extracted=&has_thumbnail=&model=&strength=&limit=
+                                   ファイル名とファセットでポーションを探す
+- POST /query    {"queries": [{"name": ..., "version": ...}, ...]}
+                                   /potions の条件をまとめて問い合わせる
+"""
+import argparse
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import json_backend
+import potion_bundle
+from encoding_index import EncodingIndex, VERSION_KEYS, encoding_digest
+from thumbnail_pipeline import ThumbnailPipeline
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_DB = os.path.join("cache", "index.sqlite3")
+# /potions と /query で一度に返す件数の上限
+MAX_RESULTS = 1000
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        return value.lower() in ("1", "true", "yes")
+    return bool(value)
+
+
+def read_thumbnail(path, bundle_indexes):
+    """ポーションの thumbnail（data URI）を返す。bundle_indexes は読み込み済みのバンドルの索引"""
+    parts = potion_bundle.split_bundle_path(path)
+    try:
+        if parts is None:
+            return json_backend.read_json(path).get("thumbnail")
+        if parts[0] not in bundle_indexes:
+            bundle_indexes[parts[0]] = dict(potion_bundle.read_index(parts[0]))
+        return bundle_indexes[parts[0]].get(path, {}).get("thumbnail")
+    except Exception:
+        return None
+
+
+def lookup(index, request):
+    """encoding の一括問い合わせ。結果は問い合わせの順に並べる"""
+    digests = list(request.get("digests", []))
+    digests += [encoding_digest(enc) for enc in request.get("encodings", [])]
+    rows = index.lookup(digests)
+
+    thumbnails = {}
+    if request.get("thumbnail"):
+        bundle_indexes = {}
+        for path in {path for matches in rows.values() for _, _, path in matches}:
+            thumbnails[path] = read_thumbnail(path, bundle_indexes)
+
+    results = []
+    for digest in digests:
+        matches = []
+        for version_key, info_extracted, path in rows.get(digest, []):
+            match = {"path": path, "version": version_key, "info_extracted": info_extracted}
+            if request.get("thumbnail"):
+                match["thumbnail"] = thumbnails.get(path)
+            matches.append(match)
+        results.append({"digest": digest, "matches": matches})
+    return {"results": results}
+
+
+def query_potions(index, query):
+    """ファイル名とファセットの条件に合うポーションを返す
+
+    version は設定の表記 (v4.5 など) と encodings のキー (v4-5full など) のどちらでもよい。
+    """
+    version = query.get("version")
+    info_extracted = query.get("info_extracted")
+    has_thumbnail = query.get("has_thumbnail")
+    potions = index.find_potions(
+        version_key=VERSION_KEYS.get(version, version),
+        info_extracted=float(info_extracted) if info_extracted not in (None, "") else None,
+        has_thumbnail=_to_bool(has_thumbnail) if has_thumbnail not in (None, "") else None,
+    )
+
+    name = (query.get("name") or "").lower()
+    model = query.get("model")
+    strength = query.get("strength")
+    limit = min(int(query.get("limit") or MAX_RESULTS), MAX_RESULTS)
+    matched = []
+    for path, has_thumb, importinfo in potions:
+        if name and name not in os.path.basename(path).removesuffix(".naiv4vibe").lower():
+            continue
+        if model and importinfo.get("model") != model:
+            continue
+        if strength not in (None, "") and importinfo.get("strength") != float(strength):
+            continue
+        matched.append((path, has_thumb, importinfo))
+        if len(matched) >= limit:
+            break
+
+    encodings = index.encodings_of(path for path, _, _ in matched)
+    return [
+        {
+            "path": path,
+            "name": os.path.basename(path),
+            "has_thumbnail": has_thumb,
+            "importInfo": importinfo,
+            "encodings": [
+                {"digest": digest, "version": version_key, "info_extracted": info}
+                for digest, version_key, info in encodings.get(path, [])
+            ],
+        }
+        for path, has_thumb, importinfo in matched
+    ]
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "NAIVibeViewerQuery/1"
+    # ヘッダと本文を別々に書き込むので、Nagle アルゴリズムで応答が遅れないようにする
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        # SQLite の接続はスレッドをまたげないので、接続（keep-alive の間）ごとに開く
+        self.index = None
+
+    def finish(self):
+        super().finish()
+        if self.index is not None:
+            self.index.close()
+
+    def get_index(self):
+        if self.index is None:
+            self.index = EncodingIndex(self.server.db_path)
+        return self.index
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/health":
+            count = self.get_index().conn.execute("SELECT COUNT(*) FROM potions").fetchone()[0]
+            self.reply(200, {"potions": count})
+        elif url.path == "/potions":
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            self.respond_json(lambda: {"potions": query_potions(self.get_index(), query)})
+        else:
+            self.reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            request = json_backend.loads(body) if body else {}
+        except ValueError:
+            self.reply(400, {"error": "invalid JSON"})
+            return
+
+        if url.path == "/lookup":
+            self.respond_json(lambda: lookup(self.get_index(), request))
+        elif url.path == "/query":
+            self.respond_json(lambda: {
+                "results": [query_potions(self.get_index(), query) for query in request.get("queries", [])]
+            })
+        else:
+            self.reply(404, {"error": "not found"})
+
+    def respond_json(self, respond):
+        try:
+            result = respond()
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            self.reply(400, {"error": str(e)})
+            return
+        self.reply(200, result)
+
+    def reply(self, status, obj):
+        body = json_backend.dumps(obj)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class QueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, db_path, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        super().__init__((host, port), QueryHandler)
+        self.db_path = db_path
+
+
+def start_in_thread(db_path, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """バックグラウンドのスレッドでサービスを起動する。止めるときは stop() に渡す"""
+    server = QueryServer(db_path, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stop(server):
+    server.shutdown()
+    server.server_close()
+
+
+def refresh_index(db_path, directories):
+    """GUI 無しで起動したときに、フォルダの変更を索引に反映する"""
+    index = EncodingIndex(db_path)
+    pipeline = ThumbnailPipeline()
+    try:
+        current = index.current_paths()
+        filepaths = []
+        stale = []
+        stats = {}
+        errors = []
+        for filepath, source in potion_bundle.iter_sources(directories, errors):
+            container = potion_bundle.container_path(filepath)
+            try:
+                if container not in stats:
+                    stats[container] = os.stat(container)
+            except OSError:
+                continue
+            filepaths.append(filepath)
+            stat = stats[container]
+            if current.get(filepath) != (stat.st_mtime_ns, stat.st_size):
+                stale.append(source)
+
+        # サムネイルはハッシュを取るためだけにデコードするので、受け渡す縮小版は小さくてよい
+        for filepath, data, thumbnail, no_thumb, error in pipeline.map(stale, 16):
+            if not error:
+                index.update_potion(filepath, stats[potion_bundle.container_path(filepath)], data, not no_thumb)
+        # 読めなかったフォルダの行は消さない（NAS の休止などで一時的に見えないだけのことがある）。
+        # フォルダが 1 つも無いときは設定を読めていないだけかもしれないので、何も消さない
+        if directories:
+            index.discard_except(set(filepaths), potion_bundle.unreadable_directories(errors))
+        for directory, e in errors:
+            print(f"[エラー] {directory}: {e}")
+        index.commit()
+        return len(stale)
+    finally:
+        pipeline.shutdown()
+        index.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ポーションの索引を HTTP で問い合わせられるようにする")
+    parser.add_argument("--config", default="config.json", help="フォルダ設定を読む設定ファイル")
+    parser.add_argument("--db", default=DEFAULT_DB, help="索引のファイル")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--no-refresh", action="store_true", help="起動時にフォルダを読み直さない")
+    args = parser.parse_args()
+
+    if not args.no_refresh:
+        try:
+            directories = json_backend.read_json(args.config).get("directories", [])
+        except (OSError, ValueError) as e:
+            print(f"設定ファイルを読めないため、索引を更新せずに起動します: {e}")
+        else:
+            print(f"索引を更新しました: {refresh_index(args.db, directories)} 件")
+
+    server = QueryServer(args.db, args.host, args.port)
+    print(f"http://{args.host}:{args.port}/ で待ち受けています")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""encoding のベクトルを NumPy の行列にまとめ、コサイン類似度で似ているポーションを探す索引
+
+encoding の base64 を float16 の配列として読み、長さ 1 に正規化した行列にまとめる。
+表 ファイルパス -> [mtime_ns, ファイルサイズ, 先頭行, 行数] で行を引く。
+行列と表は vectors_<version_key>.npz に一緒に保存し、1 回の置き換えで書き出すので食い違うことはない。
+1 つのポーションは情報抽出度ごとに複数の行を持ち、類似度はその中で最も高いものを使う。
+"""
+import base64
+import binascii
+import os
+
+import numpy as np
+
+import json_backend
+import potion_bundle
+
+ENCODING_DTYPE = np.dtype('<f2')
+# 類似度を計算するときに一度に float32 に変換する行数
+CHUNK_ROWS = 8192
+
+
+def decode_encoding(encoding):
+    """encoding を長さ 1 の float32 ベクトルにする。読めない場合は None"""
+    try:
+        raw = base64.b64decode(encoding, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    if not raw or len(raw) % ENCODING_DTYPE.itemsize:
+        return None
+    vector = np.frombuffer(raw, dtype=ENCODING_DTYPE).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    if not np.isfinite(norm) or norm == 0:
+        return None
+    return vector / norm
+
+
+class SimilarityIndex:
+    def __init__(self, cache_dir, version_key):
+        self.version_key = version_key
+        self.path = os.path.join(cache_dir, f"vectors_{version_key}.npz")
+        self.table = {}
+        self.matrix = np.zeros((0, 0), dtype=np.float16)
+        self._pending = {}  # filepath -> ([mtime_ns, ファイルサイズ], 行列)
+        self._dirty = False
+        self._paths = []
+        self._starts = np.zeros(0, dtype=np.intp)
+        self._bounds = np.zeros(0, dtype=np.intp)
+        self._load()
+
+    def _load(self):
+        try:
+            with np.load(self.path) as archive:
+                matrix = archive["matrix"]
+                table = json_backend.loads(archive["table"].tobytes())
+        except (OSError, ValueError, KeyError):
+            return
+        if matrix.ndim != 2:
+            return
+
+        # 壊れたファイルなど、行列からはみ出す項目は捨てる
+        self.table = {
+            path: entry for path, entry in table.items()
+            if entry[2] + entry[3] <= len(matrix)
+        }
+        self.matrix = matrix
+        self._build_lookup()
+
+    def _build_lookup(self):
+        """行のあるポーションを先頭行の順に並べ、reduceat 用の区切りを作る
+
+        どのポーションにも属さない行（取り除いた項目の行など）が前のポーションに混ざらないよう、
+        区切りは [先頭行, 先頭行 + 行数) の組を交互に並べたものにする。
+        """
+        entries = sorted((entry[2], entry[3], path) for path, entry in self.table.items() if entry[3])
+        self._paths = [path for start, count, path in entries]
+        self._starts = np.array([start for start, count, path in entries], dtype=np.intp)
+        self._bounds = np.array(
+            [bound for start, count, path in entries for bound in (start, start + count)], dtype=np.intp)
+
+    @property
+    def dimension(self):
+        if len(self.matrix):
+            return self.matrix.shape[1]
+        for signature, vectors in self._pending.values():
+            if len(vectors):
+                return vectors.shape[1]
+        return None
+
+    def is_current(self, filepath, stat):
+        if filepath in self._pending:
+            signature = self._pending[filepath][0]
+        else:
+            signature = self.table.get(filepath, [None, None])[:2]
+        return signature == [stat.st_mtime_ns, stat.st_size]
+
+    def add(self, filepath, stat, data):
+        """ポーションの dict から、このバージョンの encoding をベクトルにして登録する"""
+        vectors = []
+        for item in data.get("encodings", {}).get(self.version_key, {}).values():
+            vector = decode_encoding(item.get("encoding") or "")
+            if vector is not None:
+                vectors.append(vector)
+
+        dimension = self.dimension
+        if dimension is None and vectors:
+            dimension = len(vectors[0])
+        vectors = [vector for vector in vectors if len(vector) == dimension]
+        matrix = np.array(vectors, dtype=np.float16).reshape(len(vectors), dimension or 0)
+        self._pending[filepath] = ([stat.st_mtime_ns, stat.st_size], matrix)
+        self.table.pop(filepath, None)
+        self._dirty = True
+
+    def discard_except(self, filepaths, unreadable):
+        """filepaths に含まれないファイルの項目を取り除く。unreadable のフォルダのものは残す"""
+        filepaths = set(filepaths)
+        for mapping in (self.table, self._pending):
+            for path in [
+                path for path in mapping
+                if path not in filepaths and not potion_bundle.is_under(path, unreadable)
+            ]:
+                del mapping[path]
+                self._dirty = True
+
+    def rename_paths(self, pairs):
+        """名前の変更や移動に合わせて、(元のパス, 新しいパス) の組で項目を付け替える"""
+        for mapping in (self.table, self._pending):
+            entries = [(new, mapping.pop(old)) for old, new in pairs if old in mapping]
+            mapping.update(entries)
+            if entries:
+                self._dirty = True
+        self._build_lookup()
+
+    def remove_paths(self, paths):
+        """ゴミ箱に移したファイルなどの項目を取り除く。行列の行は save() で詰める"""
+        for mapping in (self.table, self._pending):
+            for path in paths:
+                if mapping.pop(path, None) is not None:
+                    self._dirty = True
+        self._build_lookup()
+
+    def save(self):
+        """登録待ちの行を取り込んだ行列を作り直して書き出す"""
+        if not self._dirty:
+            return
+        blocks = []
+        table = {}
+        row = 0
+        for path, (mtime_ns, size, start, count) in self.table.items():
+            blocks.append(self.matrix[start:start + count])
+            table[path] = [mtime_ns, size, row, count]
+            row += count
+        for path, (signature, vectors) in self._pending.items():
+            blocks.append(vectors)
+            table[path] = signature + [row, len(vectors)]
+            row += len(vectors)
+
+        dimension = self.dimension or 0
+        blocks = [block for block in blocks if len(block)]
+        self.matrix = np.concatenate(blocks) if blocks else np.zeros((0, dimension), dtype=np.float16)
+        self.table = table
+        self._pending = {}
+        self._dirty = False
+        self._build_lookup()
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, matrix=self.matrix, table=np.frombuffer(json_backend.dumps(self.table), dtype=np.uint8))
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        self.save()
+
+    def vectors(self, filepath):
+        entry = self.table.get(filepath)
+        if entry is None:
+            return None
+        return self.matrix[entry[2]:entry[2] + entry[3]]
+
+    def query_vector(self, vector, k=50, exclude=()):
+        """vector に似ているポーションを [(ファイルパス, 類似度), ...] で類似度の高い順に返す"""
+        if not self._paths or len(vector) != self.matrix.shape[1]:
+            return []
+        vector = np.asarray(vector, dtype=np.float32)
+        scores = np.empty(len(self.matrix), dtype=np.float32)
+        for i in range(0, len(self.matrix), CHUNK_ROWS):
+            scores[i:i + CHUNK_ROWS] = self.matrix[i:i + CHUNK_ROWS].astype(np.float32) @ vector
+        # 終わりの区切りが行数と同じになっても reduceat に渡せるよう、番兵を 1 つ足しておく
+        scores = np.append(scores, -np.inf)
+        best = np.maximum.reduceat(scores, self._bounds)[::2]
+
+        for path in exclude:
+            entry = self.table.get(path)
+            if entry and entry[3]:
+                best[np.searchsorted(self._starts, entry[2])] = -np.inf
+        k = min(k, len(best))
+        top = np.argpartition(-best, k - 1)[:k]
+        top = top[np.argsort(-best[top])]
+        return [(self._paths[i], float(best[i])) for i in top if np.isfinite(best[i])]
+
+    def query(self, filepath, k=50):
+        """filepath のポーションに似ているポーションを返す。索引に無ければ None"""
+        vectors = self.vectors(filepath)
+        if vectors is None or not len(vectors):
+            return None
+        vector = vectors.astype(np.float32).mean(axis=0)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+        return self.query_vector(vector / norm, k, exclude=(filepath,))
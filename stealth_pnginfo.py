@@ -0,0 +1,76 @@
+"""画素の最下位ビットに埋め込まれたメタデータ（stealth pnginfo）を読み取る
+
+NAI はテキストチャンクとは別に、アルファチャンネルの LSB にも gzip 圧縮したメタデータを埋め込んでいる。
+ビットは x を外側、y を内側にした列優先の順に並んでおり、先頭 15 バイトがシグネチャ、
+続く 32 ビットが本体のビット数、その後ろが本体になっている。
+画素を 1 つずつ Python で読むと遅いので、必要な列だけを切り出して NumPy のビット演算でまとめて取り出す。
+"""
+import gzip
+
+import numpy as np
+
+import json_backend
+
+# シグネチャ -> (使うチャンネル, gzip 圧縮されているか)
+SIGNATURES = {
+    b"stealth_pnginfo": ("alpha", False),
+    b"stealth_pngcomp": ("alpha", True),
+    b"stealth_rgbinfo": ("rgb", False),
+    b"stealth_rgbcomp": ("rgb", True),
+}
+SIGNATURE_LENGTH = 15
+HEADER_BITS = SIGNATURE_LENGTH * 8 + 32
+
+
+def _lsb_bytes(img, channels, n_bits):
+    """画像の先頭 n_bits 分の LSB を列優先で取り出し、バイト列に詰める"""
+    width, height = img.size
+    columns = min(width, -(-n_bits // (height * len(channels))))
+    pixels = np.asarray(img.crop((0, 0, columns, height)))[:, :, channels]
+    bits = pixels.transpose(1, 0, 2).reshape(-1)[:n_bits] & 1
+    return np.packbits(bits).tobytes()
+
+
+def _read(img, mode):
+    channels = [3] if mode == "alpha" else [0, 1, 2]
+    header = _lsb_bytes(img, channels, HEADER_BITS)
+    if len(header) < HEADER_BITS // 8:
+        return None
+    signature = SIGNATURES.get(header[:SIGNATURE_LENGTH])
+    if signature is None or signature[0] != mode:
+        return None
+
+    n_bits = int.from_bytes(header[SIGNATURE_LENGTH:], 'big')
+    capacity = img.width * img.height * len(channels) - HEADER_BITS
+    if n_bits <= 0 or n_bits > capacity:
+        return None
+    payload = _lsb_bytes(img, channels, HEADER_BITS + n_bits)[HEADER_BITS // 8:]
+    if signature[1]:
+        try:
+            payload = gzip.decompress(payload)
+        except (OSError, EOFError):
+            return None
+    return payload.decode('utf-8', errors='ignore')
+
+
+def read_stealth_info(img):
+    """PIL の画像から埋め込まれた文字列を返す。見つからなければ None"""
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+    if img.mode == "RGBA":
+        text = _read(img, "alpha")
+        if text is not None:
+            return text
+    return _read(img, "rgb")
+
+
+def read_stealth_metadata(img):
+    """NAI の画像に埋め込まれたメタデータを dict で返す。見つからなければ None"""
+    text = read_stealth_info(img)
+    if text is None:
+        return None
+    try:
+        metadata = json_backend.loads(text)
+    except ValueError:
+        return None
+    return metadata if isinstance(metadata, dict) else None
@@ -0,0 +1,77 @@
+"""参照強度の再計算と、キリの良い数値になる組み合わせの探索
+
+「参照強度をバランス調整」にチェックを入れて生成すると、参照強度は合計が 1 になるよう割り戻されて保存される。
+割合さえ同じなら元の入力を再現できるので、1 つを基準にほかを同じ比率で拡大・縮小すればよい。
+すべて NumPy の配列で計算し、ウィジェットには依存しない。
+"""
+import numpy as np
+
+# NAI に入力できる参照強度の刻み
+STEP = 0.01
+# これを超える参照強度や、合計がこれを下回る組み合わせはバランス調整で元の数値を再現できない
+MAX_STRENGTH = 1.0
+MIN_TOTAL = 1.0
+_EPS = 1e-9
+
+
+def rescale(strengths, index, value):
+    """strengths[index] が value になるよう、全体を同じ比率で拡大・縮小する"""
+    strengths = np.asarray(strengths, dtype=np.float64)
+    base = strengths[index]
+    if base == 0:
+        result = np.zeros_like(strengths)
+        result[index] = value
+        return result
+    return strengths * (value / base)
+
+
+def check_strengths(values):
+    """バランス調整で元の数値を再現できない理由を、PotionTabWidget.warnings のキーで返す"""
+    values = np.abs(np.asarray(values, dtype=np.float64))
+    found = []
+    if values.size and values.max() > MAX_STRENGTH + _EPS:
+        found.append("large_value")
+    if values.sum() < MIN_TOTAL - _EPS:
+        found.append("small_total")
+    return found
+
+
+def solve_round(strengths, step=STEP, limit=5):
+    """入力するとバランス調整後に strengths をできるだけ正確に再現できる、キリの良い数値の組み合わせを探す
+
+    いずれかの参照強度が step の倍数ちょうどになるような拡大率を全通り試し、
+    全体を step 単位に丸めたときに割合がどれだけずれるかを一度にまとめて求める。
+    1.0 以下・合計 1.0 以上の条件を満たすものを、ずれの小さい順に [(数値の配列, ずれ), ...] で返す。
+    ずれは割り戻した後の参照強度の差の最大値。
+    """
+    strengths = np.asarray(strengths, dtype=np.float64)
+    magnitudes = np.abs(strengths)
+    if not strengths.size or magnitudes.sum() == 0:
+        return []
+    target = strengths / magnitudes.sum()
+
+    # 拡大率の候補: 各参照強度を step, 2*step, ..., MAX_STRENGTH にする倍率
+    levels = np.arange(1, int(round(MAX_STRENGTH / step)) + 1) * step
+    nonzero = magnitudes[magnitudes > 0]
+    scales = np.unique((levels[:, np.newaxis] / nonzero[np.newaxis, :]).ravel())
+
+    units = np.rint(scales[:, np.newaxis] * strengths[np.newaxis, :] / step)
+    values = units * step
+    totals = np.abs(values).sum(axis=1)
+    valid = (
+        (np.abs(values).max(axis=1) <= MAX_STRENGTH + _EPS)
+        & (totals >= MIN_TOTAL - _EPS)
+        # 元が 0 でない参照強度を 0 に丸めてしまう組み合わせは使えない
+        & ~((units == 0) & (strengths != 0)).any(axis=1)
+    )
+    if not valid.any():
+        return []
+    units, values, totals = units[valid], values[valid], totals[valid]
+    errors = np.abs(values / totals[:, np.newaxis] - target).max(axis=1)
+
+    units, first = np.unique(units, axis=0, return_index=True)
+    values, errors = values[first], errors[first]
+    # ずれが同じなら、0.05 や 0.1 の倍数が多い（入力しやすい）ものを優先する
+    coarse = (units % 5 == 0).sum(axis=1) + (units % 10 == 0).sum(axis=1)
+    order = np.lexsort((-coarse, np.round(errors, 9)))[:limit]
+    return [(np.round(values[i], 10), float(errors[i])) for i in order]
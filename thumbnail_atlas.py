@@ -0,0 +1,153 @@
+"""表示サイズごとに縮小済みサムネイルをまとめて保存するアトラスファイル
+
+thumbs_<size>.atlas に RGBA バッファを追記していき、thumbs_<size>.json のオフセット表で
+ファイルパス -> [mtime_ns, ファイルサイズ, オフセット, 幅, 高さ] を引く。
+アトラスは mmap で開くので、サムネイルをデコードせずにそのまま QImage で包める。
+"""
+import json_backend
+import mmap
+import os
+
+import potion_bundle
+
+# 不要になった領域がこの割合を超えたら詰め直す
+COMPACT_RATIO = 0.5
+
+
+class ThumbnailAtlas:
+    def __init__(self, cache_dir, size):
+        self.size = size
+        self.data_path = os.path.join(cache_dir, f"thumbs_{size}.atlas")
+        self.table_path = os.path.join(cache_dir, f"thumbs_{size}.json")
+        self.table = {}
+        self._map = None
+        self._retired = []  # サムネイルの参照が残っていて閉じられなかった古い mmap
+        self._writer = None
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            table = json_backend.read_json(self.table_path)
+            data_size = os.path.getsize(self.data_path)
+        except (OSError, ValueError):
+            return
+
+        # 書き込み途中で終了した場合など、データ部からはみ出す項目は捨てる
+        self.table = {
+            path: entry for path, entry in table.items()
+            if entry[2] + entry[3] * entry[4] * 4 <= data_size
+        }
+        self._open_map()
+
+    def _open_map(self):
+        self._close_map()
+        if os.path.exists(self.data_path) and os.path.getsize(self.data_path):
+            with open(self.data_path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _close_map(self):
+        if self._map is not None:
+            self._retired.append(self._map)
+            self._map = None
+        self._release_retired()
+
+    def _release_retired(self):
+        """古い mmap を閉じる。lookup が返した memoryview がまだ残っているものは、次の機会まで持っておく"""
+        busy = []
+        for old_map in self._retired:
+            try:
+                old_map.close()
+            except BufferError:
+                busy.append(old_map)
+        self._retired = busy
+        return not busy
+
+    def lookup(self, filepath, stat):
+        """ファイルが変更されていなければ (幅, 高さ, RGBA の memoryview) を返す
+
+        memoryview は mmap を直接指すので、save() や close() の前に手放すこと。
+        """
+        entry = self.table.get(filepath)
+        if entry is None or entry[0] != stat.st_mtime_ns or entry[1] != stat.st_size:
+            return None
+
+        offset, width, height = entry[2:]
+        end = offset + width * height * 4
+        if self._map is None or end > len(self._map):
+            return None
+        return width, height, memoryview(self._map)[offset:end]
+
+    def add(self, filepath, stat, width, height, buffer):
+        if self._writer is None:
+            os.makedirs(os.path.dirname(self.data_path) or ".", exist_ok=True)
+            self._writer = open(self.data_path, 'ab')
+        offset = self._writer.tell()
+        self._writer.write(buffer)
+        self.table[filepath] = [stat.st_mtime_ns, stat.st_size, offset, width, height]
+        self._dirty = True
+
+    def discard_except(self, filepaths, unreadable):
+        """filepaths に含まれないファイルの項目を取り除く。unreadable のフォルダのものは残す"""
+        filepaths = set(filepaths)
+        for path in [path for path in self.table if path not in filepaths and not potion_bundle.is_under(path, unreadable)]:
+            del self.table[path]
+            self._dirty = True
+
+    def rename_paths(self, pairs):
+        """名前の変更や移動に合わせて、(元のパス, 新しいパス) の組で項目を付け替える"""
+        entries = [(new, self.table.pop(old)) for old, new in pairs if old in self.table]
+        self.table.update(entries)
+        if entries:
+            self._dirty = True
+
+    def remove_paths(self, paths):
+        """ゴミ箱に移したファイルなどの項目を取り除く"""
+        for path in paths:
+            if self.table.pop(path, None) is not None:
+                self._dirty = True
+
+    def save(self):
+        """追記分をディスクに反映し、オフセット表を書き出して開き直す"""
+        if not self._dirty:
+            return
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+        live_bytes = sum(entry[3] * entry[4] * 4 for entry in self.table.values())
+        data_size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        if data_size and data_size - live_bytes > data_size * COMPACT_RATIO:
+            self._compact()
+
+        tmp_path = self.table_path + ".tmp"
+        json_backend.write_json(tmp_path, self.table)
+        os.replace(tmp_path, self.table_path)
+        self._dirty = False
+        self._open_map()
+
+    def _compact(self):
+        tmp_path = self.data_path + ".tmp"
+        offsets = {}
+        with open(self.data_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            for path, entry in sorted(self.table.items(), key=lambda item: item[1][2]):
+                src.seek(entry[2])
+                offsets[path] = dst.tell()
+                dst.write(src.read(entry[3] * entry[4] * 4))
+        self._close_map()
+        if self._retired:
+            # 参照中のサムネイルがあって閉じられない mmap があると Windows では置き換えられないので、次回に回す
+            os.remove(tmp_path)
+            return
+        try:
+            os.replace(tmp_path, self.data_path)
+        except OSError:
+            # 他で開かれていて置き換えられない場合は、詰め直しを次回に回す
+            os.remove(tmp_path)
+            return
+        for path, offset in offsets.items():
+            self.table[path][2] = offset
+
+    def close(self):
+        self.save()
+        self._close_map()
@@ -0,0 +1,182 @@
+"""ポーションファイルの読み込みとサムネイルの縮小をプロセスプールで並列に行う
+
+Qt に依存しないため、ワーカープロセスでは PyQt6 が読み込まれない。
+遅いストレージ向けに、ファイルの読み込みを io_scheduler.ReadScheduler に任せて先読みすることもできる。
+縮小済みのサムネイルは RGBA の生バッファで返し、GUI スレッドがコピーせずに QImage で包む。
+"""
+import base64
+import binascii
+import io
+import json_backend
+import os
+import re
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from PIL import Image, UnidentifiedImageError
+
+from image_hash import image_hashes
+
+DATA_URI_PREFIX = re.compile('^data:image/.+;base64,')
+
+# これより少ないファイル数ならプロセス起動のコストの方が高くつくのでその場で処理する
+INLINE_THRESHOLD = 32
+# 先読みしたファイルをワーカープロセスに渡す単位
+PREFETCH_CHUNK_SIZE = 16
+
+
+def prescale_size(width, height, size):
+    """アスペクト比を保ったまま size x size に収まる大きさを返す"""
+    scale = size / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def open_thumbnail(b64_thumb):
+    """thumbnail の data URI をデコードして RGBA の画像を返す。画像として読めない場合は None"""
+    try:
+        image_data = base64.b64decode(DATA_URI_PREFIX.sub('', b64_thumb))
+        with Image.open(io.BytesIO(image_data)) as img:
+            return img.convert("RGBA")
+    except (binascii.Error, UnidentifiedImageError, OSError):
+        return None
+
+
+def scale_thumbnail(img, size):
+    """size x size に収まるよう縮小し、(幅, 高さ, RGBA バッファ) を返す"""
+    if size:
+        new_size = prescale_size(img.width, img.height, size)
+        if new_size != img.size:
+            img = img.resize(new_size, Image.Resampling.LANCZOS)
+    return img.width, img.height, img.tobytes()
+
+
+def load_potion(source, size, decode=True):
+    """ポーションを読み込み、必要な項目と縮小済みサムネイルを返す
+
+    source はファイルパスか、読み込み済みの (パス, ポーションの dict またはファイルのバイト列) の組。
+    戻り値は (filepath, data, thumbnail, no_thumb, error)。
+    data には encodings と importInfo だけを残し、プロセス間で受け渡す量を抑える。
+    サムネイルをデコードした場合は、縮小前の画像の (pHash, dHash) を data の imageHash に入れる。
+    thumbnail が None かつ no_thumb が False の場合はサムネイルが壊れている。
+    decode が False の場合はサムネイルをデコードせず、thumbnail は常に None になる。
+    """
+    filepath, data = source if isinstance(source, tuple) else (source, None)
+    try:
+        if data is None:
+            data = json_backend.read_json(filepath)
+        elif isinstance(data, (bytes, bytearray)):
+            data = json_backend.loads(data)
+
+        b64_thumb = data.get("thumbnail")
+        no_thumb = not b64_thumb
+        thumbnail = None
+        image_hash = None
+        if decode and not no_thumb:
+            img = open_thumbnail(b64_thumb)
+            if img is not None:
+                thumbnail = scale_thumbnail(img, size)
+                image_hash = image_hashes(img)
+        data = {key: data[key] for key in ("encodings", "importInfo") if key in data}
+        if image_hash:
+            data["imageHash"] = image_hash
+        return filepath, data, thumbnail, no_thumb, None
+    except Exception as e:
+        return filepath, None, None, False, str(e)
+
+
+def _source_path(source):
+    return source[0] if isinstance(source, tuple) else source
+
+
+def _load_chunk(sources, size, cached):
+    return [load_potion(source, size, _source_path(source) not in cached) for source in sources]
+
+
+def _prefetch(sources, scheduler):
+    """ファイルパスの source を scheduler で先読みし、(source, エラー) を入力順に返す
+
+    読めたものは (パス, バイト列) に置き換える。バンドル内のポーションは読み込み済みなのでそのまま返す。
+    """
+    reads = scheduler.read_all(_source_path(source) for source in sources if not isinstance(source, tuple))
+    for source in sources:
+        if isinstance(source, tuple):
+            yield source, None
+            continue
+        filepath, raw, error = next(reads)
+        yield ((filepath, raw), None) if error is None else (filepath, str(error) or type(error).__name__)
+
+
+class ThumbnailPipeline:
+    """load_potion をプロセスプールに振り分ける。プールは初回利用時に起動して使い回す"""
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def map(self, sources, size, cached=frozenset(), scheduler=None):
+        """各ポーションの load_potion の結果を入力順に返すイテレータ
+
+        cached に含まれるパスは縮小済みサムネイルが手元にあるものとして、デコードを省く。
+        scheduler を渡すと、ファイルはそれで先読みしてから解析する。読めなかったものはエラーとして返す。
+        """
+        sources = list(sources)
+        if scheduler is not None:
+            yield from self._map_prefetched(sources, size, cached, scheduler)
+            return
+        if self.max_workers == 1 or len(sources) < INLINE_THRESHOLD:
+            for source in sources:
+                yield load_potion(source, size, _source_path(source) not in cached)
+            return
+
+        # 1 ファイルずつ投げると受け渡しのオーバーヘッドが目立つので、ある程度まとめて渡す
+        chunk_size = max(1, min(64, len(sources) // (self.max_workers * 4)))
+        chunks = [sources[i:i + chunk_size] for i in range(0, len(sources), chunk_size)]
+        chunk_cached = [cached.intersection(map(_source_path, chunk)) for chunk in chunks]
+        executor = self._get_executor()
+        for results in executor.map(_load_chunk, chunks, [size] * len(chunks), chunk_cached):
+            yield from results
+
+    def _map_prefetched(self, sources, size, cached, scheduler):
+        prefetched = _prefetch(sources, scheduler)
+        if self.max_workers == 1 or len(sources) < INLINE_THRESHOLD:
+            for source, error in prefetched:
+                if error:
+                    yield _source_path(source), None, None, False, error
+                else:
+                    yield load_potion(source, size, _source_path(source) not in cached)
+            return
+
+        # 読み終えたものから順にワーカーへ渡す。解析待ちを溜めすぎないよう、渡したまま未回収の塊は数を絞る
+        executor = self._get_executor()
+        pending = deque()
+        chunk = []
+        for source, error in prefetched:
+            if error:
+                # 入力順を守るため、読めなかったものも完了済みの Future として先に渡した塊の後ろに並べる
+                if chunk:
+                    pending.append(executor.submit(_load_chunk, chunk, size, cached.intersection(map(_source_path, chunk))))
+                    chunk = []
+                failed = Future()
+                failed.set_result([(_source_path(source), None, None, False, error)])
+                pending.append(failed)
+            else:
+                chunk.append(source)
+            if len(chunk) >= PREFETCH_CHUNK_SIZE:
+                pending.append(executor.submit(_load_chunk, chunk, size, cached.intersection(map(_source_path, chunk))))
+                chunk = []
+            while len(pending) > self.max_workers * 2:
+                yield from pending.popleft().result()
+        if chunk:
+            pending.append(executor.submit(_load_chunk, chunk, size, cached.intersection(map(_source_path, chunk))))
+        while pending:
+            yield from pending.popleft().result()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
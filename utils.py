@@ -1,9 +1,10 @@
 from PyQt6.QtWidgets import QWidget, QLabel, QMenu, QMessageBox, QVBoxLayout
-from PyQt6.QtGui import QPixmap, QMouseEvent, QDrag
+from PyQt6.QtGui import QPixmap, QImage, QMouseEvent, QDrag
 from PyQt6.QtCore import Qt, QUrl, QMimeData
 
 import platform
 import os, subprocess
+import potion_bundle
 from datetime import datetime
 
 
@@ -14,7 +15,7 @@ def open_file_location(filepath, parent=None):
             QMessageBox.warning(parent, "エラー", f"所持していないポーションです")
             return
 
-        abs_path = os.path.abspath(filepath)
+        abs_path = os.path.abspath(potion_bundle.container_path(filepath))
         if not os.path.exists(abs_path):
             QMessageBox.warning(parent, "エラー", f"ファイルが見つかりません：{abs_path}")
             return
@@ -37,16 +38,25 @@ def open_file_location(filepath, parent=None):
         QMessageBox.critical(parent, "エラー", f"ファイルの場所を開く操作に失敗しました：{str(e)}")
 
 
+def rgba_to_qimage(width, height, buffer) -> QImage:
+    """ワーカーが返した RGBA バッファをコピーせずに QImage で包む（buffer は呼び出し側で保持すること）"""
+    return QImage(buffer, width, height, width * 4, QImage.Format.Format_RGBA8888)
+
+
 def creation_date(path_to_file):
     """
     Try to get the date that a file was created, falling back to when it was
     last modified if that isn't possible.
     See http://stackoverflow.com/a/39501288/1709587 for explanation.
     """
+    return stat_creation_date(os.stat(path_to_file))
+
+
+def stat_creation_date(stat):
+    """creation_date と同じ日付を、取得済みの os.stat の結果から求める"""
     if platform.system() == 'Windows':
-        return os.path.getctime(path_to_file)
+        return stat.st_ctime
     else:
-        stat = os.stat(path_to_file)
         try:
             return stat.st_birthtime
         except AttributeError:
@@ -63,7 +73,7 @@ class ClickableThumbnail(QLabel):
         super().__init__(parent)
 
         self.selected = False
-        self.clicked_callback = None
+        self.selection_model = None
         self.thumbnail_size = thumbnail_size
         self.fullpath = fullpath
         if mtime:
@@ -79,7 +89,7 @@ class ClickableThumbnail(QLabel):
         self.setCursor(Qt.CursorShape.PointingHandCursor)
 
     def resize_pixmap(self, pixmap):
-        if self.thumbnail_size:
+        if self.thumbnail_size and max(pixmap.width(), pixmap.height()) != self.thumbnail_size:
             pixmap = pixmap.scaled(
                 self.thumbnail_size, self.thumbnail_size,
                 Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
@@ -95,24 +105,40 @@ class ClickableThumbnail(QLabel):
     def open_in_explorer(self):
         open_file_location(self.fullpath, parent=self)
 
+    def drag_paths(self):
+        """ドラッグで渡すファイル。選択中のものがあればまとめて渡す"""
+        if self.selection_model and self.selected:
+            return [w.fullpath for w in self.selection_model.selected_widgets() if w.fullpath]
+        return [self.fullpath]
+
     def leftclick(self, event):
+        try:
+            filepaths = [potion_bundle.local_path(path) for path in self.drag_paths()]
+        except Exception as e:
+            QMessageBox.critical(self, "エラー", f"バンドルからの取り出しに失敗しました：{str(e)}")
+            return
         drag = QDrag(self)
         mime_data = QMimeData()
-        mime_data.setUrls([QUrl.fromLocalFile(self.fullpath)])
+        mime_data.setUrls([QUrl.fromLocalFile(path) for path in filepaths])
         drag.setMimeData(mime_data)
         drag.setPixmap(self.pixmap())
         drag.setHotSpot(event.position().toPoint())
-        drag.exec(Qt.DropAction.CopyAction)
+        if drag.exec(Qt.DropAction.CopyAction) == Qt.DropAction.IgnoreAction and self.selection_model:
+            # ドロップせずに離した場合は普通のクリックとして、このサムネイルだけを選択する
+            self.selection_model.select_only(self)
 
     def mousePressEvent(self, event: QMouseEvent):
-        if self.clicked_callback:
-            self.clicked_callback(self)
-        self.selected = True
-        self.update_style()
-        if event.button() == Qt.MouseButton.LeftButton and self.fullpath:
+        modifiers = event.modifiers() & (
+            Qt.KeyboardModifier.ControlModifier | Qt.KeyboardModifier.ShiftModifier)
+        if self.selection_model:
+            self.selection_model.press(self, modifiers)
+        else:
+            self.selected = True
+            self.update_style()
+        if event.button() == Qt.MouseButton.LeftButton and self.fullpath and not modifiers:
             self.leftclick(event)
         else:
-            event.accept()  # Right Click
+            event.accept()  # Right Click / 複数選択
 
     def update_style(self):
         if self.selected:
@@ -138,8 +164,8 @@ class ThumbnailWidget(QWidget):
         self.setLayout(layout)
         return layout
 
-    def set_clicked_callback(self, callback):
-        self.thumbnail.clicked_callback = callback
+    def set_selection_model(self, selection_model):
+        selection_model.add(self)
 
     @property
     def fullpath(self):
@@ -161,3 +187,86 @@ class ThumbnailWidget(QWidget):
 
     def selected(self, is_selected):
         self.thumbnail.selected = is_selected
+
+
+class SelectionModel:
+    """サムネイルの選択状態を管理する
+
+    選択状態が変わったウィジェットだけスタイルを更新するので、クリックのたびに
+    全サムネイルのスタイルシートを設定し直さずに済む。
+    Ctrl で追加・解除、Shift で範囲選択ができる。
+    """
+    def __init__(self, on_current_changed=None):
+        self.widgets = []
+        self.indices = {}  # id(ClickableThumbnail) -> index
+        self.selected = set()
+        self.current = None
+        self.anchor = None
+        self.on_current_changed = on_current_changed
+
+    def clear(self):
+        self.widgets = []
+        self.indices = {}
+        self.selected = set()
+        self.current = None
+        self.anchor = None
+
+    def add(self, widget: ThumbnailWidget):
+        self.indices[id(widget.thumbnail)] = len(self.widgets)
+        self.widgets.append(widget)
+        widget.thumbnail.selection_model = self
+
+    def selected_widgets(self):
+        return [self.widgets[i] for i in sorted(self.selected)]
+
+    def current_widget(self):
+        return None if self.current is None else self.widgets[self.current]
+
+    def press(self, thumbnail: ClickableThumbnail, modifiers):
+        index = self.indices[id(thumbnail)]
+        if modifiers & Qt.KeyboardModifier.ShiftModifier and self.anchor is not None:
+            span = set(range(min(self.anchor, index), max(self.anchor, index) + 1))
+            if modifiers & Qt.KeyboardModifier.ControlModifier:
+                span |= self.selected
+            self._apply(span)
+        elif modifiers & Qt.KeyboardModifier.ControlModifier:
+            self._apply(self.selected ^ {index})
+            self.anchor = index
+        elif index not in self.selected:
+            self._apply({index})
+            self.anchor = index
+        # 選択済みのものを修飾キー無しで押した場合は、まとめてドラッグできるよう選択を保つ
+        self._set_current(index)
+
+    def select_only(self, thumbnail: ClickableThumbnail):
+        index = self.indices[id(thumbnail)]
+        self._apply({index})
+        self.anchor = index
+        self._set_current(index)
+
+    def move(self, delta, extend=False):
+        """キー操作で選択位置を delta 個動かす。extend なら起点からの範囲を選択する"""
+        if not self.widgets:
+            return
+        if self.current is None:
+            index = 0
+        else:
+            index = min(max(self.current + delta, 0), len(self.widgets) - 1)
+        if extend and self.anchor is not None:
+            self._apply(set(range(min(self.anchor, index), max(self.anchor, index) + 1)))
+        else:
+            self._apply({index})
+            self.anchor = index
+        self._set_current(index)
+
+    def _apply(self, selected):
+        for i in self.selected ^ selected:
+            widget = self.widgets[i]
+            widget.selected(i in selected)
+            widget.update_style()
+        self.selected = selected
+
+    def _set_current(self, index):
+        self.current = index
+        if self.on_current_changed:
+            self.on_current_changed(self.widgets[index])
@@ -0,0 +1,179 @@
+"""Qt に依存しない、ポーションと生成画像の読み取り API
+
+ビューアの読み込み処理のうち Qt を使わない部分をまとめたもので、スクリプトからも QApplication 無しで使える。
+iter_potions と read_image_references はジェネレータで、1 件ずつ読んで軽いレコードを返すので、
+大きなフォルダでも一定のメモリで最後まで回せる。
+
+    import vibe_core
+    for potion in vibe_core.iter_potions(["D:/potions"], "v4.5"):
+        print(potion.name, [info for enc, info in potion.encodings])
+
+    for ref in vibe_core.read_image_references("image.png"):
+        print(ref.digest, ref.strength)
+"""
+import base64
+import binascii
+import io
+import os
+from collections import namedtuple
+
+from PIL import Image
+
+import json_backend
+import potion_bundle
+from encoding_index import VERSION_KEYS, encoding_digest, iter_encodings
+from stealth_pnginfo import read_stealth_metadata
+from thumbnail_pipeline import DATA_URI_PREFIX
+
+# path はバンドル内なら仮想パス、name は拡張子を除いたファイル名、versions は encoding を持つバージョンのキー、
+# encodings は指定したバージョンの (encoding, info_extracted) のタプル
+Potion = namedtuple("Potion", "path name versions encodings importinfo has_thumbnail")
+# 生成画像に使われた参照 1 つ分。digest は encoding_digest(encoding)
+ImageReference = namedtuple("ImageReference", "encoding digest strength")
+
+
+def version_key(version):
+    """設定の version (v4.5 など) を encodings のキー (v4-5full など) にする。キーはそのまま返す"""
+    return VERSION_KEYS.get(version, version)
+
+
+def potion_versions(data):
+    """encoding を 1 つ以上持つバージョンのキー"""
+    return tuple(key for key, encodings in data.get("encodings", {}).items() if encodings)
+
+
+def potion_encodings(data, key):
+    """バージョン key の (encoding, info_extracted) のリスト。info_extracted が数値でなければ None"""
+    return [(enc, info_extracted) for vk, enc, info_extracted in iter_encodings(data) if vk == key]
+
+
+def make_potion(path, data, key=None):
+    """ポーションの dict から Potion を作る。key が None なら encodings は空になる"""
+    return Potion(
+        path=path,
+        name=os.path.basename(path).removesuffix(".naiv4vibe"),
+        versions=potion_versions(data),
+        encodings=tuple(potion_encodings(data, key)) if key else (),
+        importinfo=data.get("importInfo") or {},
+        has_thumbnail=bool(data.get("thumbnail")),
+    )
+
+
+def iter_potions(directories, version=None, errors=None):
+    """フォルダとバンドルのポーションを 1 件ずつ読んで Potion で返す
+
+    version を指定すると、そのバージョンの encoding を持つポーションだけを返す。
+    読めなかったファイルやフォルダは errors に (パス, 例外) を追加して飛ばす。
+    """
+    key = version_key(version) if version else None
+    for filepath, source in potion_bundle.iter_sources(directories, errors):
+        if isinstance(source, tuple):
+            data = source[1]
+        else:
+            try:
+                data = json_backend.read_json(filepath)
+            except Exception as e:
+                if errors is not None:
+                    errors.append((filepath, e))
+                continue
+        potion = make_potion(filepath, data, key)
+        if key is None or potion.encodings:
+            yield potion
+
+
+def thumbnail_bytes(data):
+    """ポーションの thumbnail をデコードした画像ファイルのバイト列。無いか壊れていれば None"""
+    b64_thumb = data.get("thumbnail")
+    if not b64_thumb:
+        return None
+    try:
+        return base64.b64decode(DATA_URI_PREFIX.sub('', b64_thumb))
+    except (binascii.Error, ValueError):
+        return None
+
+
+def extract_json_from_bytes(data: bytes, marker=b'{"Comment":') -> dict:
+    # 1) JSON開始位置
+    start = data.find(marker)
+    if start == -1:
+        raise ValueError("JSON marker not found")
+
+    # 2) 波括弧の対応を数えて JSON の終端を見つける
+    i = start
+    depth = 0
+    in_string = False
+    escape = False
+
+    while i < len(data):
+        c = data[i]
+
+        if in_string:
+            if escape:
+                escape = False
+            elif c == 0x5C:  # backslash \
+                escape = True
+            elif c == 0x22:  # double quote "
+                in_string = False
+        else:
+            if c == 0x22:      # "
+                in_string = True
+            elif c == 0x7B:    # {
+                depth += 1
+            elif c == 0x7D:    # }
+                depth -= 1
+                if depth == 0:
+                    end = i + 1
+                    break
+        i += 1
+    else:
+        raise ValueError("JSON end not found")
+
+    json_bytes = data[start:end]
+
+    # 3) JSON は ASCII/UTF-8 として解釈できる想定
+    return json_backend.loads(json_bytes)
+
+
+def read_generation_info(raw: bytes) -> dict:
+    """NAI の生成画像から Comment に埋め込まれた生成パラメータを読み取る
+
+    テキストチャンクや EXIF に無い場合（再保存でチャンクが消えた画像など）は、
+    アルファチャンネルに埋め込まれたメタデータを探す。
+    """
+    img = Image.open(io.BytesIO(raw))
+    comment = None
+    if "exif" in img.info:
+        try:
+            comment = extract_json_from_bytes(img.info["exif"]).get("Comment")
+        except ValueError:
+            pass
+    else:
+        comment = img.info.get("Comment")
+    if not comment:
+        comment = (read_stealth_metadata(img) or {}).get("Comment")
+    if not comment:
+        raise ValueError("no comment")
+    return json_backend.loads(comment)
+
+
+def parse_image_references(raw):
+    """生成画像のバイト列から、使われたポーションを ImageReference で 1 つずつ返す
+
+    メタデータが無い画像では、最初の要素を取り出すときに ValueError を送出する。
+    """
+    info = read_generation_info(raw)
+    encodings = info.get("reference_image_multiple") or []
+    if not encodings:
+        return
+    strengths = info.get("reference_strength_multiple")
+    if not isinstance(strengths, list) or len(strengths) < len(encodings):
+        raise ValueError("reference strengths not found")
+    for enc, strength in zip(encodings, strengths):
+        yield ImageReference(enc, encoding_digest(enc), strength)
+
+
+def read_image_references(path):
+    """生成画像のファイルから、使われたポーションを ImageReference で 1 つずつ返す"""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    yield from parse_image_references(raw)